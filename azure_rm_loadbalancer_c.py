@@ -50,8 +50,8 @@ options:
         required: false
     name:
         description:
-            - Name of the load balancer.
-        required: true
+            - Name of the load balancer. Required unless I(drift_report) is given.
+        required: false
     state:
         description:
             - Assert the state of the load balancer. Use 'present' to create or update a load balancer and 'absent' to delete a load balancer.
@@ -176,8 +176,7 @@ options:
                 required: false
             backend_port:
                 description:
-                    - Backend port that will be exposed for the load balancer.
-                default: 80
+                    - Backend port that will be exposed for the load balancer. Default to frontend_port.
                 required: false
             idle_timeout:
                 description:
@@ -214,10 +213,13 @@ options:
             frontend_port:
                 description:
                     - Frontend port that will be exposed for the inbound nat rule. Acceptable values range from 1 to 65535.
+                    - A port range such as C(50000-50099) expands to one inbound nat rule per port, named <name>-<frontend port>.
+                    - Must not be in the I(frontend_port_range) of an inbound nat pool on the same frontend.
                 required: true
             backend_port:
                 description:
                     - Backend port that will be exposed for the inbound nat rule. Default to nat_frontend_port.
+                    - When I(frontend_port) is a range, either a single port used by every expanded rule or a range of the same length.
                 required: true
             enable_floating_ip:
                 description:
@@ -225,13 +227,71 @@ options:
                       This setting is required when using the SQL AlwaysOn Availability Groups in SQL server.
                       This setting can't be changed after you create the
                 required: false
-                default: fase
+                default: false
             idle_timeout:
                 description:
                     - Timeout for TCP idle connection in minutes. The value can be set between 4 and 30 minutes.
                       The default value is 4 minutes. This element is only used when the protocol is set to TCP.
                 default: 4
                 required: false
+    inbound_nat_pools:
+        description:
+            - Describes a list of inbound NAT pools. Azure derives one inbound NAT rule per port of the range for each
+              virtual machine scale set instance using the pool, so the pool replaces a long list of I(inbound_nat_rules).
+            - Inbound NAT rules whose frontend port is in the range of a pool on the same frontend are not compared with I(inbound_nat_rules).
+        required: false
+        suboptions:
+            name:
+                description:
+                    - Name of the inbound NAT pool.
+                required: true
+            frontend_name:
+                description:
+                    - Name of frontend ip configuraton.
+                required: true
+            protocol:
+                description:
+                    - The protocol (TCP or UDP) that the inbound nat pool will use.
+                required: false
+                choices:
+                    - Tcp
+                    - Udp
+                default: Tcp
+            frontend_port_range:
+                description:
+                    - Range of frontend ports, such as C(50000-50099).
+                required: true
+            backend_port:
+                description:
+                    - Backend port that the frontend ports of the pool are translated to.
+                required: true
+    snapshot_cache:
+        description:
+            - Fetch all load balancers of I(resource_group) with one list call and keep them, together with the resource group location,
+              in a local cache file which later tasks of the same play reuse instead of fetching the load balancer again.
+            - The cache file is dropped whenever this module changes a load balancer of the resource group, with or without this option.
+        default: false
+        required: false
+    snapshot_cache_ttl:
+        description:
+            - Time in seconds for which a snapshot cache file is reused before it is refreshed.
+        default: 60
+        required: false
+    etag_cache:
+        description:
+            - Keep the last seen state and etag of the load balancer in a local cache file and fetch the load balancer with If-None-Match.
+            - When the etag is unchanged and the load balancer matched the same parameters in an earlier run, the comparison is skipped.
+            - The cache file is dropped whenever this module changes the load balancer, with or without this option.
+        default: false
+        required: false
+    drift_report:
+        description:
+            - A list of desired load balancers of I(resource_group) to compare with the existing ones without changing anything.
+            - The existing load balancers are fetched with one list call, or taken from the snapshot cache when I(snapshot_cache) is enabled.
+            - Each item accepts I(name), I(location), I(tags), I(frontend_ip_configs), I(backend_pools), I(health_probes),
+              I(load_balancing_rules), I(inbound_nat_rules) and I(inbound_nat_pools) with the same suboptions as the module options.
+            - When given, I(name), I(state) and the other load balancer options are ignored.
+        required: false
 
 extends_documentation_fragment:
     - azure
@@ -245,6 +305,27 @@ EXAMPLES = '''
     - name: Create a load balancer configuring the frontend using internal private IP from a subnet of a different resource group.
       azure_rm_loadbalancer:
         name: myloadbalancer
+
+    - name: Expose SSH of 100 virtual machines through one ranged NAT rule and RDP of a scale set through a NAT pool
+      azure_rm_loadbalancer_c:
+        resource_group: myresourcegroup
+        name: myloadbalancer
+        frontend_ip_configs:
+          - name: frontend
+            public_ip_name: mypublicip
+        backend_pools: []
+        health_probes: []
+        load_balancing_rules: []
+        inbound_nat_rules:
+          - name: ssh
+            frontend_name: frontend
+            frontend_port: 50000-50099
+            backend_port: 22
+        inbound_nat_pools:
+          - name: rdp
+            frontend_name: frontend
+            frontend_port_range: 51000-51099
+            backend_port: 3389
 '''
 
 RETURN = '''
@@ -256,10 +337,138 @@ changed:
     description: Whether or not the resource has changed
     returned: always
     type: bool
+changes:
+    description:
+        - Keys of the child collections which are added, removed or modified compared with the existing load balancer.
+        - Inbound NAT rules are keyed by [frontend name, frontend port], other collections by name.
+    returned: when the load balancer exists
+    type: dict
+    sample: {
+        "load_balancing_rules": {"added": ["https"], "removed": [], "modified": ["http"]},
+        "inbound_nat_rules": {"added": [], "removed": [["frontend", 50001]], "modified": []}
+    }
+metrics:
+    description:
+        - Number and duration in seconds of the SDK calls made by the module, in total and per operation.
+        - Waiting for long running operations is recorded as <operation>.wait and summed up in lro_wait_seconds.
+    returned: always
+    type: dict
+    sample: {
+        "calls": 3,
+        "seconds": 31.402,
+        "lro_wait_seconds": 30.87,
+        "operations": {
+            "load_balancers.get": {"count": 1, "seconds": 0.311, "max_seconds": 0.311},
+            "load_balancers.create_or_update": {"count": 1, "seconds": 0.221, "max_seconds": 0.221},
+            "load_balancers.create_or_update.wait": {"count": 1, "seconds": 30.87, "max_seconds": 30.87}
+        }
+    }
+drift:
+    description:
+        - Drift of each load balancer of I(drift_report). Modified keys list every differing field with its desired and actual value.
+    returned: when drift_report is given
+    type: list
+    sample: [{
+        "name": "myloadbalancer",
+        "exists": true,
+        "drifted": true,
+        "location": null,
+        "tags": {"env": {"desired": "prod", "actual": "test"}},
+        "changes": {
+            "load_balancing_rules": {
+                "added": [],
+                "removed": [],
+                "modified": [{"key": "http", "fields": {"idle_timeout": {"desired": 15, "actual": 4}}}]
+            }
+        }
+    }]
 '''
 
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
 from ansible.module_utils.azure_rm_common import AzureRMModuleBase
 
+try:
+    from ansible.module_utils.azure_rm_helpers import CallMetrics, cache_file_path, read_cache_file, write_cache_file, remove_cache_file
+except ImportError:
+    # The module runs without the module_utils of this repo, e.g. dropped in the library directory of a playbook.
+    # Same helpers as module_utils/azure_rm_helpers.py, keep them in sync.
+    class CallMetrics(object):
+        # Count and time the SDK calls of a module run. summary is updated in place and returned as metrics.
+
+        def __init__(self):
+            self.summary = dict(calls=0, seconds=0.0, lro_wait_seconds=0.0, operations=dict())
+            self.lock = threading.Lock()
+
+        def call(self, operation, func, *args, **kwargs):
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(operation, time.time() - start)
+
+        def wait(self, operation, poller):
+            start = time.time()
+            try:
+                return poller.wait()
+            finally:
+                elapsed = time.time() - start
+                with self.lock:
+                    self.record_locked(operation + '.wait', elapsed)
+                    self.summary['lro_wait_seconds'] = round(self.summary['lro_wait_seconds'] + elapsed, 3)
+
+        def record(self, operation, elapsed):
+            with self.lock:
+                self.record_locked(operation, elapsed)
+
+        def record_locked(self, operation, elapsed):
+            entry = self.summary['operations'].setdefault(operation, dict(count=0, seconds=0.0, max_seconds=0.0))
+            entry['count'] += 1
+            entry['seconds'] = round(entry['seconds'] + elapsed, 3)
+            entry['max_seconds'] = round(max(entry['max_seconds'], elapsed), 3)
+            self.summary['calls'] += 1
+            self.summary['seconds'] = round(self.summary['seconds'] + elapsed, 3)
+
+    def cache_file_path(module_name, key):
+        return os.path.join(tempfile.gettempdir(), '{0}-{1}.json'.format(module_name, hashlib.sha1(key.lower().encode('utf-8')).hexdigest()))
+
+    def read_cache_file(path, ttl=None):
+        try:
+            with open(path, 'r') as f:
+                content = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if ttl is not None and time.time() - content.get('timestamp', 0) > ttl:
+            return None
+        return content
+
+    def write_cache_file(path, content):
+        tmp_path = '{0}.{1}'.format(path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as f:
+                os.chmod(tmp_path, 0o600)
+                json.dump(content, f)
+            os.rename(tmp_path, path)
+        except (IOError, OSError):
+            remove_cache_file(tmp_path)
+
+    def remove_cache_file(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+try:
+    from ansible.module_utils.azure_rm_client_pool import CLIENT_POOL, module_credentials
+except ImportError:
+    CLIENT_POOL = None
+
 try:
     from msrestazure.azure_exceptions import CloudError
     from azure.mgmt.network.models import (
@@ -291,16 +500,68 @@ class AzureRMLoadBalancer(AzureRMModuleBase):
     """Configuration class for an Azure RM load balancer resource"""
 
     def __init__(self):
+        child_options = dict(
+            frontend_ip_configs=dict(type='list', elements='dict', default=[], options=dict(
+                name=dict(type='str', required=True),
+                public_ip_name=dict(type='str'),
+                private_ip_address=dict(type='str'),
+                subnet_name=dict(type='str'),
+                resource_group=dict(type='str'),
+                vnet_name=dict(type='str')
+            )),
+            backend_pools=dict(type='list', elements='str', default=[]),
+            health_probes=dict(type='list', elements='dict', default=[], options=dict(
+                name=dict(type='str', required=True),
+                port=dict(type='int', default=80),
+                protocol=dict(type='str', default='Tcp', choices=['Tcp', 'Http']),
+                interval=dict(type='int', default=15),
+                fail_count=dict(type='int', default=3),
+                request_path=dict(type='str', default='/')
+            )),
+            load_balancing_rules=dict(type='list', elements='dict', default=[], options=dict(
+                name=dict(type='str', required=True),
+                frontend_name=dict(type='str', required=True),
+                backend_name=dict(type='str', required=True),
+                probe_name=dict(type='str', required=True),
+                protocol=dict(type='str', default='Tcp', choices=['Tcp', 'Udp']),
+                load_distribution=dict(type='str', default='Default', choices=['Default', 'SourceIP', 'SourceIPProtocol']),
+                frontend_port=dict(type='int', default=80),
+                backend_port=dict(type='int'),
+                idle_timeout=dict(type='int', default=15),
+                enable_floating_ip=dict(type='bool', default=False)
+            )),
+            inbound_nat_rules=dict(type='list', elements='dict', default=[], options=dict(
+                name=dict(type='str', required=True),
+                frontend_name=dict(type='str', required=True),
+                protocol=dict(type='str', default='Tcp', choices=['Tcp', 'Udp']),
+                frontend_port=dict(type='raw', required=True),
+                backend_port=dict(type='raw', required=True),
+                enable_floating_ip=dict(type='bool', default=False),
+                idle_timeout=dict(type='int', default=4)
+            )),
+            inbound_nat_pools=dict(type='list', elements='dict', default=[], options=dict(
+                name=dict(type='str', required=True),
+                frontend_name=dict(type='str', required=True),
+                protocol=dict(type='str', default='Tcp', choices=['Tcp', 'Udp']),
+                frontend_port_range=dict(type='str', required=True),
+                backend_port=dict(type='int', required=True)
+            ))
+        )
         self.module_args = dict(
             resource_group=dict(type='str', required=True),
-            name=dict(type='str', required=True),
+            name=dict(type='str'),
             state=dict(type='str', required=False, default='present', choices=['present', 'absent']),
             location=dict(type='str', required=False),
-            frontend_ip_configs=dict(type='list'),
-            backend_pools=dict(type='list'),
-            health_probes=dict(type='list'),
-            load_balancing_rules=dict(type='list'),
-            inbound_nat_rules=dict(type='list'),
+            snapshot_cache=dict(type='bool', default=False),
+            snapshot_cache_ttl=dict(type='int', default=60),
+            etag_cache=dict(type='bool', default=False),
+            drift_report=dict(type='list', elements='dict', options=dict(
+                name=dict(type='str', required=True),
+                location=dict(type='str'),
+                tags=dict(type='dict'),
+                **child_options
+            )),
+            **child_options
         )
 
         self.resource_group = None
@@ -312,26 +573,51 @@ class AzureRMLoadBalancer(AzureRMModuleBase):
         self.health_probes = None
         self.load_balancing_rules = None
         self.inbound_nat_rules = None
+        self.inbound_nat_pools = None
+        self.snapshot_cache = None
+        self.snapshot_cache_ttl = None
+        self.etag_cache = None
+        self.drift_report = None
         self.tags = None
 
-        self.results = dict(changed=False, state=dict())
+        self.metrics = CallMetrics()
+        self.results = dict(changed=False, state=dict(), metrics=self.metrics.summary)
 
         super(AzureRMLoadBalancer, self).__init__(
             derived_arg_spec=self.module_args,
+            required_one_of=[['name', 'drift_report']],
             supports_check_mode=True
         )
 
+    @property
+    def network_client(self):
+        """Network client from the shared client pool when it is available, with a kept alive HTTP session"""
+        base_client = super(AzureRMLoadBalancer, self)
+        if CLIENT_POOL is None:
+            return base_client.network_client
+        return CLIENT_POOL.get('network', module_credentials(self), self.subscription_id, lambda: base_client.network_client)
+
     def exec_module(self, **kwargs):
         """Main module execution method"""
         for key in list(self.module_args.keys()) + ['tags']:
             setattr(self, key, kwargs[key])
 
+        if self.drift_report:
+            self.results['drift'] = self.get_drift_report()
+            return self.results
+
         if self.state == 'absent':
             try:
-                self.network_client.load_balancers.delete(resource_group_name=self.resource_group, load_balancer_name=self.name).wait()
+                poller = self.metrics.call('load_balancers.delete', self.network_client.load_balancers.delete,
+                                           resource_group_name=self.resource_group, load_balancer_name=self.name)
+                self.metrics.wait('load_balancers.delete', poller)
                 changed = True
             except CloudError:
                 changed = False
+            if changed:
+                # the cache files may have been written by other tasks, with snapshot_cache or etag_cache enabled
+                remove_cache_file(snapshot_cache_path(self.subscription_id, self.resource_group))
+                remove_cache_file(etag_cache_path(load_balancer_id(self.subscription_id, self.resource_group, self.name)))
             self.results['changed'] = changed
             return self.results
 
@@ -344,210 +630,63 @@ class AzureRMLoadBalancer(AzureRMModuleBase):
         pip = None
         subnet = None
         load_balancer_props = dict()
+        snapshot = None
 
-        try:
-            resource_group = self.get_resource_group(self.resource_group)
-        except CloudError:
-            self.fail('resource group {0} not found'.format(self.resource_group))
-        if not self.location:
+        if self.snapshot_cache:
+            snapshot = self.get_snapshot()
+            if not self.location:
+                self.location = snapshot['location']
+        elif not self.location:
+            try:
+                resource_group = self.metrics.call('resource_groups.get', self.get_resource_group, self.resource_group)
+            except CloudError:
+                self.fail('resource group {0} not found'.format(self.resource_group))
             self.location = resource_group.location
         load_balancer_props['location'] = self.location
 
-        # CHECK INPUT AND SET DEFAULT VALUE:
-        self.frontnamelist = []
-        for front in self.frontend_ip_configs:
-            if not front.get('name') or front['name'] in self.frontnamelist:
-                self.fail('name is not provided correctly in one of frontend_ip_configs.')
-            self.frontnamelist.append(front['name'])
-            if not front.get('public_ip_name') and not (front.get('subnet_name') and front.get('vnet_name')):
-                self.fail('frontend_ip_configs error: neither public_ip_name nor the combination of subnet_name and vnet_name is provided.')
-            if not front.get('resource_group'):
-                front['resource_group'] = self.resource_group
-        self.probenamelist = []
-        for probe in self.health_probes:
-            if not probe.get('name') or probe['name'] in self.probenamelist:
-                self.fail('name is not provided correctly in one of health_probes.')
-            self.probenamelist.append(probe['name'])
-            if not probe.get('fail_count'):
-                probe['fail_count'] = 3
-            if not probe.get('interval'):
-                probe['interval'] = 15
-            if not probe.get('port'):
-                probe['port'] = 80
-            if not probe.get('protocol'):
-                probe['protocol'] = 'Tcp'
-            if not probe.get('request_path'):
-                probe['request_path'] = '/'
-        self.rulenamelist = []
-        for rule in self.load_balancing_rules:
-            if not rule.get('name') or rule['name'] in self.rulenamelist:
-                self.fail('name is not provided in one of load_balancing_rules.')
-            self.rulenamelist.append(rule['name'])
-            if not rule.get('frontend_name') or rule['frontend_name'] not in self.frontnamelist:
-                self.fail('frontend_name is not provied correctly in one of load_balancing_rules.')
-            if not rule.get('backend_name') or rule['backend_name'] not in self.backend_pools:
-                self.fail('backend_name is not provied correctly in one of load_balancing_rules.')
-            if not rule.get('probe_name') or rule['probe_name'] not in self.probenamelist:
-                self.fail('probe_name is not provied correctly in one of load_balancing_rules.')
-            if not rule.get('load_distribution'):
-                rule['load_distribution'] = 'Default'
-            if not rule.get('frontend_port'):
-                rule['frontend_port'] = 80
-            if not rule.get('backend_port'):
-                rule['backend_port'] = rule['frontend_port']
-            if not rule.get('protocol'):
-                rule['protocol'] = 'Tcp'
-            if rule.get('enable_floating_ip') in ['True', 'true', 'Yes', 'yes']:
-                rule['enable_floating_ip'] = True
-            else:
-                rule['enable_floating_ip'] = False
-            if not rule.get('idle_timeout'):
-                rule['idle_timeout'] = 15
-        self.natnamelist = []
-        for nat in self.inbound_nat_rules:
-            if not nat.get('name') or nat['name'] in self.natnamelist:
-                self.fail('name is not provided in one of inbound_nat_rules.')
-            self.natnamelist.append(nat['name'])
-            if not nat.get('frontend_name') or nat['frontend_name'] not in self.frontnamelist:
-                self.fail('frontend_name is not provided correctly in one of inbound_nat_rules.')
-            if not nat.get('frontend_port'):
-                self.fail('frontend_port is not provided in one of inbound_nat_rules.')
-            if not nat.get('backend_port'):
-                self.fail('backend_port is not provided in one of inbound_nat_rules.')
-            if not nat.get('protocol'):
-                nat['protocol'] = 'Tcp'
-            if nat.get('enable_floating_ip') in ['True', 'true', 'Yes', 'yes']:
-                nat['enable_floating_ip'] = True
-            else:
-                nat['enable_floating_ip'] = False
-            if not nat.get('idle_timeout'):
-                nat['idle_timeout'] = 4
+        # CHECK INPUT: the nested options and their defaults are validated by the argument spec.
+        spec = dict((key, getattr(self, key)) for key in LOAD_BALANCER_CHILD_OPTIONS)
+        errors = check_load_balancer_spec(spec, self.resource_group)
+        if errors:
+            self.fail(' '.join(errors))
+        self.inbound_nat_rules = spec['inbound_nat_rules']
+        spec_digest = hashlib.sha1(json.dumps([spec, self.location, self.tags, self.append_tags], sort_keys=True).encode('utf-8')).hexdigest()
 
         # handle present status
+        in_sync = False
         try:
             # before we do anything, we need to attempt to retrieve the load balancer and compare with current parameters
             self.log('Fetching load balancer {0}'.format(self.name))
-            load_balancer = self.network_client.load_balancers.get(self.resource_group, self.name)
+            cached = None
+            if snapshot is not None:
+                if self.name not in snapshot['load_balancers']:
+                    raise DiffErr('load balancer {0} is not in the snapshot of resource group {1}'.format(self.name, self.resource_group))
+                cached = snapshot['load_balancers'][self.name]
+                if cached['provisioning_state'] != 'Succeeded':
+                    # a load balancer in transition is fetched again to get its current state
+                    cached = None
+            if cached is not None:
+                results = cached
+            elif self.etag_cache:
+                results, in_sync = self.get_load_balancer_conditionally(spec_digest)
+            else:
+                load_balancer = self.metrics.call('load_balancers.get', self.network_client.load_balancers.get, self.resource_group, self.name)
+                self.check_provisioning_state(load_balancer, self.state)
+                results = load_balancer
             self.log('Load balancer {0} exists'.format(self.name))
-            self.check_provisioning_state(load_balancer, self.state)
-            results = load_balancer_to_dict(load_balancer)
-            self.log(results, pretty_print=True)
-            update_tags, load_balancer_props['tags'] = self.update_tags(results['tags'])
-            if update_tags:
-                changed = True
-            # Check difference with current status
-            # Check frontend ip configurations: subnet_id, name, public_ip_address, private_ip_address, private_ip_allocation_method.
-            param_fronts = list_to_dict(self.frontend_ip_configs, 'name')
-            results_fronts = list_to_dict(results['frontend_ip_configurations'], 'name')
-            for front in param_fronts.keys():
-                results_fronts[front].update(azureid_to_dict(results_fronts[front]['subnet']['id']))
-                if param_fronts[front].get('public_ip_name') and param_fronts[front]['public_ip_name'] != results_fronts[front]['public_ip_address']:
-                    raise DiffErr('Load balancer {0} frontend {1} parameter public_ip_name differs: {2} vs {3}'.format(
-                        self.name, front, param_fronts[front]['public_ip_name'], results_fronts[front]['public_ip_address']))
-                if param_fronts[front].get('private_ip_address'):
-                    if param_fronts[front]['private_ip_address'] != results_fronts[front]['private_ip_address'] or \
-                       results_fronts[front]['private_ip_allocation_method'] != 'Static':
-                        raise DiffErr('Load balancer {0} frontend {1} parameter private_ip_address differs: {2} vs {3}'.format(
-                            self.name, front, param_fronts[front]['private_ip_address'], results_fronts[front]['private_ip_address']))
-                else:
-                    if results_fronts[front]['private_ip_allocation_method'] != 'Dynamic':
-                        raise DiffErr('Load balancer {0} frontend {1} differs. None private ip means dynamic!'.format(self.name, front))
-                if param_fronts[front].get('subnet_name') and param_fronts[front]['subnet_name'] != results_fronts[front]['subnets']:
-                    raise DiffErr('Load balancer {0} frontend {1} parameter subnet_name differs: {2} vs {3}'.format(
-                        self.name, front, param_fronts[front]['subnet_name'], results_fronts[front]['subnets']))
-                if param_fronts[front].get('vnet_name') and param_fronts[front]['vnet_name'] != results_fronts[front]['virtualNetworks']:
-                    raise DiffErr('Load balancer {0} frontend {1} parameter vnet_name differs: {2} vs {3}'.format(
-                        self.name, front, param_fronts[front]['vnet_name'], results_fronts[front]['virtualNetworks']))
-                if param_fronts[front].get('resource_group') and param_fronts[front]['resource_group'] != results_fronts[front]['resourceGroups']:
-                    raise DiffErr('Load balancer {0} frontend {1} parameter resource_group differs: {2} vs {3}'.format(
-                        self.name, front, param_fronts[front]['resource_group'], results_fronts[front]['resourceGroups']))
-            # Check backend address pool configuration: name only, which will be used by NIC module
-            if self.backend_pools:
-                results_backs = list_to_dict(results['backend_address_pools'], 'name').keys()
-                results_backs.sort()
-                self.backend_pools.sort()
-                if results_backs[0] != self.backend_pools[0]:
-                    raise DiffErr('Load balancer {0} backend name list differs!'.format(self.name))
-
-            # Check probe configurations: port, protocol, interval, number of probes, request_path, name
-            param_probes = list_to_dict(self.health_probes, 'name')
-            results_probes = list_to_dict(results['probes'], 'name')
-            for probe in param_probes.keys():
-                if param_probes[probe].get('port') and param_probes[probe]['port'] != results_probes[probe]['port']:
-                    raise DiffErr('Load balancer {0} probe {1} parameter port differs: {2} vs {3}'.format(
-                        self.name, probe, param_probes[probe]['port'], results_probes[probe]['port']))
-                if param_probes[probe].get('protocol') and param_probes[probe]['protocol'] != results_probes[probe]['protocol']:
-                    raise DiffErr('Load balancer {0} probe {1} parameter protocal differs: {2} vs {3}'.format(
-                        self.name, probe, param_probes[probe]['protocol'], results_probes[probe]['protocol']))
-                if param_probes[probe].get('interval') and param_probes[probe]['interval'] != results_probes[probe]['interval_in_seconds']:
-                    raise DiffErr('Load balancer {0} probe {1} parameter interval differs: {2} vs {3}'.format(
-                        self.name, probe, param_probes[probe]['interval'], results_probes[probe]['interval_in_seconds']))
-                if param_probes[probe].get('fail_count') and param_probes[probe]['fail_count'] != results_probes[probe]['number_of_probes']:
-                    raise DiffErr('Load balancer {0} probe {1} fail_count differs: {2} vs {3}'.format(
-                        self.name, probe, param_probes[probe]['fail_count'], results_probes[probe]['number_of_probes']))
-                if param_probes[probe].get('protocol') == 'Http' and param_probes[probe].get('request_path') and \
-                   param_probes[probe]['request_path'] != results_probes[probe]['request_path']:
-                    raise DiffErr('Load balancer {0} probe {1} requst_path differs: {2} vs {3}'.format(
-                        self.name, probe, param_probes[probe]['request_path'], results_probes['request_path']))
-            # Check load balancing rule configurations: protocol, distribution, frontend port, backend port, idle, name
-            param_rules = list_to_dict(self.load_balancing_rules, 'name')
-            results_rules = list_to_dict(results['load_balancing_rules'], 'name')
-            for rule in param_rules.keys():
-                results_rules[rule].update(azureid_to_dict(results_rules[rule]['frontend_ip_configuration_id']))
-                results_rules[rule].update(azureid_to_dict(results_rules[rule]['probe_id']))
-                results_rules[rule].update(azureid_to_dict(results_rules[rule]['backend_address_pool_id']))
-                if param_rules[rule].get('frontend_name') and param_rules[rule]['frontend_name'] != results_rules[rule]['frontendIPConfigurations']:
-                    raise DiffErr('Load balancer {0} rule {1} frontend_name differs: {2} vs {3}!'.format(
-                        self.name, rule, param_rules[rule]['frontend_name'], results_rules[rule]['frontendIPConfigurations']))
-                if param_rules[rule].get('backend_name') and param_rules[rule]['backend_name'] != results_rules[rule]['backendAddressPools']:
-                    raise DiffErr('Load balancer {0} rule {1} backend_name differs: {2} vs {3}!'.format(
-                        self.name, rule, param_rules[rule]['backend_name'], results_rules[rule]['backendAddressPools']))
-                if param_rules[rule].get('probe_name') and param_rules[rule]['probe_name'] != results_rules[rule]['probes']:
-                    raise DiffErr('Load balancer {0} rule {1} probe_name differs: {2} vs {3}!'.format(
-                        self.name, rule, param_rules[rule]['probe_name'], results_rules[rule]['probes']))
-                if param_rules[rule].get('protocol') and param_rules[rule]['protocol'] != results_rules[rule]['protocol']:
-                    raise DiffErr('Load balancer {0} rule {1} protocol differs: {2} vs {3}!'.format(
-                        self.name, rule, param_rules[rule]['protocol'], results_rules[rule]['protocol']))
-                if param_rules[rule].get('load_distribution') and param_rules[rule]['load_distribution'] != results_rules[rule]['load_distribution']:
-                    raise DiffErr('Load balancer {0} rule {1} load_distribution differs: {2} vs {3}!'.format(
-                        self.name, rule, param_rules[rule]['load_distribution'], results_rules[rule]['load_distribution']))
-                if param_rules[rule].get('frontend_port') and param_rules[rule]['frontend_port'] != results_rules[rule]['frontend_port']:
-                    raise DiffErr('Load balancer {0} rule {1} frontend_port differs: {2} vs {3}!'.format(
-                        self.name, rule, param_rules[rule]['frontend_port'], results_rules[rule]['frontend_port']))
-                if param_rules[rule].get('backend_port') and param_rules[rule]['backend_port'] != results_rules[rule]['backend_port']:
-                    raise DiffErr('Load balancer {0} rule {1} backend_port differs: {2} vs {3}!'.format(
-                        self.name, rule, param_rules[rule]['backend_port'], results_rules[rule]['backend_port']))
-                if param_rules[rule].get('idle_timeout') and param_rules[rule]['idle_timeout'] != results_rules[rule]['idle_timeout_in_minutes']:
-                    raise DiffErr('Load balancer {0} rule {1} idle_timeout differs: {2} vs {3}!'.format(
-                        self.name, rule, param_rules[rule]['idle_timeout'], results_rules[rule]['idle_timeout_in_minutes']))
-                if param_rules[rule].get('enable_floating_ip') and param_rules[rule]['enable_floating_ip'] != results_rules[rule]['enable_floating_ip']:
-                    raise DiffErr('Load balancer {0} rule {1} enable_floating_ip differs: {2} vs {3}!'.format(
-                        self.name, rule, param_rules[rule]['enable_floating_ip'], results_rules[rule]['enable_floating_ip']))
-            # Check inbound nat rule:
-            param_nats = list_to_dict(self.inbound_nat_rules, 'name')
-            results_nats = list_to_dict(results['inbound_nat_rules'], 'name')
-            for nat in param_nats:
-                results_nats[nat].update(azureid_to_dict(results_nats[nat]['frontend_ip_configuration_id']))
-                if param_nats[nat].get('protocol') and param_nats[nat]['protocol'] != results_nats[nat]['protocol']:
-                    raise DiffErr('Load balancer {0} NAT {1} protocol differs: {2} vs {3}!'.format(
-                        self.name, nat, param_nats[nat]['protocol'], results_nats[nat]['protocol']))
-                if param_nats[nat].get('frontend_port') and param_nats[nat]['frontend_port'] != results_nats[nat]['frontend_port']:
-                    raise DiffErr('Load balancer {0} NAT {1} frontend_port differs: {2} vs {3}!'.format(
-                        self.name, nat, param_nats[nat]['frontend_port'], results_nats[nat]['frontend_port']))
-                if param_nats[nat].get('backend_port') and param_nats[nat]['backend_port'] != results_nats[nat]['backend_port']:
-                    raise DiffErr('Load balancer {0} NAT {1} backend_port differs: {2} vs {3}!'.format(
-                        self.name, nat, param_nats[nat]['backend_port'], results_nats[nat]['backend_port']))
-                if param_nats[nat].get('frontend_name') and param_nats[nat]['frontend_name'] != results_nats[nat]['frontendIPConfigurations']:
-                    raise DiffErr('Load balancer {0} NAT {1} frontend_name differs: {2} vs {3}!'.format(
-                        self.name, nat, param_nats[nat]['frontend_name'], results_nats[nat]['frontendIPConfigurations']))
-                if param_nats[nat].get('idle_timeout') and param_nats[nat]['idle_timeout'] != results_nats[nat]['idle_timeout_in_minutes']:
-                    raise DiffErr('Load balancer {0} NAT {1} idle_timeout differs: {2} vs {3}!'.format(
-                        self.name, nat, param_nats[nat]['idle_timeout'], results_nats[nat]['idle_timeout_in_minutes']))
-                # DUE TO SDK LIBRARY ERROR, enable_floating_ip is not checked.
-                # if param_nats[nat].get('enable_floating_ip') and param_nats[nat]['enable_floating_ip'] != results_nats[nat]['enable_floating_point_ip']:
-                #     raise DiffErr('Load balancer {0} NAT {1} enable_floating_ip differs: {2} vs {3}!'.format(
-                #        self.name, nat, param_nats[nat]['enable_floating_ip'], results_nats[nat]['enable_floating_point_ip']))
-
+            if in_sync:
+                self.log('Load balancer {0} is unchanged since it last matched the same parameters'.format(self.name))
+            else:
+                update_tags, load_balancer_props['tags'] = self.update_tags(field(results, 'tags'))
+                if update_tags:
+                    changed = True
+                # Check difference with current status: every child collection is compared as a dict of canonical tuples
+                self.results['changes'] = dict((section, diff_keyed(desired, current))
+                                               for section, (desired, current) in load_balancer_collections(spec, results).items())
+                for section, change in self.results['changes'].items():
+                    if change['added'] or change['removed'] or change['modified']:
+                        self.log('CHANGED: load balancer {0} {1} differ: {2}'.format(self.name, section, change))
+                        changed = True
         except (IndexError, KeyError, DiffErr) as e:
             self.log('CHANGED: {0}'.format(e))
             changed = True
@@ -557,7 +696,10 @@ class AzureRMLoadBalancer(AzureRMModuleBase):
 
         if not changed or self.check_mode:
             self.results['changed'] = changed
-            self.results['state'] = results
+            self.results['state'] = results if is_serialized(results) else load_balancer_to_dict(results)
+            if self.etag_cache and not changed and not in_sync:
+                write_cache_file(etag_cache_path(load_balancer_id(self.subscription_id, self.resource_group, self.name)),
+                                 dict(etag=self.results['state']['etag'], digest=spec_digest, state=self.results['state']))
             return self.results
 
         # From now changed==True
@@ -613,32 +755,15 @@ class AzureRMLoadBalancer(AzureRMModuleBase):
                         number_of_probes=probe['fail_count']
                     ))
 
+        sub_resources = LoadBalancerSubResources(self.subscription_id, self.resource_group, self.name)
         if self.load_balancing_rules:
             load_balancer_props['load_balancing_rules'] = []
             for rule in self.load_balancing_rules:
-                frontend_ip_config_id = frontend_ip_configuration_id(
-                    subscription_id=self.subscription_id,
-                    resource_group_name=self.resource_group,
-                    load_balancer_name=self.name,
-                    name=rule['frontend_name']
-                )
-                backend_addr_pool_id = backend_address_pool_id(
-                    subscription_id=self.subscription_id,
-                    resource_group_name=self.resource_group,
-                    load_balancer_name=self.name,
-                    name=rule['backend_name']
-                )
-                prb_id = probe_id(
-                    subscription_id=self.subscription_id,
-                    resource_group_name=self.resource_group,
-                    load_balancer_name=self.name,
-                    name=rule['probe_name']
-                )
                 load_balancer_props['load_balancing_rules'].append(LoadBalancingRule(
                     name=rule['name'],
-                    frontend_ip_configuration=SubResource(id=frontend_ip_config_id),
-                    backend_address_pool=SubResource(id=backend_addr_pool_id),
-                    probe=SubResource(id=prb_id),
+                    frontend_ip_configuration=sub_resources.frontend_ip_configuration(rule['frontend_name']),
+                    backend_address_pool=sub_resources.backend_address_pool(rule['backend_name']),
+                    probe=sub_resources.probe(rule['probe_name']),
                     protocol=rule['protocol'],
                     load_distribution=rule['load_distribution'],
                     frontend_port=rule['frontend_port'],
@@ -650,15 +775,9 @@ class AzureRMLoadBalancer(AzureRMModuleBase):
         if self.inbound_nat_rules:
             load_balancer_props['inbound_nat_rules'] = []
             for nat in self.inbound_nat_rules:
-                frontend_ip_config_id = frontend_ip_configuration_id(
-                    subscription_id=self.subscription_id,
-                    resource_group_name=self.resource_group,
-                    load_balancer_name=self.name,
-                    name=nat['frontend_name']
-                )
                 load_balancer_props['inbound_nat_rules'].append(InboundNatRule(
                     name=nat['name'],
-                    frontend_ip_configuration=SubResource(id=frontend_ip_config_id),
+                    frontend_ip_configuration=sub_resources.frontend_ip_configuration(nat['frontend_name']),
                     frontend_port=nat['frontend_port'],
                     backend_port=nat['backend_port'],
                     protocol=nat['protocol'],
@@ -666,193 +785,555 @@ class AzureRMLoadBalancer(AzureRMModuleBase):
                     idle_timeout_in_minutes=nat['idle_timeout']
                 ))
 
+        if self.inbound_nat_pools:
+            load_balancer_props['inbound_nat_pools'] = []
+            for pool in self.inbound_nat_pools:
+                load_balancer_props['inbound_nat_pools'].append(InboundNatPool(
+                    name=pool['name'],
+                    frontend_ip_configuration=sub_resources.frontend_ip_configuration(pool['frontend_name']),
+                    protocol=pool['protocol'],
+                    frontend_port_range_start=pool['frontend_port_range_start'],
+                    frontend_port_range_end=pool['frontend_port_range_end'],
+                    backend_port=pool['backend_port']
+                ))
+
+        parameters = LoadBalancer(**load_balancer_props)
         self.results['changed'] = changed
-        self.results['state'] = load_balancer_to_dict(LoadBalancer(**load_balancer_props))
+        self.results['state'] = load_balancer_to_dict(parameters)
 
         try:
-            self.network_client.load_balancers.create_or_update(
-                resource_group_name=self.resource_group,
-                load_balancer_name=self.name,
-                parameters=LoadBalancer(**load_balancer_props)
-            ).wait()
+            poller = self.metrics.call('load_balancers.create_or_update', self.network_client.load_balancers.create_or_update,
+                                       resource_group_name=self.resource_group,
+                                       load_balancer_name=self.name,
+                                       parameters=parameters)
+            self.metrics.wait('load_balancers.create_or_update', poller)
         except CloudError as err:
             self.fail('Error creating load balancer {0}'.format(err))
+        remove_cache_file(snapshot_cache_path(self.subscription_id, self.resource_group))
+        remove_cache_file(etag_cache_path(load_balancer_id(self.subscription_id, self.resource_group, self.name)))
 
         return self.results
 
+    def get_drift_report(self):
+        """Compare the desired load balancers of drift_report with the load balancers of the resource group, fetched by one list call"""
+
+        errors = []
+        for spec in self.drift_report:
+            errors.extend('load balancer {0}: {1}'.format(spec['name'], error) for error in check_load_balancer_spec(spec, self.resource_group))
+        if errors:
+            self.fail(' '.join(errors))
+
+        if self.snapshot_cache:
+            existing = self.get_snapshot()['load_balancers']
+        else:
+            self.log('Fetching load balancers of resource group {0}'.format(self.resource_group))
+            try:
+                load_balancers = self.metrics.call('load_balancers.list', lambda: list(self.network_client.load_balancers.list(self.resource_group)))
+                existing = dict((load_balancer.name, load_balancer) for load_balancer in load_balancers)
+            except CloudError as err:
+                self.fail('Error listing load balancers in resource group {0} - {1}'.format(self.resource_group, str(err)))
+        return [load_balancer_drift(spec, existing.get(spec['name'])) for spec in self.drift_report]
+
+    def get_load_balancer_conditionally(self, digest):
+        """Fetch the load balancer with If-None-Match on the etag of the cache file.
+        Return the cached serialized load balancer or the fetched one, and whether it matched the parameters of digest when it was cached."""
+
+        entry = read_cache_file(etag_cache_path(load_balancer_id(self.subscription_id, self.resource_group, self.name)))
+        if entry is None:
+            load_balancer = self.metrics.call('load_balancers.get', self.network_client.load_balancers.get, self.resource_group, self.name)
+        else:
+            try:
+                load_balancer = self.metrics.call('load_balancers.get', self.network_client.load_balancers.get, self.resource_group, self.name,
+                                                  custom_headers={'If-None-Match': entry['etag']})
+            except CloudError as err:
+                if err.status_code != 304:
+                    raise
+                load_balancer = None
+            if load_balancer is None or load_balancer.etag == entry['etag']:
+                return entry['state'], entry['digest'] == digest
+        self.check_provisioning_state(load_balancer, self.state)
+        return load_balancer, False
+
+    def get_snapshot(self):
+        """Return the snapshot of all load balancers in the resource group, refreshing the cache file when expired"""
+
+        path = snapshot_cache_path(self.subscription_id, self.resource_group)
+        snapshot = read_cache_file(path, self.snapshot_cache_ttl)
+        if snapshot is not None:
+            self.log('Using load balancer snapshot {0}'.format(path))
+            return snapshot
+
+        self.log('Fetching load balancer snapshot of resource group {0}'.format(self.resource_group))
+        try:
+            resource_group = self.metrics.call('resource_groups.get', self.get_resource_group, self.resource_group)
+        except CloudError:
+            self.fail('resource group {0} not found'.format(self.resource_group))
+        snapshot = dict(timestamp=time.time(), location=resource_group.location, load_balancers=dict())
+        try:
+            for load_balancer in self.metrics.call('load_balancers.list', lambda: list(self.network_client.load_balancers.list(self.resource_group))):
+                snapshot['load_balancers'][load_balancer.name] = load_balancer_to_dict(load_balancer)
+        except CloudError as err:
+            self.fail('Error listing load balancers in resource group {0} - {1}'.format(self.resource_group, str(err)))
+        write_cache_file(path, snapshot)
+        return snapshot
+
     def get_public_ip_address(self, name):
         """Get a reference to the public ip address resource"""
 
         self.log('Fetching public ip address {0}'.format(name))
         try:
-            public_ip = self.network_client.public_ip_addresses.get(self.resource_group, name)
+            public_ip = self.metrics.call('public_ip_addresses.get', self.network_client.public_ip_addresses.get, self.resource_group, name)
         except CloudError as err:
             self.fail('Error fetching public ip address {0} - {1}'.format(name, str(err)))
         return public_ip
 
 
+def frontend_ip_configuration_to_dict(_):
+    return dict(
+        id=_.id,
+        name=_.name,
+        etag=_.etag,
+        provisioning_state=_.provisioning_state,
+        private_ip_address=_.private_ip_address,
+        private_ip_allocation_method=_.private_ip_allocation_method,
+        subnet=dict(
+            id=_.subnet.id,
+            name=_.subnet.name,
+            address_prefix=_.subnet.address_prefix
+        ) if _.subnet else None,
+        public_ip_address=dict(
+            id=_.public_ip_address.id,
+            location=_.public_ip_address.location,
+            public_ip_allocation_method=_.public_ip_address.public_ip_allocation_method,
+            ip_address=_.public_ip_address.ip_address
+        ) if _.public_ip_address else None
+    )
+
+
+def backend_address_pool_to_dict(_):
+    return dict(
+        id=_.id,
+        name=_.name,
+        provisioning_state=_.provisioning_state,
+        etag=_.etag
+    )
+
+
+def load_balancing_rule_to_dict(_):
+    return dict(
+        id=_.id,
+        name=_.name,
+        protocol=_.protocol,
+        frontend_ip_configuration_id=_.frontend_ip_configuration.id,
+        backend_address_pool_id=_.backend_address_pool.id,
+        probe_id=_.probe.id,
+        load_distribution=_.load_distribution,
+        frontend_port=_.frontend_port,
+        backend_port=_.backend_port,
+        idle_timeout_in_minutes=_.idle_timeout_in_minutes,
+        enable_floating_ip=_.enable_floating_ip,
+        provisioning_state=_.provisioning_state,
+        etag=_.etag
+    )
+
+
+def probe_to_dict(_):
+    return dict(
+        id=_.id,
+        name=_.name,
+        protocol=_.protocol,
+        port=_.port,
+        interval_in_seconds=_.interval_in_seconds,
+        number_of_probes=_.number_of_probes,
+        request_path=_.request_path,
+        provisioning_state=_.provisioning_state
+    )
+
+
+def inbound_nat_rule_to_dict(_):
+    return dict(
+        id=_.id,
+        name=_.name,
+        frontend_ip_configuration_id=_.frontend_ip_configuration.id,
+        protocol=_.protocol,
+        frontend_port=_.frontend_port,
+        backend_port=_.backend_port,
+        idle_timeout_in_minutes=_.idle_timeout_in_minutes,
+        enable_floating_point_ip=_.enable_floating_point_ip if hasattr(_, 'enable_floating_point_ip') else None,
+        provisioning_state=_.provisioning_state,
+        etag=_.etag
+    )
+
+
+def inbound_nat_pool_to_dict(_):
+    return dict(
+        id=_.id,
+        name=_.name,
+        frontend_ip_configuration_id=_.frontend_ip_configuration.id,
+        protocol=_.protocol,
+        frontend_port_range_start=_.frontend_port_range_start,
+        frontend_port_range_end=_.frontend_port_range_end,
+        backend_port=_.backend_port,
+        provisioning_state=_.provisioning_state,
+        etag=_.etag
+    )
+
+
+def outbound_nat_rule_to_dict(_):
+    return dict(
+        id=_.id,
+        name=_.name,
+        allocated_outbound_ports=_.allocated_outbound_ports,
+        frontend_ip_configuration_id=_.frontend_ip_configuration.id,
+        backend_address_pool=_.backend_address_pool.id,
+        provisioning_state=_.provisioning_state,
+        etag=_.etag
+    )
+
+
 def load_balancer_to_dict(load_balancer):
     """Seralialize a LoadBalancer object to a dict"""
-
-    result = dict(
+    return dict(
         id=load_balancer.id,
         name=load_balancer.name,
         location=load_balancer.location,
         tags=load_balancer.tags,
         provisioning_state=load_balancer.provisioning_state,
         etag=load_balancer.etag,
-        frontend_ip_configurations=[],
-        backend_address_pools=[],
-        load_balancing_rules=[],
-        probes=[],
-        inbound_nat_rules=[],
-        inbound_nat_pools=[],
-        outbound_nat_rules=[]
+        frontend_ip_configurations=[frontend_ip_configuration_to_dict(_) for _ in load_balancer.frontend_ip_configurations or []],
+        backend_address_pools=[backend_address_pool_to_dict(_) for _ in load_balancer.backend_address_pools or []],
+        load_balancing_rules=[load_balancing_rule_to_dict(_) for _ in load_balancer.load_balancing_rules or []],
+        probes=[probe_to_dict(_) for _ in load_balancer.probes or []],
+        inbound_nat_rules=[inbound_nat_rule_to_dict(_) for _ in load_balancer.inbound_nat_rules or []],
+        inbound_nat_pools=[inbound_nat_pool_to_dict(_) for _ in load_balancer.inbound_nat_pools or []],
+        outbound_nat_rules=[outbound_nat_rule_to_dict(_) for _ in load_balancer.outbound_nat_rules or []]
     )
 
-    if load_balancer.frontend_ip_configurations:
-        result['frontend_ip_configurations'] = [dict(
-            id=_.id,
-            name=_.name,
-            etag=_.etag,
-            provisioning_state=_.provisioning_state,
-            private_ip_address=_.private_ip_address,
-            private_ip_allocation_method=_.private_ip_allocation_method,
-            subnet=dict(
-                id=_.subnet.id,
-                name=_.subnet.name,
-                address_prefix=_.subnet.address_prefix
-            ) if _.subnet else None,
-            public_ip_address=dict(
-                id=_.public_ip_address.id,
-                location=_.public_ip_address.location,
-                public_ip_allocation_method=_.public_ip_address.public_ip_allocation_method,
-                ip_address=_.public_ip_address.ip_address
-            ) if _.public_ip_address else None
-        ) for _ in load_balancer.frontend_ip_configurations]
-
-    if load_balancer.backend_address_pools:
-        result['backend_address_pools'] = [dict(
-            id=_.id,
-            name=_.name,
-            provisioning_state=_.provisioning_state,
-            etag=_.etag
-        ) for _ in load_balancer.backend_address_pools]
-
-    if load_balancer.load_balancing_rules:
-        result['load_balancing_rules'] = [dict(
-            id=_.id,
-            name=_.name,
-            protocol=_.protocol,
-            frontend_ip_configuration_id=_.frontend_ip_configuration.id,
-            backend_address_pool_id=_.backend_address_pool.id,
-            probe_id=_.probe.id,
-            load_distribution=_.load_distribution,
-            frontend_port=_.frontend_port,
-            backend_port=_.backend_port,
-            idle_timeout_in_minutes=_.idle_timeout_in_minutes,
-            enable_floating_ip=_.enable_floating_ip,
-            provisioning_state=_.provisioning_state,
-            etag=_.etag
-        ) for _ in load_balancer.load_balancing_rules]
-
-    if load_balancer.probes:
-        result['probes'] = [dict(
-            id=_.id,
-            name=_.name,
-            protocol=_.protocol,
-            port=_.port,
-            interval_in_seconds=_.interval_in_seconds,
-            number_of_probes=_.number_of_probes,
-            request_path=_.request_path,
-            provisioning_state=_.provisioning_state
-        ) for _ in load_balancer.probes]
-
-    if load_balancer.inbound_nat_rules:
-        result['inbound_nat_rules'] = [dict(
-            id=_.id,
-            name=_.name,
-            frontend_ip_configuration_id=_.frontend_ip_configuration.id,
-            protocol=_.protocol,
-            frontend_port=_.frontend_port,
-            backend_port=_.backend_port,
-            idle_timeout_in_minutes=_.idle_timeout_in_minutes,
-            enable_floating_point_ip=_.enable_floating_point_ip if hasattr(_, 'enable_floating_point_ip') else None,
-            provisioning_state=_.provisioning_state,
-            etag=_.etag
-        ) for _ in load_balancer.inbound_nat_rules]
-
-    if load_balancer.inbound_nat_pools:
-        result['inbound_nat_pools'] = [dict(
-            id=_.id,
-            name=_.name,
-            frontend_ip_configuration_id=_.frontend_ip_configuration.id,
-            protocol=_.protocol,
-            frontend_port_range_start=_.frontend_port_range_start,
-            frontend_port_range_end=_.frontend_port_range_end,
-            backend_port=_.backend_port,
-            provisioning_state=_.provisioning_state,
-            etag=_.etag
-        ) for _ in load_balancer.inbound_nat_pools]
-
-    if load_balancer.outbound_nat_rules:
-        result['outbound_nat_rules'] = [dict(
-            id=_.id,
-            name=_.name,
-            allocated_outbound_ports=_.allocated_outbound_ports,
-            frontend_ip_configuration_id=_.frontend_ip_configuration.id,
-            backend_address_pool=_.backend_address_pool.id,
-            provisioning_state=_.provisioning_state,
-            etag=_.etag
-        ) for _ in load_balancer.outbound_nat_rules]
-
-    return result
-
 
-def frontend_ip_configuration_id(subscription_id, resource_group_name, load_balancer_name, name):
-    """Generate the id for a frontend ip configuration"""
-    return '/subscriptions/{0}/resourceGroups/{1}/providers/Microsoft.Network/loadBalancers/{2}/frontendIPConfigurations/{3}'.format(
+def load_balancer_id(subscription_id, resource_group_name, load_balancer_name):
+    """Generate the id of a load balancer"""
+    return '/subscriptions/{0}/resourceGroups/{1}/providers/Microsoft.Network/loadBalancers/{2}'.format(
         subscription_id,
         resource_group_name,
-        load_balancer_name,
-        name
+        load_balancer_name
     )
 
 
-def backend_address_pool_id(subscription_id, resource_group_name, load_balancer_name, name):
-    """Generate the id for a backend address pool"""
-    return '/subscriptions/{0}/resourceGroups/{1}/providers/Microsoft.Network/loadBalancers/{2}/backendAddressPools/{3}'.format(
-        subscription_id,
-        resource_group_name,
-        load_balancer_name,
-        name
-    )
+class LoadBalancerSubResources(object):
+    """Build SubResource references to the child resources of a load balancer.
+    The load balancer id is formatted once and each reference is created once per child name."""
 
+    def __init__(self, subscription_id, resource_group_name, load_balancer_name):
+        self.prefix = load_balancer_id(subscription_id, resource_group_name, load_balancer_name) + '/'
+        self.sub_resources = dict()
 
-def probe_id(subscription_id, resource_group_name, load_balancer_name, name):
-    """Generate the id for a probe"""
-    return '/subscriptions/{0}/resourceGroups/{1}/providers/Microsoft.Network/loadBalancers/{2}/probes/{3}'.format(
-        subscription_id,
-        resource_group_name,
-        load_balancer_name,
-        name
-    )
+    def get(self, child_type, name):
+        key = (child_type, name)
+        sub_resource = self.sub_resources.get(key)
+        if sub_resource is None:
+            sub_resource = self.sub_resources[key] = SubResource(id=self.prefix + child_type + '/' + name)
+        return sub_resource
+
+    def frontend_ip_configuration(self, name):
+        return self.get('frontendIPConfigurations', name)
+
+    def backend_address_pool(self, name):
+        return self.get('backendAddressPools', name)
+
+    def probe(self, name):
+        return self.get('probes', name)
 
 
 def get_subnet(self, resource_group, vnet_name, subnet_name):
     self.log("Fetching subnet {0} in virtual network {1}".format(subnet_name, vnet_name))
     try:
-        subnet = self.network_client.subnets.get(resource_group, vnet_name, subnet_name)
+        subnet = self.metrics.call('subnets.get', self.network_client.subnets.get, resource_group, vnet_name, subnet_name)
     except Exception as exc:
         self.fail("Error: fetching subnet {0} in virtual network {1} - {2}".format(subnet_name, vnet_name, str(exc)))
     return subnet
 
 
-def list_to_dict(listin, key):
-    dictout = {}
-    for l in listin:
-        dictout[l[key]] = l
-    return dictout
+def snapshot_cache_path(subscription_id, resource_group_name):
+    """Generate the path of the snapshot cache file of a resource group"""
+    return cache_file_path('azure_rm_loadbalancer_c', 'snapshot/{0}/{1}'.format(subscription_id, resource_group_name))
+
+
+def etag_cache_path(load_balancer_id):
+    """Generate the path of the etag cache file of a load balancer"""
+    return cache_file_path('azure_rm_loadbalancer_c', load_balancer_id)
+
+
+def load_balancer_collections(spec, results):
+    """Reduce each child collection of a load balancer spec and of a load balancer, serialized or as returned by the SDK,
+    to a dict of canonical tuples. Return a (desired, current) pair of dicts per collection."""
+
+    def children(collection):
+        return field(results, collection) or []
+
+    # rules derived by Azure from an inbound nat pool are not compared with inbound_nat_rules
+    pool_ranges = [(pool['frontend_name'], pool['frontend_port_range_start'], pool['frontend_port_range_end'])
+                   for pool in spec['inbound_nat_pools']]
+    results_nats = [nat for nat in children('inbound_nat_rules')
+                    if not any(child_name(reference_id(nat, 'frontend_ip_configuration')) == name and start <= field(nat, 'frontend_port') <= end
+                               for name, start, end in pool_ranges)]
+    return dict(
+        frontend_ip_configurations=(
+            dict((_['name'], frontend_param_key(_)) for _ in spec['frontend_ip_configs']),
+            dict((field(_, 'name'), frontend_result_key(_)) for _ in children('frontend_ip_configurations'))),
+        backend_address_pools=(
+            dict((_, ()) for _ in spec['backend_pools']),
+            dict((field(_, 'name'), ()) for _ in children('backend_address_pools'))),
+        probes=(
+            dict((_['name'], probe_param_key(_)) for _ in spec['health_probes']),
+            dict((field(_, 'name'), probe_result_key(_)) for _ in children('probes'))),
+        load_balancing_rules=(
+            dict((_['name'], rule_param_key(_)) for _ in spec['load_balancing_rules']),
+            dict((field(_, 'name'), rule_result_key(_)) for _ in children('load_balancing_rules'))),
+        inbound_nat_rules=(
+            dict(((_['frontend_name'], _['frontend_port']), nat_param_key(_)) for _ in spec['inbound_nat_rules']),
+            dict(((child_name(reference_id(_, 'frontend_ip_configuration')), field(_, 'frontend_port')), nat_result_key(_)) for _ in results_nats)),
+        inbound_nat_pools=(
+            dict((_['name'], nat_pool_param_key(_)) for _ in spec['inbound_nat_pools']),
+            dict((field(_, 'name'), nat_pool_result_key(_)) for _ in children('inbound_nat_pools')))
+    )
+
+
+def load_balancer_drift(spec, results):
+    """Describe every field in which a load balancer, serialized or as returned by the SDK, drifts from a load balancer spec"""
+
+    drift = dict(name=spec['name'], exists=results is not None, drifted=True, location=None, tags=None, changes=dict())
+    if results is None:
+        return drift
+    if spec['location'] and spec['location'].replace(' ', '').lower() != field(results, 'location'):
+        drift['location'] = dict(desired=spec['location'], actual=field(results, 'location'))
+    current_tags = field(results, 'tags') or dict()
+    drift['tags'] = dict((key, dict(desired=value, actual=current_tags.get(key)))
+                         for key, value in (spec['tags'] or dict()).items() if current_tags.get(key) != value) or None
+    for section, (desired, current) in load_balancer_collections(spec, results).items():
+        drift['changes'][section] = drift_keyed(LOAD_BALANCER_FIELDS[section], desired, current)
+    drift['drifted'] = bool(drift['location'] or drift['tags'] or
+                            any(change['added'] or change['removed'] or change['modified'] for change in drift['changes'].values()))
+    return drift
+
+
+def drift_keyed(fields, desired, current):
+    """Compare two dicts of canonical tuples like diff_keyed, describing the differing fields of each modified key"""
+    changes = diff_keyed(desired, current)
+    changes['modified'] = [dict(key=key, fields=dict((field, dict(desired=value, actual=actual))
+                                                     for field, value, actual in zip(fields, desired[key], current[key]) if value != actual))
+                           for key in changes['modified']]
+    return changes
+
+
+def diff_keyed(desired, current):
+    """Compare two dicts of canonical tuples. Return the sorted added, removed and modified keys."""
+    return dict(
+        added=sorted(key for key in desired if key not in current),
+        removed=sorted(key for key in current if key not in desired),
+        modified=sorted(key for key in desired if key in current and desired[key] != current[key])
+    )
+
+
+def child_name(id):
+    """Return the name of the resource identified by an azure id"""
+    return id.rstrip('/').rsplit('/', 1)[-1]
+
+
+def lower(value):
+    return value.lower() if value else value
+
+
+def is_serialized(item):
+    """Whether a load balancer or child resource is serialized, as read from a cache file, rather than an SDK model.
+    Models which also are dicts are not serialized."""
+    return type(item) is dict
+
+
+def field(item, name):
+    """Read a field of a load balancer or of one of its child resources, serialized or as returned by the SDK"""
+    return item[name] if is_serialized(item) else getattr(item, name)
+
+
+def reference_id(item, name):
+    """Return the id of the resource referenced by the field name of a child resource, serialized or as returned by the SDK.
+    Serialized child resources hold it as name_id, or as a dict with an id."""
+    if is_serialized(item) and name + '_id' in item:
+        return item[name + '_id']
+    reference = field(item, name)
+    if not reference:
+        return None
+    return reference['id'] if isinstance(reference, dict) else reference.id
+
+
+def frontend_param_key(front):
+    if front.get('public_ip_name'):
+        return (lower(front['public_ip_name']), None, None, None, None)
+    return (None, lower(front['resource_group']), lower(front['vnet_name']), lower(front['subnet_name']), front.get('private_ip_address'))
+
+
+def frontend_result_key(front):
+    if field(front, 'public_ip_address'):
+        return (lower(child_name(reference_id(front, 'public_ip_address'))), None, None, None, None)
+    subnet = azureid_to_dict(reference_id(front, 'subnet'))
+    return (None, lower(subnet['resourceGroups']), lower(subnet['virtualNetworks']), lower(subnet['subnets']),
+            field(front, 'private_ip_address') if field(front, 'private_ip_allocation_method') == 'Static' else None)
+
+
+def probe_param_key(probe):
+    return (lower(probe['protocol']), probe['port'], probe['interval'], probe['fail_count'],
+            probe['request_path'] if lower(probe['protocol']) == 'http' else None)
+
+
+def probe_result_key(probe):
+    return (lower(field(probe, 'protocol')), field(probe, 'port'), field(probe, 'interval_in_seconds'), field(probe, 'number_of_probes'),
+            field(probe, 'request_path') if lower(field(probe, 'protocol')) == 'http' else None)
+
+
+def rule_param_key(rule):
+    return (rule['frontend_name'], rule['backend_name'], rule['probe_name'], lower(rule['protocol']), rule['load_distribution'],
+            rule['frontend_port'], rule['backend_port'], rule['idle_timeout'], bool(rule['enable_floating_ip']))
+
+
+def rule_result_key(rule):
+    return (child_name(reference_id(rule, 'frontend_ip_configuration')), child_name(reference_id(rule, 'backend_address_pool')),
+            child_name(reference_id(rule, 'probe')), lower(field(rule, 'protocol')), field(rule, 'load_distribution'), field(rule, 'frontend_port'),
+            field(rule, 'backend_port'), field(rule, 'idle_timeout_in_minutes'), bool(field(rule, 'enable_floating_ip')))
+
+
+def nat_param_key(nat):
+    # DUE TO SDK LIBRARY ERROR, enable_floating_ip is not compared.
+    return (nat['name'], lower(nat['protocol']), nat['backend_port'], nat['idle_timeout'])
+
+
+def nat_result_key(nat):
+    return (field(nat, 'name'), lower(field(nat, 'protocol')), field(nat, 'backend_port'), field(nat, 'idle_timeout_in_minutes'))
+
+
+def nat_pool_param_key(pool):
+    return (pool['frontend_name'], lower(pool['protocol']), pool['frontend_port_range_start'], pool['frontend_port_range_end'], pool['backend_port'])
+
+
+def nat_pool_result_key(pool):
+    return (child_name(reference_id(pool, 'frontend_ip_configuration')), lower(field(pool, 'protocol')), field(pool, 'frontend_port_range_start'),
+            field(pool, 'frontend_port_range_end'), field(pool, 'backend_port'))
+
+
+def check_load_balancer_spec(spec, resource_group):
+    """Check the uniqueness and the cross references of the child options of a load balancer against sets.
+    Fill in the defaults which depend on other options, expand ranged inbound nat rules and return all errors."""
+    errors = []
+    frontnames = set(front['name'] for front in spec['frontend_ip_configs'])
+    backendnames = set(spec['backend_pools'])
+    probenames = set(probe['name'] for probe in spec['health_probes'])
+    for option in ('frontend_ip_configs', 'health_probes', 'load_balancing_rules', 'inbound_nat_pools'):
+        duplicated = find_duplicates(item['name'] for item in spec[option])
+        if duplicated:
+            errors.append('{0} names are not unique: {1}.'.format(option, ', '.join(duplicated)))
+    duplicated = find_duplicates(spec['backend_pools'])
+    if duplicated:
+        errors.append('backend_pools names are not unique: {0}.'.format(', '.join(duplicated)))
+    for front in spec['frontend_ip_configs']:
+        if not front['public_ip_name'] and not (front['subnet_name'] and front['vnet_name']):
+            errors.append('frontend_ip_configs {0}: neither public_ip_name nor the combination of subnet_name and vnet_name is provided.'.format(
+                front['name']))
+        if not front['resource_group']:
+            front['resource_group'] = resource_group
+    for rule in spec['load_balancing_rules']:
+        if rule['frontend_name'] not in frontnames:
+            errors.append('load_balancing_rules {0}: frontend_name {1} is not in frontend_ip_configs.'.format(rule['name'], rule['frontend_name']))
+        if rule['backend_name'] not in backendnames:
+            errors.append('load_balancing_rules {0}: backend_name {1} is not in backend_pools.'.format(rule['name'], rule['backend_name']))
+        if rule['probe_name'] not in probenames:
+            errors.append('load_balancing_rules {0}: probe_name {1} is not in health_probes.'.format(rule['name'], rule['probe_name']))
+        if not rule['backend_port']:
+            rule['backend_port'] = rule['frontend_port']
+    for pool in spec['inbound_nat_pools']:
+        if pool['frontend_name'] not in frontnames:
+            errors.append('inbound_nat_pools {0}: frontend_name {1} is not in frontend_ip_configs.'.format(pool['name'], pool['frontend_name']))
+        frontend_ports = port_range(pool['frontend_port_range'])
+        if not frontend_ports:
+            errors.append('inbound_nat_pools {0}: frontend_port_range is not a valid port range.'.format(pool['name']))
+        else:
+            pool['frontend_port_range_start'], pool['frontend_port_range_end'] = frontend_ports
+    # a single inbound nat rule must not take a frontend port of an inbound nat pool
+    pool_ranges = [(pool['name'], pool['frontend_name'], pool['frontend_port_range_start'], pool['frontend_port_range_end'])
+                   for pool in spec['inbound_nat_pools'] if 'frontend_port_range_start' in pool]
+    nat_rules = []
+    for nat in spec['inbound_nat_rules']:
+        if nat['frontend_name'] not in frontnames:
+            errors.append('inbound_nat_rules {0}: frontend_name {1} is not in frontend_ip_configs.'.format(nat['name'], nat['frontend_name']))
+        frontend_ports = port_range(nat['frontend_port'])
+        backend_ports = port_range(nat['backend_port'])
+        if not frontend_ports or not backend_ports:
+            errors.append('inbound_nat_rules {0}: frontend_port or backend_port is not a valid port or port range.'.format(nat['name']))
+        elif backend_ports[0] != backend_ports[1] and backend_ports[1] - backend_ports[0] != frontend_ports[1] - frontend_ports[0]:
+            errors.append('inbound_nat_rules {0}: backend_port range does not match the length of the frontend_port range.'.format(nat['name']))
+        else:
+            nat_rules.extend(expand_nat_rule(nat, frontend_ports, backend_ports))
+            for name, frontend_name, start, end in pool_ranges:
+                if frontend_name == nat['frontend_name'] and frontend_ports[0] <= end and start <= frontend_ports[1]:
+                    errors.append('inbound_nat_rules {0}: frontend_port is in the frontend_port_range of inbound_nat_pools {1}.'.format(nat['name'], name))
+    spec['inbound_nat_rules'] = nat_rules
+    duplicated = find_duplicates(nat['name'] for nat in spec['inbound_nat_rules'])
+    if duplicated:
+        errors.append('inbound_nat_rules names are not unique: {0}.'.format(', '.join(duplicated)))
+    duplicated = find_duplicates('{0}:{1}'.format(nat['frontend_name'], nat['frontend_port']) for nat in spec['inbound_nat_rules'])
+    if duplicated:
+        errors.append('inbound_nat_rules frontend ports are used more than once: {0}.'.format(', '.join(duplicated)))
+    return errors
+
+
+def find_duplicates(names):
+    """Return the sorted names which occur more than once"""
+    seen = set()
+    duplicated = set()
+    for name in names:
+        if name in seen:
+            duplicated.add(name)
+        seen.add(name)
+    return sorted(duplicated)
+
+
+# names of the fields of the canonical tuples of each child collection
+LOAD_BALANCER_FIELDS = dict(
+    frontend_ip_configurations=('public_ip_name', 'resource_group', 'vnet_name', 'subnet_name', 'private_ip_address'),
+    backend_address_pools=(),
+    probes=('protocol', 'port', 'interval', 'fail_count', 'request_path'),
+    load_balancing_rules=('frontend_name', 'backend_name', 'probe_name', 'protocol', 'load_distribution', 'frontend_port', 'backend_port',
+                          'idle_timeout', 'enable_floating_ip'),
+    inbound_nat_rules=('name', 'protocol', 'backend_port', 'idle_timeout'),
+    inbound_nat_pools=('frontend_name', 'protocol', 'frontend_port_range_start', 'frontend_port_range_end', 'backend_port')
+)
+
+LOAD_BALANCER_CHILD_OPTIONS = ('frontend_ip_configs', 'backend_pools', 'health_probes', 'load_balancing_rules', 'inbound_nat_rules', 'inbound_nat_pools')
+
+
+def port_range(value):
+    """Parse a port such as 22 or a port range such as '50000-50099'. Return a (start, end) tuple, or None when invalid."""
+    start, sep, end = str(value).partition('-')
+    try:
+        start = int(start)
+        end = int(end) if sep else start
+    except ValueError:
+        return None
+    if not 1 <= start <= end <= 65535:
+        return None
+    return start, end
+
+
+def expand_nat_rule(nat, frontend_ports, backend_ports):
+    """Generate one inbound nat rule per frontend port of a ranged inbound nat rule"""
+    if frontend_ports[0] == frontend_ports[1]:
+        nat['frontend_port'], nat['backend_port'] = frontend_ports[0], backend_ports[0]
+        yield nat
+        return
+    backend_step = 0 if backend_ports[0] == backend_ports[1] else 1
+    for offset in range(frontend_ports[1] - frontend_ports[0] + 1):
+        expanded = dict(nat)
+        expanded['name'] = '{0}-{1}'.format(nat['name'], frontend_ports[0] + offset)
+        expanded['frontend_port'] = frontend_ports[0] + offset
+        expanded['backend_port'] = backend_ports[0] + offset * backend_step
+        yield expanded
 
 
 def azureid_to_dict(id):
@@ -25,11 +25,11 @@ options:
     name:
         description:
             - The name of the Traffic Manager profile.
-        required: true
+            - Required unless I(profiles) is given.
     resource_group:
         description:
             - The name of the resource group containing the Traffic Manager profile.
-        required: true
+            - Required unless every item of I(profiles) sets its own resource group.
     profile_status:
         description:
             - The status of the Traffic Manager profile.
@@ -68,7 +68,7 @@ options:
     monitor_config:
         description:
             - The endpoint monitoring settings of the Traffic Manager profile.
-        required: true
+            - Required when I(state) is present.
         suboptions:
             protocol:
                 description:
@@ -156,9 +156,19 @@ options:
                 description:
                     - The minimum number of endpoints that must be available in the child profile in order for
                       the parent profile to be considered available. Only applicable to endpoint of type 'NestedEndpoints'.
+            target_profile:
+                description:
+                    - For nestedEndpoints, the child Traffic Manager profile, as a name in the resource group of the profile
+                      or as resource_group/name, instead of its I(target_resource_id).
             geo_mapping:
                 description:
                     - The list of countries/regions mapped to this endpoint when using the 'Geographic' traffic routing method.
+                    - Codes are WORLD, the GEO- regions, ISO 3166-1 country codes, and state codes of Australia, Canada and
+                      the United States such as US-TX. They are sent as given.
+                    - The list is compared with the existing one as a set, ignoring case, codes covered by another code of the list
+                      and complete sets of states, countries or regions given instead of their parent code.
+                    - A code may not be in the mappings of two endpoints, but may be within a parent code mapped to another endpoint,
+                      e.g. US-TX and US.
 
     state:
         description:
@@ -170,6 +180,137 @@ options:
             - absent
             - present
         required: false
+    rollout:
+        description:
+            - Shift traffic progressively between endpoints of the existing Weighted profile I(name), instead of reconciling the profile.
+            - Each step updates the weight of the endpoints it changes only, after the endpoints gaining weight reach one of
+              the accepted monitor statuses. Nothing is done when the endpoints already have their target weights.
+        suboptions:
+            endpoints:
+                description:
+                    - The endpoints whose weight changes.
+                required: true
+                suboptions:
+                    name:
+                        description:
+                            - The name of the endpoint.
+                        required: true
+                    start_weight:
+                        description:
+                            - Weight set by the first step. Defaults to the current weight.
+                    target_weight:
+                        description:
+                            - Weight at the end of the rollout, from 1 to 1000.
+                        required: true
+            step:
+                description:
+                    - Maximum change of the weight of an endpoint at each step.
+                default: 10
+            interval:
+                description:
+                    - Seconds between two steps.
+                default: 60
+            monitor_status:
+                description:
+                    - Endpoint monitor statuses allowing an endpoint to gain weight.
+                default: ['Online']
+            gate_timeout:
+                description:
+                    - Seconds to wait at each step for the endpoints gaining weight to reach an accepted monitor status, before failing.
+                default: 300
+    health_report:
+        description:
+            - Report the status and monitor status of every endpoint of the listed profiles, instead of managing a profile.
+            - The profiles are fetched concurrently, at most I(max_workers) at a time. Nothing is changed.
+        suboptions:
+            name:
+                description:
+                    - The name of the Traffic Manager profile.
+                required: true
+            resource_group:
+                description:
+                    - The name of the resource group containing the Traffic Manager profile. Defaults to I(resource_group).
+    health_cache_ttl:
+        description:
+            - Time in seconds for which the endpoints of a profile read by I(health_report) are served from a local cache file,
+              so that playbooks polling the health of endpoints do not fetch the profiles every time. 0 disables the cache.
+        default: 10
+        required: false
+    teardown:
+        description:
+            - Delete the listed profiles, instead of managing a single profile, e.g. to tear down an ephemeral environment.
+            - The profiles are deleted concurrently, at most I(max_workers) at a time, then polled together until
+              all of them are gone or I(teardown_timeout) expires. The status of each profile is returned in teardown.
+        suboptions:
+            name:
+                description:
+                    - The name of the Traffic Manager profile.
+                required: true
+            resource_group:
+                description:
+                    - The name of the resource group containing the Traffic Manager profile. Defaults to I(resource_group).
+    teardown_timeout:
+        description:
+            - Seconds to wait for the profiles deleted by I(teardown) to be gone, before failing.
+        default: 300
+        required: false
+    profiles:
+        description:
+            - Reconcile many Traffic Manager profiles in one run instead of the single profile given by I(name).
+            - The profiles share one client, each resource group is listed once, and the profiles are created, updated
+              or deleted concurrently, at most I(max_workers) at a time. The endpoints of each profile are then updated sequentially.
+            - Each item takes the profile options of the module. I(resource_group) and I(tags) default to the module ones.
+            - Profiles nesting other profiles of the list through nestedEndpoints are applied in waves, nested profiles
+              before the profiles nesting them, and profiles to delete after the profiles of the list that reference them.
+              The profiles of a wave are applied concurrently. Waves after a failed one are not applied.
+        suboptions:
+            name:
+                description:
+                    - The name of the Traffic Manager profile.
+                required: true
+            resource_group:
+                description:
+                    - The name of the resource group containing the Traffic Manager profile.
+            profile_status:
+                description:
+                    - Same as the module I(profile_status).
+            traffic_routing_method:
+                description:
+                    - Same as the module I(traffic_routing_method).
+            traffic_view_enrollment_status:
+                description:
+                    - Same as the module I(traffic_view_enrollment_status).
+            dns_config:
+                description:
+                    - Same as the module I(dns_config).
+            monitor_config:
+                description:
+                    - Same as the module I(monitor_config).
+            endpoints:
+                description:
+                    - Same as the module I(endpoints).
+            tags:
+                description:
+                    - Tags of the profile.
+            state:
+                description:
+                    - Same as the module I(state).
+    max_workers:
+        description:
+            - Maximum number of concurrent requests, e.g. when only some endpoints of an existing profile need to change.
+            - When the profile level settings are unchanged, only the added, updated and removed endpoints are sent,
+              through the endpoints API, instead of the whole profile.
+            - The whole profile is sent instead when the priority or the geo_mapping of an existing endpoint changes, as
+              the endpoints would pass through a state where two of them share a priority or a region, and when an
+              endpoint request fails, so that the profile is not left half updated.
+        default: 4
+        required: false
+    prefetch:
+        description:
+            - Read the profile from a single listing of all the profiles of the resource group instead of fetching it directly.
+            - Only worth it when many profiles of the same resource group are handled in one run.
+        default: false
+        required: false
 extends_documentation_fragment:
     - azure
     - azure_tags
@@ -207,6 +348,80 @@ EXAMPLES = '''
         tags:
             project: "API Project"
 
+    - name: Reconcile the profiles of several services
+      azure_rm_trafficmanagerprofile:
+        resource_group: "telstra-rg"
+        max_workers: 8
+        profiles:
+            - name: "orders-tm"
+              traffic_routing_method: "Weighted"
+              monitor_config:
+                  path: "/health"
+              endpoints:
+                  - name: 'orders-east'
+                    type: externalEndpoints
+                    weight: 1
+                    target: orders-east.telstra.com
+            - name: "billing-tm"
+              resource_group: "billing-rg"
+              state: "absent"
+
+    - name: Deploy a nested multi-region setup, children first
+      azure_rm_trafficmanagerprofile:
+        resource_group: "telstra-rg"
+        profiles:
+            - name: "orders-global"
+              monitor_config:
+                  path: "/health"
+              endpoints:
+                  - name: 'orders-au'
+                    type: nestedEndpoints
+                    target_profile: "orders-au"
+                    min_child_endpoints: 1
+                    endpoint_location: "Australia East"
+            - name: "orders-au"
+              traffic_routing_method: "Priority"
+              monitor_config:
+                  path: "/health"
+              endpoints:
+                  - name: 'orders-au-1'
+                    type: externalEndpoints
+                    priority: 1
+                    target: orders-au-1.telstra.com
+
+    - name: Move traffic from the blue to the green endpoint, 10 points every 2 minutes
+      azure_rm_trafficmanagerprofile:
+        name: "orders-tm"
+        resource_group: "telstra-rg"
+        rollout:
+            step: 10
+            interval: 120
+            endpoints:
+                - name: 'orders-blue'
+                  target_weight: 1
+                - name: 'orders-green'
+                  start_weight: 1
+                  target_weight: 100
+
+    - name: Wait until every endpoint of the orders profiles is online
+      azure_rm_trafficmanagerprofile:
+        resource_group: "telstra-rg"
+        health_report:
+            - name: "orders-tm"
+            - name: "orders-eu-tm"
+      register: health
+      until: health.endpoint_health.rows | map(attribute='5') | reject('equalto', 'Online') | list | length == 0
+      retries: 30
+      delay: 10
+
+    - name: Tear down the profiles of a review environment
+      azure_rm_trafficmanagerprofile:
+        resource_group: "review-42-rg"
+        teardown_timeout: 120
+        teardown:
+            - name: "orders-tm"
+            - name: "billing-tm"
+
     - name: Delete a Traffic Manager Profile
       azure_rm_trafficmanagerprofile:
         name: "contoso.com"
@@ -227,10 +442,188 @@ state:
             "testing": "no"
         }
     }
+changes:
+    description:
+        - Differences between the parameters and the existing profile, also computed in check mode. Empty when nothing differs.
+        - profile maps each differing setting to its desired and current value, monitor and DNS settings as dotted keys.
+        - endpoints lists the names of the endpoints added and removed, and maps each modified endpoint to its differing settings.
+        - Values are normalized, e.g. lower case endpoint types and locations, upper case monitor protocol.
+        - Differences of geo_mapping are reported as the codes added and removed.
+    returned: when state is present
+    type: dict
+    sample: {
+        "profile": {
+            "monitor_config.port": {"desired": 443, "current": 80}
+        },
+        "endpoints": {
+            "added": ["zheng"],
+            "modified": {
+                "raymond": {"weight": {"desired": 3, "current": 1}}
+            },
+            "removed": []
+        }
+    }
+endpoint_health:
+    description:
+        - One row per endpoint of the profiles of I(health_report), with the values of the listed columns.
+        - missing lists the profiles that were not found, as resource group and name.
+    returned: when health_report is given
+    type: dict
+    sample: {
+        "columns": ["profile", "resource_group", "endpoint", "type", "endpoint_status", "endpoint_monitor_status", "weight", "priority"],
+        "rows": [
+            ["orders-tm", "telstra-rg", "orders-east", "externalEndpoints", "Enabled", "Online", 1, 1],
+            ["orders-tm", "telstra-rg", "orders-west", "externalEndpoints", "Enabled", "Degraded", 1, 2]
+        ],
+        "missing": []
+    }
+teardown:
+    description:
+        - Name, resource group and status of each profile of I(teardown).
+        - The status is deleted, absent when the profile did not exist, timeout when it still existed at the end of
+          I(teardown_timeout), or error with the error. In check mode, a profile which exists is would_delete instead of deleted.
+    returned: when teardown is given
+    type: list
+    sample: [
+        {"name": "orders-tm", "resource_group": "review-42-rg", "status": "deleted"},
+        {"name": "billing-tm", "resource_group": "review-42-rg", "status": "absent"}
+    ]
+rollout:
+    description:
+        - Weights set at each step of the rollout, for the changed endpoints only, and the number of steps applied.
+    returned: when rollout is given
+    type: dict
+    sample: {
+        "steps": [{"orders-green": 11, "orders-blue": 90}, {"orders-green": 21, "orders-blue": 80}],
+        "applied": 2
+    }
+profiles:
+    description:
+        - Result of each item of I(profiles), in the same order, with its name, resource group, changed flag,
+          changes and state as for a single profile, or the error it failed with.
+    returned: when profiles is given
+    type: list
+    sample: [
+        {
+            "name": "orders-tm",
+            "resource_group": "telstra-rg",
+            "changed": true,
+            "changes": {"profile": {}, "endpoints": {"added": [], "modified": {"orders-east": {"weight": {"desired": 1, "current": 2}}},
+                                                     "removed": []}},
+            "state": {"name": "orders-tm", "location": "global"}
+        }
+    ]
+waves:
+    description:
+        - Resource group and name of the profiles of I(profiles), grouped by the wave they were applied in.
+    returned: when profiles is given
+    type: list
+    sample: [["telstra-rg/orders-au"], ["telstra-rg/orders-global"]]
+metrics:
+    description:
+        - Number and duration in seconds of the SDK calls made by the module, in total and per operation.
+    returned: always
+    type: dict
+    sample: {
+        "calls": 2,
+        "seconds": 0.912,
+        "lro_wait_seconds": 0.0,
+        "operations": {
+            "profiles.get": {"count": 1, "seconds": 0.402, "max_seconds": 0.402},
+            "profiles.create_or_update": {"count": 1, "seconds": 0.51, "max_seconds": 0.51}
+        }
+    }
 '''
 
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+from collections import Counter
+from multiprocessing.pool import ThreadPool
+
 from ansible.module_utils.azure_rm_common import AzureRMModuleBase
 
+try:
+    from ansible.module_utils.azure_rm_helpers import CallMetrics, cache_file_path, read_cache_file, write_cache_file, remove_cache_file
+except ImportError:
+    # The module runs without the module_utils of this repo, e.g. dropped in the library directory of a playbook.
+    # Same helpers as module_utils/azure_rm_helpers.py, keep them in sync.
+    class CallMetrics(object):
+        # Count and time the SDK calls of a module run. summary is updated in place and returned as metrics.
+
+        def __init__(self):
+            self.summary = dict(calls=0, seconds=0.0, lro_wait_seconds=0.0, operations=dict())
+            self.lock = threading.Lock()
+
+        def call(self, operation, func, *args, **kwargs):
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(operation, time.time() - start)
+
+        def wait(self, operation, poller):
+            start = time.time()
+            try:
+                return poller.wait()
+            finally:
+                elapsed = time.time() - start
+                with self.lock:
+                    self.record_locked(operation + '.wait', elapsed)
+                    self.summary['lro_wait_seconds'] = round(self.summary['lro_wait_seconds'] + elapsed, 3)
+
+        def record(self, operation, elapsed):
+            with self.lock:
+                self.record_locked(operation, elapsed)
+
+        def record_locked(self, operation, elapsed):
+            entry = self.summary['operations'].setdefault(operation, dict(count=0, seconds=0.0, max_seconds=0.0))
+            entry['count'] += 1
+            entry['seconds'] = round(entry['seconds'] + elapsed, 3)
+            entry['max_seconds'] = round(max(entry['max_seconds'], elapsed), 3)
+            self.summary['calls'] += 1
+            self.summary['seconds'] = round(self.summary['seconds'] + elapsed, 3)
+
+    def cache_file_path(module_name, key):
+        return os.path.join(tempfile.gettempdir(), '{0}-{1}.json'.format(module_name, hashlib.sha1(key.lower().encode('utf-8')).hexdigest()))
+
+    def read_cache_file(path, ttl=None):
+        try:
+            with open(path, 'r') as f:
+                content = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if ttl is not None and time.time() - content.get('timestamp', 0) > ttl:
+            return None
+        return content
+
+    def write_cache_file(path, content):
+        tmp_path = '{0}.{1}'.format(path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as f:
+                os.chmod(tmp_path, 0o600)
+                json.dump(content, f)
+            os.rename(tmp_path, path)
+        except (IOError, OSError):
+            remove_cache_file(tmp_path)
+
+    def remove_cache_file(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+try:
+    from ansible.module_utils.azure_rm_client_pool import CLIENT_POOL, module_credentials
+except ImportError:
+    CLIENT_POOL = None
+
 try:
     from msrestazure.azure_exceptions import CloudError
     from azure.mgmt.trafficmanager.models import DnsConfig, Profile, MonitorConfig, Endpoint
@@ -239,13 +632,16 @@ except ImportError:
     pass
 
 
+class TrafficManagerError(Exception):
+    # Failure in a worker thread, reported to the main thread instead of exiting the module from the thread
+    pass
+
+
 class AzureRMTrafficManager(AzureRMModuleBase):
     # Main Traffic Manager class
 
     def __init__(self):
-        self.module_arg_spec = dict(
-            name=dict(type='str', required=True),
-            resource_group=dict(type='str', required=True),
+        profile_options = dict(
             profile_status=dict(type='str', default='Enabled', choices=['Enabled', 'Disabled']),
             traffic_routing_method=dict(type='str', default='Performance', choices=['Performance', 'Priority', 'Weighted', 'Geographic']),
             traffic_view_enrollment_status=dict(type='str', default='Disabled', choices=['Disabled', 'Enabled']),
@@ -254,7 +650,7 @@ class AzureRMTrafficManager(AzureRMModuleBase):
                 relative_name=dict(type='str', required=False),
                 ttl=dict(type='int', default=60)
             )),
-            monitor_config=dict(type='dict', required=True, options=dict(
+            monitor_config=dict(type='dict', options=dict(
                 protocol=dict(type='str', default='HTTP', choices=['Http', 'Https', 'Tcp', 'HTTP', 'HTTPS', 'TCP']),
                 port=dict(type='int', default=80),
                 path=dict(type='str', default='/'),
@@ -272,8 +668,41 @@ class AzureRMTrafficManager(AzureRMModuleBase):
                 endpoint_location=dict(type='str'),
                 endpoint_status=dict(type='str', default='Enabled'),
                 min_child_endpoints=dict(type='int'),
-                geo_mapping=dict(type='list'))
+                geo_mapping=dict(type='list'),
+                target_profile=dict(type='str'))
             ))
+        self.module_arg_spec = dict(
+            name=dict(type='str'),
+            resource_group=dict(type='str'),
+            prefetch=dict(type='bool', default=False),
+            max_workers=dict(type='int', default=4),
+            rollout=dict(type='dict', options=dict(
+                endpoints=dict(type='list', elements='dict', required=True, options=dict(
+                    name=dict(type='str', required=True),
+                    start_weight=dict(type='int'),
+                    target_weight=dict(type='int', required=True)
+                )),
+                step=dict(type='int', default=10),
+                interval=dict(type='int', default=60),
+                monitor_status=dict(type='list', default=['Online']),
+                gate_timeout=dict(type='int', default=300)
+            )),
+            health_report=dict(type='list', elements='dict', options=dict(
+                name=dict(type='str', required=True),
+                resource_group=dict(type='str')
+            )),
+            health_cache_ttl=dict(type='int', default=10),
+            teardown=dict(type='list', elements='dict', options=dict(
+                name=dict(type='str', required=True),
+                resource_group=dict(type='str')
+            )),
+            teardown_timeout=dict(type='int', default=300),
+            profiles=dict(type='list', elements='dict', options=dict(
+                name=dict(type='str', required=True),
+                resource_group=dict(type='str'),
+                tags=dict(type='dict'),
+                **profile_options)),
+            **profile_options)
         self.name = None
         self.resource_group = None
         self.profile_status = None
@@ -284,162 +713,743 @@ class AzureRMTrafficManager(AzureRMModuleBase):
         self.endpoints = None
         self.tags = None
         self.state = None
+        self.prefetch = None
+        self.max_workers = None
+        self.profiles = None
+        self.rollout = None
+        self.health_report = None
+        self.health_cache_ttl = None
+        self.teardown = None
+        self.teardown_timeout = None
+        self.prefetched = dict()
+        self.main_thread = threading.current_thread()
+        self._trafficmanager_client = None
+        self.client_lock = threading.Lock()
+        self.metrics = CallMetrics()
         self.results = dict(
             changed=False,
-            state=dict())
+            state=dict(),
+            metrics=self.metrics.summary)
 
-        super(AzureRMTrafficManager, self).__init__(self.module_arg_spec, supports_check_mode=True)
+        super(AzureRMTrafficManager, self).__init__(self.module_arg_spec, supports_check_mode=True,
+                                                    required_one_of=[['name', 'profiles', 'health_report', 'teardown']],
+                                                    mutually_exclusive=[['name', 'profiles', 'health_report', 'teardown'],
+                                                                        ['rollout', 'profiles', 'health_report', 'teardown']])
 
     def exec_module(self, **kwargs):
         # Collect all the parameters and add them to the attributes
         for key in list(self.module_arg_spec.keys()) + ['tags']:
             setattr(self, key, kwargs[key])
 
-        # Set default parameters
-        if self.dns_config.get('relative_name') is None:
-            self.dns_config['relative_name'] = self.name
-        for end in self.endpoints:
-            if end.get('type'):
-                end['type'] = 'Microsoft.Network/trafficManagerProfiles/' + end['type']
-        self.monitor_config['protocol'] = self.monitor_config['protocol'].upper()
-
         self.results['check_mode'] = self.check_mode
-        # Initialize the Ansible return
-        results = dict(resource_group=self.resource_group)
-        changed = False
+        if self.profiles:
+            return self.exec_batch()
+        if self.rollout:
+            return self.exec_rollout()
+        if self.health_report:
+            return self.exec_health_report()
+        if self.teardown:
+            return self.exec_teardown()
 
-        # Get the existing Traffic Manager
-        existing_traffic_manager = self.get_traffic_manager_profile(self.resource_group, self.name)
-        if not self.check_mode:
-            if self.state == 'present' and self.is_different(existing_traffic_manager):
-                traffic_manager_as_dict = self.create_or_update_traffic_manager_profile(bool(existing_traffic_manager))
-                results.update(traffic_manager_as_dict)
-                changed = True
-            elif self.state == 'absent' and bool(existing_traffic_manager):
-                # Deletes the Traffic Manager and set change variable
-                self.remove_traffic_manager_profile()
-                changed = True
+        changed, changes, state = self.reconcile(self.profile_spec(kwargs), self.max_workers)
+        if changes is not None:
+            self.results['changes'] = changes
         self.results['changed'] = changed
-        self.results['state'] = results
+        self.results['state'] = state
         return self.results
 
-    def get_traffic_manager_profile(self, resource_group, name):
+    def exec_batch(self):
         '''
-        Fetch a Traffic Manager profile. Return Traffic Manager object.
+        Reconcile every profile of profiles, concurrently, after listing each of their resource groups once.
         '''
+        specs = [self.profile_spec(item) for item in self.profiles]
+        keys = Counter((spec['resource_group'].lower(), spec['name'].lower()) for spec in specs)
+        duplicates = sorted('{0}/{1}'.format(*key) for key, count in keys.items() if count > 1)
+        if duplicates:
+            self.fail('Traffic Manager profiles listed more than once: {0}'.format(', '.join(duplicates)))
+
+        # One listing per resource group serves the lookups of all its profiles
+        self.prefetch = True
+        resource_groups = list(dict((spec['resource_group'].lower(), spec['resource_group']) for spec in specs).values())
+        errors = [str(error) for resource_group, result, error
+                  in run_concurrently(self.prefetch_traffic_manager_profiles, resource_groups, self.max_workers) if error]
+        if errors:
+            self.fail('; '.join(errors))
+
+        # Profiles nesting others are applied in waves, each wave only depending on the previous ones.
+        # The endpoints of each profile are updated sequentially, max_workers bounds the profiles handled at once
+        waves = self.profile_waves(specs)
+        self.results['waves'] = [['{0}/{1}'.format(spec['resource_group'], spec['name']) for spec in wave] for wave in waves]
+        entries = dict()
+        errors = []
+        for wave in waves:
+            if errors:
+                for spec in wave:
+                    entries[id(spec)] = dict(name=spec['name'], resource_group=spec['resource_group'], changed=False,
+                                             error='not applied, an earlier wave failed')
+                continue
+            for spec, result, error in run_concurrently(lambda spec: self.reconcile(spec, 1), wave, self.max_workers):
+                entry = dict(name=spec['name'], resource_group=spec['resource_group'], changed=False)
+                if error:
+                    entry['error'] = str(error)
+                    errors.append('{0}: {1}'.format(spec['name'], str(error)))
+                else:
+                    entry['changed'], changes, entry['state'] = result
+                    if changes is not None:
+                        entry['changes'] = changes
+                entries[id(spec)] = entry
+        profiles = [entries[id(spec)] for spec in specs]
+        self.results['profiles'] = profiles
+        self.results['changed'] = any(entry['changed'] for entry in profiles)
+        if errors:
+            self.fail('Error reconciling Traffic Manager profiles. {0}'.format('; '.join(errors)), **self.results)
+        return self.results
+
+    def profile_waves(self, specs):
+        '''
+        Order the profiles of a batch by their nesting. A profile nesting another one of the batch comes after it, unless
+        the nested one is deleted: a profile to delete comes after the profiles of the batch that reference it now.
+        Return the list of waves, each a list of profiles independent of each other.
+        '''
+        by_key = dict(((spec['resource_group'].lower(), spec['name'].lower()), spec) for spec in specs)
+        before = dict((key, set()) for key in by_key)
+        for key, spec in by_key.items():
+            existing = self.prefetched.get(key[0], dict()).get(key[1])
+            referenced = set(nested_profile_keys(spec['endpoints'] or [] if spec['state'] == 'present' else []))
+            referenced.update(nested_profile_keys([end.as_dict() for end in existing.endpoints or []] if existing else []))
+            for child in referenced & set(by_key):
+                if child == key:
+                    continue
+                if by_key[child]['state'] == 'absent':
+                    before[child].add(key)
+                elif spec['state'] == 'present':
+                    before[key].add(child)
+
+        waves = []
+        done = set()
+        while len(done) < len(by_key):
+            wave = sorted(key for key in by_key if key not in done and before[key] <= done)
+            if not wave:
+                self.fail('Traffic Manager profiles nest each other in a cycle: {0}'.format(
+                    ', '.join(sorted('{0}/{1}'.format(*key) for key in by_key if key not in done))))
+            waves.append([by_key[key] for key in wave])
+            done.update(wave)
+        return waves
+
+    def exec_rollout(self):
+        '''
+        Shift the weights of some endpoints of a profile towards their targets, step by step.
+        Each step only updates the weight of the endpoints it changes, once the endpoints gaining weight are healthy.
+        '''
+        if not self.resource_group:
+            self.fail('Traffic Manager {0}: resource_group is required'.format(self.name))
+        existing_traffic_manager = self.get_traffic_manager_profile(self.resource_group, self.name)
+        if not existing_traffic_manager:
+            self.fail('Traffic Manager {0} not found in resource group {1}'.format(self.name, self.resource_group))
+        if existing_traffic_manager.traffic_routing_method != 'Weighted':
+            self.fail('Traffic Manager {0} uses the {1} traffic routing method, a rollout needs Weighted'.format(
+                self.name, existing_traffic_manager.traffic_routing_method))
+
+        existing = dict((end.name, end) for end in existing_traffic_manager.endpoints or [])
+        missing = [end['name'] for end in self.rollout['endpoints'] if end['name'] not in existing]
+        if missing:
+            self.fail('Traffic Manager {0} has no endpoints named {1}'.format(self.name, ', '.join(missing)))
+        weights = [end[key] for end in self.rollout['endpoints'] for key in ('start_weight', 'target_weight') if end[key] is not None]
+        if any(weight < 1 or weight > 1000 for weight in weights) or self.rollout['step'] < 1:
+            self.fail('Rollout weights must be between 1 and 1000, and step at least 1')
+
+        steps = rollout_steps(dict((name, end.weight) for name, end in existing.items()),
+                              dict((end['name'], end['start_weight']) for end in self.rollout['endpoints'] if end['start_weight'] is not None),
+                              dict((end['name'], end['target_weight']) for end in self.rollout['endpoints']),
+                              self.rollout['step'])
+        self.results['rollout'] = dict(steps=steps, applied=0)
+        self.results['changed'] = bool(steps)
+        if self.check_mode or not steps:
+            self.results['state'] = existing_traffic_manager.as_dict()
+            return self.results
+
+        endpoints = self.trafficmanager_client.endpoints
+        profile = existing_traffic_manager
+        for index, step in enumerate(steps):
+            if index:
+                time.sleep(self.rollout['interval'])
+            previous = dict((end.name, end.weight) for end in profile.endpoints or [])
+            profile = self.wait_for_monitor_status(profile, [name for name, weight in step.items() if weight > (previous.get(name) or 0)])
+
+            def update(name):
+                return self.metrics.call('endpoints.update', endpoints.update, self.resource_group, self.name,
+                                         endpoint_type(existing[name].type), name, Endpoint(weight=step[name]))
+
+            errors = ['{0}: {1}'.format(name, str(error)) for name, result, error
+                      in run_concurrently(update, sorted(step), self.max_workers) if error]
+            if errors:
+                self.fail('Error updating the weights of Traffic Manager {0} at rollout step {1}. {2}'.format(
+                    self.name, index + 1, '; '.join(errors)), **self.results)
+            self.results['rollout']['applied'] = index + 1
+            for end in profile.endpoints or []:
+                if end.name in step:
+                    end.weight = step[end.name]
+        self.results['state'] = self.get_traffic_manager_profile(self.resource_group, self.name, refresh=True).as_dict()
+        return self.results
+
+    def exec_health_report(self):
+        '''
+        Report the status of every endpoint of the profiles of health_report, fetching the profiles concurrently.
+        Rows read within health_cache_ttl seconds are served from a local cache file.
+        '''
+        items = self.profile_names(self.health_report)
+
+        def fetch(item):
+            path = cache_file_path('azure_rm_trafficmanagerprofile', 'health/{0}/{1}/{2}'.format(self.subscription_id, *item))
+            entry = read_cache_file(path, self.health_cache_ttl) if self.health_cache_ttl > 0 else None
+            if entry is None:
+                profile = self.get_traffic_manager_profile(*item)
+                entry = dict(timestamp=time.time(), found=profile is not None,
+                             rows=[[item[1], item[0], end.name, endpoint_type(end.type), end.endpoint_status,
+                                    end.endpoint_monitor_status, end.weight, end.priority]
+                                   for end in (profile.endpoints or [] if profile else [])])
+                if self.health_cache_ttl > 0:
+                    write_cache_file(path, entry)
+            return entry
+
+        rows = []
+        missing = []
+        errors = []
+        for item, entry, error in run_concurrently(fetch, items, self.max_workers):
+            if error:
+                errors.append('{0}: {1}'.format(item[1], str(error)))
+            elif not entry['found']:
+                missing.append('{0}/{1}'.format(*item))
+            else:
+                rows.extend(entry['rows'])
+        if errors:
+            self.fail('Error reading Traffic Manager profiles. {0}'.format('; '.join(errors)))
+        self.results['endpoint_health'] = dict(columns=ENDPOINT_HEALTH_COLUMNS, rows=rows, missing=missing)
+        return self.results
+
+    def exec_teardown(self):
+        '''
+        Delete the profiles of teardown concurrently, then check in one polling loop that all of them are gone.
+        '''
+        items = self.profile_names(self.teardown)
+        status = dict()
+        errors = []
+        if self.check_mode:
+            for item, profile, error in run_concurrently(lambda item: self.get_traffic_manager_profile(*item), items, self.max_workers):
+                status[item] = dict(status='error', error=str(error)) if error else dict(status='would_delete' if profile else 'absent')
+        else:
+            for item, deleted, error in run_concurrently(
+                    lambda item: self.remove_traffic_manager_profile(dict(resource_group=item[0], name=item[1])), items, self.max_workers):
+                status[item] = dict(status='error', error=str(error)) if error else dict(status='deleting' if deleted else 'absent')
+
+            # A single loop polls the profiles still being deleted, until they are all gone or the timeout expires
+            deadline = time.time() + self.teardown_timeout
+            pending = [item for item in items if status[item]['status'] == 'deleting']
+            while pending:
+                for item, profile, error in run_concurrently(lambda item: self.get_traffic_manager_profile(*item, refresh=True),
+                                                             pending, self.max_workers):
+                    if error:
+                        status[item] = dict(status='error', error=str(error))
+                    elif profile is None:
+                        status[item] = dict(status='deleted')
+                pending = [item for item in pending if status[item]['status'] == 'deleting']
+                if pending and time.time() >= deadline:
+                    for item in pending:
+                        status[item] = dict(status='timeout')
+                    break
+                if pending:
+                    time.sleep(max(0, min(5, deadline - time.time())))
+
+        self.results['teardown'] = [dict(name=name, resource_group=resource_group, **status[(resource_group, name)])
+                                    for resource_group, name in items]
+        self.results['changed'] = any(entry['status'] in ('deleted', 'would_delete', 'timeout') for entry in self.results['teardown'])
+        errors = ['{0}: {1}'.format(entry['name'], entry.get('error', 'not deleted after {0} seconds'.format(self.teardown_timeout)))
+                  for entry in self.results['teardown'] if entry['status'] in ('error', 'timeout')]
+        if errors:
+            self.fail('Error deleting Traffic Manager profiles. {0}'.format('; '.join(errors)), **self.results)
+        return self.results
+
+    def profile_names(self, profiles):
+        '''
+        Resource group and name of each listed profile, once each, the resource group defaulting to the module one.
+        '''
+        items = []
+        seen = set()
+        for item in profiles:
+            resource_group = item['resource_group'] or self.resource_group
+            if not resource_group:
+                self.fail('Traffic Manager {0}: resource_group is required'.format(item['name']))
+            key = (resource_group.lower(), item['name'].lower())
+            if key not in seen:
+                seen.add(key)
+                items.append((resource_group, item['name']))
+        return items
+
+    def wait_for_monitor_status(self, profile, names):
+        '''
+        Wait until the monitor status of the named endpoints is one of the accepted ones, starting with the given profile.
+        Return the last fetched profile.
+        '''
+        deadline = time.time() + self.rollout['gate_timeout']
+        while True:
+            statuses = dict((end.name, end.endpoint_monitor_status) for end in profile.endpoints or [])
+            pending = dict((name, statuses.get(name)) for name in names if statuses.get(name) not in self.rollout['monitor_status'])
+            if not pending:
+                return profile
+            if time.time() >= deadline:
+                self.fail('Traffic Manager {0}: endpoints not healthy after {1} seconds: {2}'.format(
+                    self.name, self.rollout['gate_timeout'], ', '.join('{0} is {1}'.format(*item) for item in sorted(pending.items()))),
+                    **self.results)
+            time.sleep(min(10, self.rollout['interval']))
+            profile = self.get_traffic_manager_profile(self.resource_group, self.name, refresh=True)
+
+    def profile_spec(self, params):
+        '''
+        Settings of one profile, from the module parameters or from an item of profiles, with their defaults set.
+        '''
+        spec = dict((key, params.get(key)) for key in PROFILE_SETTINGS)
+        spec['resource_group'] = spec['resource_group'] or self.resource_group
+        if spec['tags'] is None:
+            spec['tags'] = self.tags
+        if not spec['resource_group']:
+            self.fail('Traffic Manager {0}: resource_group is required'.format(spec['name']))
+        if spec['state'] == 'present' and not spec['monitor_config']:
+            self.fail('Traffic Manager {0}: monitor_config is required'.format(spec['name']))
+
+        # Set default parameters
+        spec['dns_config'] = dict(spec['dns_config'] or dict())
+        if spec['dns_config'].get('relative_name') is None:
+            spec['dns_config']['relative_name'] = spec['name']
+        if spec['endpoints'] is not None:
+            spec['endpoints'] = [dict(end) for end in spec['endpoints']]
+            for end in spec['endpoints']:
+                if end.get('type'):
+                    end['type'] = 'Microsoft.Network/trafficManagerProfiles/' + end['type']
+                target_profile = end.pop('target_profile', None)
+                if target_profile:
+                    resource_group, name = target_profile.split('/', 1) if '/' in target_profile else (spec['resource_group'], target_profile)
+                    end['target_resource_id'] = PROFILE_ID_FORMAT.format(self.subscription_id, resource_group, name)
+            overlaps = geo_mapping_overlaps(spec['endpoints'])
+            if overlaps:
+                self.fail('Traffic Manager {0}: geographic codes mapped to more than one endpoint: {1}'.format(spec['name'], '; '.join(overlaps)))
+        if spec['monitor_config']:
+            spec['monitor_config'] = dict(spec['monitor_config'])
+            spec['monitor_config']['protocol'] = spec['monitor_config']['protocol'].upper()
+        return spec
+
+    def reconcile(self, spec, workers):
+        '''
+        Bring one profile to its desired state. Return whether it changed, the change set (None when state is absent)
+        and the profile as a dict.
+        '''
+        results = dict(resource_group=spec['resource_group'])
+        # Get the existing Traffic Manager
+        existing_traffic_manager = self.get_traffic_manager_profile(spec['resource_group'], spec['name'])
+        if spec['state'] == 'absent':
+            if not existing_traffic_manager:
+                return False, None, results
+            # Deletes the Traffic Manager
+            if not self.check_mode:
+                self.remove_traffic_manager_profile(spec)
+            return True, None, results
+
+        existing_profile = existing_traffic_manager.as_dict() if existing_traffic_manager else dict()
+        changes = self.profile_diff(spec, existing_profile)
+        if not changes or self.check_mode:
+            results.update(existing_profile)
+        elif existing_traffic_manager and not changes['profile'] and not constrained_endpoint_changes(changes) and \
+                self.update_endpoints(spec, changes, existing_profile, workers):
+            # Only endpoints differ, the touched ones were sent instead of the whole profile
+            results.update(self.get_traffic_manager_profile(spec['resource_group'], spec['name'], refresh=True).as_dict())
+        else:
+            results.update(self.create_or_update_traffic_manager_profile(spec, bool(existing_traffic_manager)))
+        return bool(changes), changes, results
+
+    def fail(self, msg, **kwargs):
+        if threading.current_thread() is not self.main_thread:
+            raise TrafficManagerError(msg)
+        super(AzureRMTrafficManager, self).fail(msg, **kwargs)
+
+    @property
+    def trafficmanager_client(self):
+        # Create the client once per module run instead of once per lookup, shared by the worker threads.
+        # With the shared client pool, its HTTP session is also kept alive and sized for the worker threads.
+        with self.client_lock:
+            if self._trafficmanager_client is None:
+                if CLIENT_POOL is None:
+                    self._trafficmanager_client = self.get_mgmt_svc_client(TrafficManagerManagementClient)
+                else:
+                    self._trafficmanager_client = CLIENT_POOL.get('trafficmanager', module_credentials(self), self.subscription_id,
+                                                                  lambda: self.get_mgmt_svc_client(TrafficManagerManagementClient))
+        return self._trafficmanager_client
+
+    def get_traffic_manager_profile(self, resource_group, name, refresh=False):
+        '''
+        Fetch a Traffic Manager profile. Return Traffic Manager object, or None if it does not exist.
+        With refresh, the profile is fetched again even if the resource group was prefetched.
+        '''
+        if self.prefetch and not refresh:
+            return self.prefetch_traffic_manager_profiles(resource_group).get(name.lower())
         try:
             self.log('Fetching Traffic Manager {0}'.format(name))
-            self.trafficmanager_client = self.get_mgmt_svc_client(TrafficManagerManagementClient)
-            profiles = self.trafficmanager_client.profiles.list_by_resource_group(resource_group)
-            #  Check the profiles and return the one that matches the name
-            for profile in profiles:
-                if profile.name == name:
-                    return self.trafficmanager_client.profiles.get(resource_group, name)
-            return None  # if there is no profile returns None
+            return self.metrics.call('profiles.get', self.trafficmanager_client.profiles.get, resource_group, name)
         except CloudError as cloud_error:
+            if cloud_error.status_code == 404:
+                return None
             self.fail(
                 "Error getting Traffic Manager profile with nanme: {0}. {1}".format(name, cloud_error))
         except Exception as exc:
             self.fail("Error retrieving Traffic Manager {0} - {1}".format(name, str(exc)))
 
-    def remove_traffic_manager_profile(self):
+    def prefetch_traffic_manager_profiles(self, resource_group):
+        '''
+        List the Traffic Manager profiles of a resource group once. Return a dict of the profiles by lower case name.
+        '''
+        key = resource_group.lower()
+        if key not in self.prefetched:
+            try:
+                self.log('Listing Traffic Managers of resource group {0}'.format(resource_group))
+                profiles = self.metrics.call('profiles.list_by_resource_group',
+                                             lambda: list(self.trafficmanager_client.profiles.list_by_resource_group(resource_group)))
+            except CloudError as cloud_error:
+                if cloud_error.status_code != 404:
+                    self.fail("Error listing Traffic Manager profiles of resource group {0}. {1}".format(resource_group, cloud_error))
+                profiles = []
+            except Exception as exc:
+                self.fail("Error listing Traffic Manager profiles of resource group {0} - {1}".format(resource_group, str(exc)))
+            self.prefetched[key] = dict((profile.name.lower(), profile) for profile in profiles)
+        return self.prefetched[key]
+
+    def remove_traffic_manager_profile(self, spec):
         '''
-        Remove the Traffic Manager profile. Return boolean True on successful deletion.
+        Remove the Traffic Manager profile. Return boolean True on successful deletion, False if it did not exist.
         '''
-        self.log('Deleting Traffic Manager {0}'.format(self.name))
+        self.log('Deleting Traffic Manager {0}'.format(spec['name']))
         try:
-            self.trafficmanager_client.profiles.delete(self.resource_group, self.name)
+            result = self.metrics.call('profiles.delete', self.trafficmanager_client.profiles.delete, spec['resource_group'], spec['name'])
         except CloudError as cloud_error:
-            self.fail('Error getting Traffic Manager profile with nanme: {0}. {1}'.format(self.name, cloud_error))
+            if cloud_error.status_code == 404:
+                return False
+            self.fail('Error deleting Traffic Manager profile with nanme: {0}. {1}'.format(spec['name'], cloud_error))
         except Exception as exc:
-            self.fail('Error retrieving Traffic Manager {0} - {1}'.format(self.name, str(exc)))
+            self.fail('Error deleting Traffic Manager {0} - {1}'.format(spec['name'], str(exc)))
+        if result is not None and result.operation_result is False:
+            self.fail('Error deleting Traffic Manager {0}: the delete operation did not succeed'.format(spec['name']))
+        return True
 
-    def create_or_update_traffic_manager_profile(self, update):
+    def create_or_update_traffic_manager_profile(self, spec, update):
         '''
         Create or update a Traffic Manager profile.
-        :param name: name of a traffic  manager
+        :param spec: settings of the traffic manager
         :return: traffic manage object
         '''
-        self.log('Creating or updating Traffic Manager {0}'.format(self.name))
+        self.log('Creating or updating Traffic Manager {0}'.format(spec['name']))
         try:
             # Create MonitorConfig
-            monitor_config = MonitorConfig(protocol=self.monitor_config.get('protocol', 'HTTP'),
-                                           port=self.monitor_config.get('port', 80),
-                                           path=self.monitor_config.get('path', '/'),
-                                           timeout_in_seconds=self.monitor_config.get('timeout_in_seconds', 10),
-                                           interval_in_seconds=self.monitor_config.get('interval_in_seconds', 30),
-                                           tolerated_number_of_failures=self.monitor_config.get('tolerated_number_of_failures', 3))
+            monitor_config = MonitorConfig(protocol=spec['monitor_config'].get('protocol', 'HTTP'),
+                                           port=spec['monitor_config'].get('port', 80),
+                                           path=spec['monitor_config'].get('path', '/'),
+                                           timeout_in_seconds=spec['monitor_config'].get('timeout_in_seconds', 10),
+                                           interval_in_seconds=spec['monitor_config'].get('interval_in_seconds', 30),
+                                           tolerated_number_of_failures=spec['monitor_config'].get('tolerated_number_of_failures', 3))
             # Create DnsConfig
-            dns_config = DnsConfig(relative_name=self.dns_config.get('relative_name', self.name), ttl=self.dns_config.get('ttl', 60))
+            dns_config = DnsConfig(relative_name=spec['dns_config'].get('relative_name', spec['name']), ttl=spec['dns_config'].get('ttl', 60))
 
             # Create Endpoints
-            endpoints = []
-            for end in self.endpoints:
-                endpoint_instance = Endpoint(name=end.get('name'), type=end.get('type'),
-                                             target=end.get('target'), endpoint_status=end.get('endpoint_status', 'Enabled'),
-                                             weight=end.get('weight'), priority=end.get('priority'),
-                                             target_resource_id=end.get('target_resource_id'),
-                                             endpoint_location=end.get('endpoint_location'),
-                                             min_child_endpoints=end.get('min_child_endpoints'),
-                                             geo_mapping=end.get('geo_mapping'))
-                endpoints.append(endpoint_instance)
-
-            profile = Profile(tags=self.tags, location="global", profile_status=self.profile_status,
-                              traffic_routing_method=self.traffic_routing_method, dns_config=dns_config,
+            endpoints = [endpoint_model(end) for end in spec['endpoints'] or []]
+
+            profile = Profile(tags=spec['tags'], location="global", profile_status=spec['profile_status'],
+                              traffic_routing_method=spec['traffic_routing_method'], dns_config=dns_config,
+                              traffic_view_enrollment_status=spec['traffic_view_enrollment_status'],
                               monitor_config=monitor_config,
                               endpoints=endpoints)
-            return self.trafficmanager_client.profiles.create_or_update(self.resource_group, self.name, profile).as_dict()
+            return self.metrics.call('profiles.create_or_update', self.trafficmanager_client.profiles.create_or_update,
+                                     spec['resource_group'], spec['name'], profile).as_dict()
         except CloudError as cloud_error:
             if update:
-                self.fail('Error Updating the Traffic Manager: {0}. {1}'.format(self.name, str(cloud_error)))
+                self.fail('Error Updating the Traffic Manager: {0}. {1}'.format(spec['name'], str(cloud_error)))
             else:
-                self.fail('Error Creating the Traffic Manager: {0}. {1}'.format(self.name, str(cloud_error)))
+                self.fail('Error Creating the Traffic Manager: {0}. {1}'.format(spec['name'], str(cloud_error)))
         except Exception as exc:
-            self.fail('Error retrieving Traffic Manager {0} - {1}'.format(self.name, str(exc)))
+            self.fail('Error retrieving Traffic Manager {0} - {1}'.format(spec['name'], str(exc)))
 
-    def is_different(self, existing_traffic_manager):
+    def update_endpoints(self, spec, changes, existing_profile, workers):
         '''
-        Check if there is any difference between existing_traffic_manager and input parameters.
-        Return True when existing_traffic_manager is empty or is different from self.trafficmanager_client.
+        Apply the endpoint changes with the endpoints sub-resource APIs, leaving the untouched endpoints alone.
+        Removals run before additions, so that an endpoint can change its type under the same name.
+        Return False when a request failed, the profile then being sent whole by the caller.
         '''
-        if bool(existing_traffic_manager):
-            existing_profile = existing_traffic_manager.as_dict()
-            for item in ['name', 'tags', 'traffic_view_enrollment_status', 'traffic_routing_method', 'profile_status']:
-                value = getattr(self, item)
-                if value and value != existing_profile.get(item):
-                    return True
-            for item in self.monitor_config.keys():
-                value_given = self.monitor_config.get(item)
-                if value_given:
-                    value_cmp = existing_profile['monitor_config'].get(item)
-                    if value_given != value_cmp:
-                        return True
-            if bool(self.dns_config):
-                if self.dns_config.get('ttl', 60) != existing_profile['dns_config'].get('ttl') or \
-                        self.dns_config.get('relative_name', self.name) != existing_profile['dns_config'].get('relative_name'):
-                    return True
-
-            if bool(self.endpoints):
-                if not bool(existing_profile['endpoints']):
-                    return True
-                else:
-                    value_cmp = self.list_to_dict(existing_profile['endpoints'])
-                    value_given = self.list_to_dict(self.endpoints)
-                    if not (set(value_cmp.keys()) <= set(value_given.keys())):
-                        return True
-                    for item in value_given.keys():
-                        for k, v in value_given[item].items():
-                            if v and v != value_cmp[item].get(k):
-                                return True
-            return False
-        else:
-            return True
+        given = dict((end['name'], end) for end in spec['endpoints'])
+        existing = dict((end['name'], end) for end in existing_profile.get('endpoints') or [])
+        modified = changes['endpoints']['modified']
+        removed = [existing[name] for name in changes['endpoints']['removed']] + \
+            [existing[name] for name in sorted(modified) if 'type' in modified[name]]
+        upserted = [given[name] for name in changes['endpoints']['added'] + sorted(modified)]
+        self.log('Traffic Manager {0}: {1} endpoints to add or update, {2} to remove'.format(spec['name'], len(upserted), len(removed)))
+        endpoints = self.trafficmanager_client.endpoints
+
+        def delete(end):
+            return self.metrics.call('endpoints.delete', endpoints.delete, spec['resource_group'], spec['name'],
+                                     endpoint_type(end['type']), end['name'])
+
+        def create_or_update(end):
+            return self.metrics.call('endpoints.create_or_update', endpoints.create_or_update, spec['resource_group'], spec['name'],
+                                     endpoint_type(end['type']), end['name'], endpoint_model(end))
+
+        for func, items in [(delete, removed), (create_or_update, upserted)]:
+            errors = ['{0}: {1}'.format(end['name'], str(error))
+                      for end, result, error in run_concurrently(func, items, workers) if error]
+            if errors:
+                self.log('Error updating the endpoints of Traffic Manager {0}, sending the whole profile. {1}'.format(spec['name'], '; '.join(errors)))
+                return False
+        return True
+
+    def profile_diff(self, spec, existing_profile):
+        '''
+        Compare the parameters with the existing profile, an empty dict when there is none, after normalizing both sides.
+        Only the settings given are compared. Endpoints are matched by name and are not compared when endpoints is omitted.
+        Return an empty dict when nothing differs, otherwise the complete change set:
+        profile maps each differing setting to its desired and current values, endpoints lists the names of the endpoints
+        added and removed and maps each modified endpoint to its differing settings.
+        '''
+        desired = flatten_profile(dict(profile_status=spec['profile_status'],
+                                       traffic_routing_method=spec['traffic_routing_method'],
+                                       traffic_view_enrollment_status=spec['traffic_view_enrollment_status'],
+                                       tags=spec['tags'],
+                                       dns_config=dict(relative_name=spec['dns_config'].get('relative_name'),
+                                                       ttl=spec['dns_config'].get('ttl', 60)),
+                                       monitor_config=spec['monitor_config']))
+        profile_changes = diff_fields(desired, flatten_profile(existing_profile))
+
+        added, modified, removed = [], dict(), []
+        if spec['endpoints'] is not None:
+            existing = dict((end['name'], normalize_fields(end)) for end in existing_profile.get('endpoints') or [])
+            given = dict((end['name'], normalize_fields(end)) for end in spec['endpoints'])
+            added = sorted(set(given) - set(existing))
+            removed = sorted(set(existing) - set(given))
+            for name in set(given) & set(existing):
+                fields = diff_fields(given[name], existing[name])
+                if fields:
+                    modified[name] = fields
+
+        if not (profile_changes or added or modified or removed):
+            return dict()
+        return dict(profile=profile_changes, endpoints=dict(added=added, modified=modified, removed=removed))
+
+
+PROFILE_ID_FORMAT = '/subscriptions/{0}/resourceGroups/{1}/providers/Microsoft.Network/trafficManagerProfiles/{2}'
+
+PROFILE_ID_PATTERN = re.compile(r'/resourceGroups/([^/]+)/providers/Microsoft\.Network/trafficManagerProfiles/([^/]+)$', re.IGNORECASE)
+
+PROFILE_SETTINGS = ['name', 'resource_group', 'profile_status', 'traffic_routing_method', 'traffic_view_enrollment_status',
+                    'dns_config', 'monitor_config', 'endpoints', 'tags', 'state']
+
+
+# Endpoint settings which must be unique among the endpoints of a profile
+CONSTRAINED_ENDPOINT_SETTINGS = ('priority', 'geo_mapping')
+
+
+def constrained_endpoint_changes(changes):
+    # Whether an existing endpoint changes a setting which must be unique among the endpoints. The endpoints can only
+    # be updated one by one without conflict when they keep these settings: a removed endpoint is deleted first and an
+    # added one then takes a value free in the final profile.
+    return any(key in fields for fields in changes['endpoints']['modified'].values() for key in CONSTRAINED_ENDPOINT_SETTINGS)
+
+
+def nested_profile_keys(endpoints):
+    # Lower case resource group and name of the profiles nested by the endpoints
+    for end in endpoints:
+        match = PROFILE_ID_PATTERN.search(end.get('target_resource_id') or '')
+        if match and endpoint_type(end.get('type') or '').lower() == 'nestedendpoints':
+            yield match.group(1).lower(), match.group(2).lower()
+
+
+def endpoint_model(end):
+    return Endpoint(name=end.get('name'), type=end.get('type'),
+                    target=end.get('target'), endpoint_status=end.get('endpoint_status', 'Enabled'),
+                    weight=end.get('weight'), priority=end.get('priority'),
+                    target_resource_id=end.get('target_resource_id'),
+                    endpoint_location=end.get('endpoint_location'),
+                    min_child_endpoints=end.get('min_child_endpoints'),
+                    geo_mapping=end.get('geo_mapping'))
+
+
+ENDPOINT_HEALTH_COLUMNS = ['profile', 'resource_group', 'endpoint', 'type', 'endpoint_status', 'endpoint_monitor_status',
+                           'weight', 'priority']
+
+
+# Geographic hierarchy of Traffic Manager: WORLD, the GEO- regions, their countries or regions by ISO 3166-1 code,
+# and the states and provinces of Australia, Canada and the United States, as children of each code
+GEO_HIERARCHY = [
+    ('WORLD', 'GEO-AF GEO-AN GEO-AP GEO-AS GEO-EU GEO-ME GEO-NA GEO-SA'),
+    ('GEO-AF', 'AO BF BI BJ BW CD CF CG CI CM CV DJ DZ EG EH ER ET GA GH GM GN GQ GW KE '
+               'KM LR LS LY MA MG ML MR MU MW MZ NA NE NG RE RW SC SD SH SL SN SO SS ST '
+               'SZ TD TG TN TZ UG YT ZA ZM ZW'),
+    ('GEO-AN', 'AQ BV TF'),
+    ('GEO-AP', 'AS AU CC CK CX FJ FM GU HM KI MH MP NC NF NR NU NZ PF PG PN PW SB TK TO '
+               'TV UM VU WF WS'),
+    ('GEO-AS', 'AF BD BN BT CN HK ID IN IO JP KG KH KP KR KZ LA LK MM MN MO MV MY NP PH '
+               'PK SG TH TJ TL TM TW UZ VN'),
+    ('GEO-EU', 'AD AL AM AT AX AZ BA BE BG BY CH CY CZ DE DK EE ES FI FO FR GB GE GG GI '
+               'GR HR HU IE IM IS IT JE LI LT LU LV MC MD ME MK MT NL NO PL PT RO RS RU '
+               'SE SI SJ SK SM TR UA VA XK'),
+    ('GEO-ME', 'AE BH IL IQ IR JO KW LB OM PS QA SA SY YE'),
+    ('GEO-NA', 'AG AI AW BB BL BM BQ BS BZ CA CR CU CW DM DO GD GL GP GT HN HT JM KN KY '
+               'LC MF MQ MS MX NI PA PM PR SV SX TC TT US VC VG VI'),
+    ('GEO-SA', 'AR BO BR CL CO EC FK GF GS GY PE PY SR UY VE'),
+    ('AU', 'AU-ACT AU-NSW AU-NT AU-QLD AU-SA AU-TAS AU-VIC AU-WA'),
+    ('CA', 'CA-AB CA-BC CA-MB CA-NB CA-NL CA-NS CA-NT CA-NU CA-ON CA-PE CA-QC CA-SK CA-YT'),
+    ('US', 'US-AK US-AL US-AR US-AZ US-CA US-CO US-CT US-DC US-DE US-FL US-GA US-HI US-IA US-ID US-IL US-IN US-KS US-KY US-LA US-MA US-MD US-ME US-MI US-MN '
+           'US-MO US-MS US-MT US-NC US-ND US-NE US-NH US-NJ US-NM US-NV US-NY US-OH US-OK US-OR US-PA US-RI US-SC US-SD US-TN US-TX US-UT US-VA US-VT US-WA '
+           'US-WI US-WV US-WY'),
+]
+GEO_CHILDREN = dict((parent, tuple(children.split())) for parent, children in GEO_HIERARCHY)
+GEO_PARENT = dict((child, parent) for parent, children in GEO_CHILDREN.items() for child in children)
+
+
+def geo_ancestors(code):
+    parent = GEO_PARENT.get(code)
+    while parent is not None:
+        yield parent
+        parent = GEO_PARENT.get(parent)
+
+
+def geo_mapping_canonical(codes):
+    '''
+    Canonical form of a geographic mapping, only used to compare mappings: upper case codes without the ones covered by
+    another code of the mapping, each complete set of children replaced by their parent, sorted. Codes missing from
+    GEO_HIERARCHY are kept as they are. The mapping sent to Azure is the one of the parameters.
+    '''
+    codes = set(code.upper() for code in codes)
+    codes = set(code for code in codes if not any(ancestor in codes for ancestor in geo_ancestors(code)))
+    collapsed = True
+    while collapsed:
+        collapsed = False
+        for parent in set(GEO_PARENT[code] for code in codes if code in GEO_PARENT):
+            if all(child in codes for child in GEO_CHILDREN[parent]):
+                codes.difference_update(GEO_CHILDREN[parent])
+                codes.add(parent)
+                collapsed = True
+    return sorted(codes)
+
+
+def geo_mapping_overlaps(endpoints):
+    '''
+    Check that no geographic code is in the mappings of two endpoints. A code may be within a parent code of another
+    endpoint, e.g. US-TX and US, as the most specific code wins. Return the list of the overlaps found.
+    '''
+    owners = dict()
+    overlaps = []
+    for end in endpoints:
+        for code in set(code.upper() for code in end.get('geo_mapping') or []):
+            if code in owners:
+                overlaps.append('{0} in {1} and {2}'.format(code, owners[code], end.get('name')))
+            owners.setdefault(code, end.get('name'))
+    return overlaps
+
+
+def rollout_steps(current, start, target, step):
+    '''
+    Plan a rollout from the current weights by endpoint name. Return the weights set at each step, for the changed endpoints only.
+    Nothing is planned when the target weights are already in place. Otherwise the first step sets the start weights, if any,
+    then each step moves every endpoint by at most step towards its target weight.
+    '''
+    if all(current[name] == weight for name, weight in target.items()):
+        return []
+    steps = []
+    weights = dict(current)
+    first = dict((name, weight) for name, weight in start.items() if weights[name] != weight)
+    if first:
+        steps.append(first)
+        weights.update(first)
+    while True:
+        changes = dict()
+        for name, weight in target.items():
+            delta = max(-step, min(step, weight - weights[name]))
+            if delta:
+                changes[name] = weights[name] + delta
+        if not changes:
+            return steps
+        steps.append(changes)
+        weights.update(changes)
+
+
+def endpoint_type(value):
+    # Endpoint type as used in the endpoints API path, e.g. azureEndpoints
+    return value.split('/')[-1]
+
+
+def normalize(key, value):
+    '''
+    Canonical form of a profile or endpoint setting, so that equivalent spellings compare equal.
+    '''
+    if value is None:
+        return None
+    key = key.split('.')[-1]
+    if key == 'type':
+        return endpoint_type(value).lower()
+    if key == 'protocol':
+        return value.upper()
+    if key == 'endpoint_location':
+        return value.replace(' ', '').lower()
+    if key in ('target', 'target_resource_id', 'relative_name'):
+        return value.lower()
+    if key == 'geo_mapping':
+        return geo_mapping_canonical(value)
+    return value
+
+
+def normalize_fields(values):
+    return dict((key, normalize(key, value)) for key, value in values.items())
+
+
+def flatten_profile(profile):
+    # Normalized profile settings, with the dns_config and monitor_config settings as dotted keys
+    result = dict()
+    for key, value in profile.items():
+        if key in ('dns_config', 'monitor_config'):
+            for sub_key, sub_value in (value or dict()).items():
+                result[key + '.' + sub_key] = normalize(sub_key, sub_value)
+        elif key != 'endpoints':
+            result[key] = normalize(key, value)
+    return result
+
+
+def diff_fields(desired, current):
+    '''
+    Compare the settings given in desired with current. Return a dict of the differing settings with both values.
+    '''
+    result = dict()
+    for key, value in desired.items():
+        if value is not None and value != current.get(key):
+            if key == 'geo_mapping':
+                # Geographic mappings can hold hundreds of codes, report the codes added and removed only
+                result[key] = dict(added=sorted(set(value) - set(current.get(key) or [])),
+                                   removed=sorted(set(current.get(key) or []) - set(value)))
+            else:
+                result[key] = dict(desired=value, current=current.get(key))
+    return result
+
+
+def run_concurrently(func, items, workers):
+    '''
+    Call func on every item with at most workers threads. Return a list of (item, result, error) in the order of items.
+    Errors are returned rather than raised, so that the module only fails from the main thread.
+    '''
+    def call(item):
+        try:
+            return item, func(item), None
+        except Exception as exc:
+            return item, None, exc
 
-    def list_to_dict(self, endpoints):
-        result = {}
-        for item in endpoints:
-            result[item['name']] = item
-        return result
+    if len(items) <= 1 or workers <= 1:
+        return [call(item) for item in items]
+    pool = ThreadPool(min(workers, len(items)))
+    try:
+        return pool.map(call, items)
+    finally:
+        pool.close()
+        pool.join()
 
 
 def main():
@@ -0,0 +1,450 @@
+#!/usr/bin/env python
+# Local stand-in for the subset of Azure Resource Manager used by the modules and inventory scripts of this repo.
+#
+# Serves resource groups, virtual machines (with instance view), network interfaces, public IP addresses,
+# subnets, load balancers and Traffic Manager profiles with their endpoints, from memory. Lists are paged
+# with nextLink, load balancer PUT and DELETE are long running operations polled through
+# Azure-AsyncOperation and Location, and latency and 429 throttling can be injected, so that the
+# performance of the modules and inventory scripts can be measured reproducibly without Azure.
+#
+#   python benchmarks/arm_server.py --port 8443 --vms 5000 --page-size 100 --latency 40 --throttle-rate 0.02
+#
+# Point the SDK clients at the printed URL with base_url, e.g.
+#
+#   NetworkManagementClient(BasicTokenAuthentication({'access_token': 'x'}), SUBSCRIPTION, base_url=url)
+#
+# with OAUTHLIB_INSECURE_TRANSPORT=1 when serving plain HTTP. GET /metadata/endpoints serves cloud metadata
+# pointing at the server and POST /<tenant>/oauth2/token returns a dummy token. GET /_stats returns the
+# number of requests served by method and resource type, and POST /_stats resets it.
+
+import argparse
+import copy
+import json
+import random
+import re
+import ssl
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlsplit
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlsplit
+
+PROVIDERS = {
+    'microsoft.compute/virtualmachines': 'Microsoft.Compute/virtualMachines',
+    'microsoft.network/networkinterfaces': 'Microsoft.Network/networkInterfaces',
+    'microsoft.network/publicipaddresses': 'Microsoft.Network/publicIPAddresses',
+    'microsoft.network/virtualnetworks': 'Microsoft.Network/virtualNetworks',
+    'microsoft.network/loadbalancers': 'Microsoft.Network/loadBalancers',
+    'microsoft.network/trafficmanagerprofiles': 'Microsoft.Network/trafficManagerProfiles',
+}
+
+# Child collections of a load balancer, whose items get an id below the load balancer
+LOAD_BALANCER_CHILDREN = ['frontendIPConfigurations', 'backendAddressPools', 'probes', 'loadBalancingRules',
+                          'inboundNatRules', 'inboundNatPools']
+
+RESOURCE_PATH = re.compile(r'^/subscriptions/([^/]+)/resourcegroups/([^/]+)(?:/providers/([^/]+/[^/]+)(?:/([^/]+)(?:/(.+))?)?)?$',
+                           re.IGNORECASE)
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ArmState(object):
+    # Resources by lower case id, the long running operations in progress and the request counters
+
+    def __init__(self, args):
+        self.args = args
+        self.lock = threading.Lock()
+        self.resources = dict()
+        self.groups = dict()
+        self.operations = dict()
+        self.stats = Counter()
+        self.random = random.Random(args.seed)
+
+    def put(self, resource):
+        self.resources[resource['id'].lower()] = resource
+        return resource
+
+    def get(self, resource_id):
+        return self.resources.get(resource_id.lower())
+
+    def delete(self, resource_id):
+        return self.resources.pop(resource_id.lower(), None)
+
+    def children(self, prefix):
+        # Resources directly below prefix, in creation order
+        prefix = prefix.lower() + '/'
+        return [resource for key, resource in self.resources.items() if key.startswith(prefix) and '/' not in key[len(prefix):]]
+
+    def seed(self, base_url):
+        args = self.args
+        group_id = '/subscriptions/{0}/resourceGroups/{1}'.format(args.subscription, args.resource_group)
+        self.groups[args.resource_group.lower()] = dict(id=group_id, name=args.resource_group, location=args.location,
+                                                        properties=dict(provisioningState='Succeeded'))
+        network = group_id + '/providers/Microsoft.Network'
+        vnet_id = network + '/virtualNetworks/vnet0'
+        self.put(dict(id=vnet_id, name='vnet0', location=args.location,
+                      properties=dict(addressSpace=dict(addressPrefixes=['10.0.0.0/8']), provisioningState='Succeeded')))
+        subnet_id = self.put(dict(id=vnet_id + '/subnets/default', name='default',
+                                  properties=dict(addressPrefix='10.0.0.0/8', provisioningState='Succeeded')))['id']
+        for index in range(args.vms):
+            name = 'vm{0:05d}'.format(index)
+            ip_configuration = dict(privateIPAddress='10.{0}.{1}.{2}'.format(index // 65536 % 256, index // 256 % 256, index % 256),
+                                    privateIPAllocationMethod='Dynamic', subnet=dict(id=subnet_id))
+            if self.random.random() < args.public_ratio:
+                public_ip = self.put(dict(id='{0}/publicIPAddresses/{1}-ip'.format(network, name), name=name + '-ip',
+                                          location=args.location,
+                                          properties=dict(ipAddress='20.{0}.{1}.{2}'.format(index // 65536 % 256, index // 256 % 256,
+                                                                                             index % 256),
+                                                          publicIPAllocationMethod='Static', provisioningState='Succeeded')))
+                ip_configuration['publicIPAddress'] = dict(id=public_ip['id'])
+            nic_id = '{0}/networkInterfaces/{1}-nic'.format(network, name)
+            self.put(dict(id=nic_id, name=name + '-nic', location=args.location,
+                          properties=dict(primary=True, provisioningState='Succeeded',
+                                          ipConfigurations=[dict(id=nic_id + '/ipConfigurations/ipconfig1', name='ipconfig1',
+                                                                 properties=ip_configuration)])))
+            self.put(dict(id='{0}/providers/Microsoft.Compute/virtualMachines/{1}'.format(group_id, name), name=name,
+                          type='Microsoft.Compute/virtualMachines', location=args.location,
+                          tags=dict(role='web' if index % 2 else 'api', index=str(index)),
+                          properties=dict(vmId=str(uuid.UUID(int=index)), provisioningState='Succeeded',
+                                          hardwareProfile=dict(vmSize='Standard_B1s'),
+                                          networkProfile=dict(networkInterfaces=[dict(id=nic_id, properties=dict(primary=True))]),
+                                          powerState='running' if self.random.random() >= args.stopped_ratio else 'deallocated')))
+
+
+class ArmHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    state = None
+    base_url = None
+
+    def log_message(self, format, *args):
+        if self.state.args.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+    def do_PATCH(self):
+        self.handle_request('PATCH')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def handle_request(self, method):
+        url = urlsplit(self.path)
+        self.query = parse_qs(url.query)
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            self.body = json.loads(self.rfile.read(length).decode('utf-8')) if length else None
+        except ValueError as exc:
+            return self.reply(400, error('InvalidRequestContent', 'The request content is not valid JSON: {0}'.format(exc)))
+        args = self.state.args
+        if args.latency or args.jitter:
+            time.sleep(max(0.0, args.latency + self.state.random.uniform(-args.jitter, args.jitter)) / 1000.0)
+
+        path = url.path.rstrip('/')
+        if path == '/_stats':
+            if method == 'POST':
+                with self.state.lock:
+                    self.state.stats.clear()
+            with self.state.lock:
+                return self.reply(200, dict(self.state.stats))
+        if path == '/metadata/endpoints':
+            return self.reply(200, self.metadata())
+        if path.endswith('/oauth2/token') or path.endswith('/oauth2/v2.0/token'):
+            return self.reply(200, dict(token_type='Bearer', access_token='arm-server', expires_in='3600',
+                                        expires_on=str(int(time.time()) + 3600), resource=self.base_url))
+
+        if args.throttle_rate and self.state.random.random() < args.throttle_rate:
+            self.count(method, 'throttled')
+            return self.reply(429, error('TooManyRequests', 'Injected throttling'), {'Retry-After': str(args.retry_after)})
+        if path.startswith('/operations/'):
+            self.count(method, 'operations')
+            return self.operation(path.split('/')[-1])
+
+        match = RESOURCE_PATH.match(path)
+        if not match:
+            return self.reply(404, error('NotFound', 'Unknown path {0}'.format(path)))
+        subscription, group, provider, name, rest = match.groups()
+        if group.lower() not in self.state.groups:
+            return self.reply(404, error('ResourceGroupNotFound', 'Resource group {0} not found'.format(group)))
+        if provider is None:
+            self.count(method, 'resourcegroups')
+            return self.reply(200, self.state.groups[group.lower()])
+        kind = provider.lower()
+        if kind not in PROVIDERS:
+            return self.reply(404, error('NotFound', 'Unknown provider {0}'.format(provider)))
+        self.count(method, kind.split('/')[-1] + ('/' + rest.split('/')[0] if rest else ''))
+        collection_id = '/subscriptions/{0}/resourceGroups/{1}/providers/{2}'.format(subscription, self.state.groups[group.lower()]['name'],
+                                                                                      PROVIDERS[kind])
+        if name is None:
+            if method != 'GET':
+                return self.reply(405, error('MethodNotAllowed', method))
+            return self.page(self.state.children(collection_id))
+        resource_id = collection_id + '/' + name
+        if rest:
+            return self.child(method, kind, resource_id, rest)
+        return self.resource(method, kind, resource_id, name)
+
+    def resource(self, method, kind, resource_id, name):
+        with self.state.lock:
+            current = self.state.get(resource_id)
+            if method == 'GET':
+                if current is None:
+                    return self.reply(404, error('ResourceNotFound', 'Resource {0} not found'.format(resource_id)))
+                if current.get('etag') and current['etag'] == self.headers.get('If-None-Match'):
+                    return self.reply(304, None)
+                result = copy.deepcopy(current)
+                if kind == 'microsoft.compute/virtualmachines':
+                    power_state = result['properties'].pop('powerState')
+                    if 'instanceView' in ''.join(self.query.get('$expand', [])):
+                        result['properties']['instanceView'] = dict(statuses=[
+                            dict(code='ProvisioningState/succeeded', level='Info', displayStatus='Provisioning succeeded'),
+                            dict(code='PowerState/' + power_state, level='Info', displayStatus='VM ' + power_state)])
+                return self.reply(200, result)
+            if method == 'DELETE':
+                if current is None:
+                    return self.reply(204, None)
+                if kind == 'microsoft.network/loadbalancers':
+                    return self.start_operation('delete', resource_id, None)
+                self.state.delete(resource_id)
+                if kind == 'microsoft.network/trafficmanagerprofiles':
+                    return self.reply(200, dict(boolean=True))
+                return self.reply(200, None)
+            if method in ('PUT', 'PATCH') and kind in ('microsoft.network/loadbalancers', 'microsoft.network/trafficmanagerprofiles'):
+                body = self.body or dict()
+                if method == 'PATCH' and current is not None:
+                    merged = copy.deepcopy(current)
+                    merged.setdefault('properties', dict()).update(body.get('properties') or dict())
+                    merged.update(dict((key, value) for key, value in body.items() if key != 'properties'))
+                    body = merged
+                message = invalid_body(kind, body)
+                if message:
+                    return self.reply(400, error('BadRequest', message))
+                resource = self.store(kind, resource_id, name, body)
+                if kind == 'microsoft.network/loadbalancers':
+                    return self.start_operation('put', resource_id, resource, 200 if current is not None else 201)
+                return self.reply(200 if current is not None else 201, resource)
+        return self.reply(405, error('MethodNotAllowed', '{0} on {1}'.format(method, kind)))
+
+    def child(self, method, kind, resource_id, rest):
+        parts = rest.split('/')
+        with self.state.lock:
+            parent = self.state.get(resource_id)
+            if kind == 'microsoft.network/virtualnetworks' and parts[0].lower() == 'subnets':
+                if len(parts) == 1:
+                    return self.page(self.state.children(resource_id + '/subnets'))
+                subnet = self.state.get(resource_id + '/subnets/' + parts[1])
+                if subnet is None or method != 'GET':
+                    return self.reply(404, error('NotFound', 'Subnet {0} not found'.format(parts[1])))
+                return self.reply(200, subnet)
+            if kind == 'microsoft.network/trafficmanagerprofiles' and len(parts) == 2 and parent is not None:
+                endpoints = parent['properties'].setdefault('endpoints', [])
+                existing = [end for end in endpoints if end['name'].lower() == parts[1].lower()
+                            and end['type'].split('/')[-1].lower() == parts[0].lower()]
+                if method == 'GET':
+                    return self.reply(200, existing[0]) if existing else self.reply(404, error('NotFound', parts[1]))
+                if method == 'DELETE':
+                    parent['properties']['endpoints'] = [end for end in endpoints if end not in existing]
+                    return self.reply(200 if existing else 204, dict(boolean=True) if existing else None)
+                if method in ('PUT', 'PATCH'):
+                    endpoint = copy.deepcopy(existing[0]) if existing and method == 'PATCH' else dict(properties=dict())
+                    endpoint['properties'].update((self.body or dict()).get('properties') or dict())
+                    endpoint.update(id='{0}/{1}/{2}'.format(parent['id'], parts[0], parts[1]), name=parts[1],
+                                    type='Microsoft.Network/trafficManagerProfiles/' + parts[0])
+                    endpoint['properties'].setdefault('endpointStatus', 'Enabled')
+                    endpoint['properties'].setdefault('endpointMonitorStatus', 'Online')
+                    parent['properties']['endpoints'] = [end for end in endpoints if end not in existing] + [endpoint]
+                    return self.reply(200 if existing else 201, endpoint)
+        return self.reply(404, error('NotFound', 'Unknown path {0}/{1}'.format(resource_id, rest)))
+
+    def store(self, kind, resource_id, name, body):
+        resource = copy.deepcopy(body)
+        resource.update(id=resource_id, name=name, type=PROVIDERS[kind])
+        properties = resource.setdefault('properties', dict())
+        if kind == 'microsoft.network/loadbalancers':
+            resource['etag'] = 'W/"{0}"'.format(uuid.UUID(int=self.state.random.getrandbits(128)))
+            properties['provisioningState'] = 'Updating'
+            for collection in LOAD_BALANCER_CHILDREN:
+                for item in properties.get(collection) or []:
+                    item['id'] = '{0}/{1}/{2}'.format(resource_id, collection, item.get('name'))
+                    item.setdefault('properties', dict())['provisioningState'] = 'Succeeded'
+                    item['etag'] = resource['etag']
+        else:
+            resource['location'] = 'global'
+            properties['profileStatus'] = properties.get('profileStatus') or 'Enabled'
+            properties['trafficViewEnrollmentStatus'] = properties.get('trafficViewEnrollmentStatus') or 'Disabled'
+            dns_config = properties.setdefault('dnsConfig', dict())
+            dns_config['fqdn'] = '{0}.trafficmanager.net'.format(dns_config.get('relativeName') or name)
+            properties.setdefault('monitorConfig', dict())['profileMonitorStatus'] = 'Online'
+            for endpoint in properties.get('endpoints') or []:
+                endpoint['id'] = '{0}/{1}/{2}'.format(resource_id, endpoint['type'].split('/')[-1], endpoint['name'])
+                endpoint.setdefault('properties', dict()).setdefault('endpointStatus', 'Enabled')
+                endpoint['properties'].setdefault('endpointMonitorStatus', 'Online')
+        return self.state.put(resource)
+
+    def start_operation(self, action, resource_id, resource, status=202):
+        # Long running operation polled args.lro_polls times before it completes
+        operation_id = str(uuid.UUID(int=self.state.random.getrandbits(128)))
+        self.state.operations[operation_id] = dict(action=action, resource_id=resource_id, polls=self.state.args.lro_polls)
+        headers = {'Azure-AsyncOperation': '{0}/operations/{1}'.format(self.base_url, operation_id),
+                   'Retry-After': str(self.state.args.retry_after)}
+        if action == 'delete':
+            headers['Location'] = headers['Azure-AsyncOperation']
+            return self.reply(202, None, headers)
+        return self.reply(status, resource, headers)
+
+    def operation(self, operation_id):
+        with self.state.lock:
+            operation = self.state.operations.get(operation_id)
+            if operation is None:
+                return self.reply(404, error('NotFound', 'Operation {0} not found'.format(operation_id)))
+            if operation['polls'] > 0:
+                operation['polls'] -= 1
+                return self.reply(200 if operation['action'] == 'put' else 202, dict(status='InProgress'),
+                                  {'Retry-After': str(self.state.args.retry_after)})
+            resource = self.state.get(operation['resource_id'])
+            if operation['action'] == 'delete':
+                self.state.delete(operation['resource_id'])
+            elif resource is not None:
+                resource['properties']['provisioningState'] = 'Succeeded'
+            self.state.operations.pop(operation_id)
+            return self.reply(200, dict(status='Succeeded'))
+
+    def page(self, items):
+        token = self.query.get('$skiptoken', ['0'])[0]
+        try:
+            skip = int(token)
+        except ValueError:
+            skip = -1
+        if skip < 0:
+            return self.reply(400, error('BadRequest', 'The $skiptoken {0} is not valid.'.format(token)))
+        size = self.state.args.page_size
+        result = dict(value=[copy.deepcopy(item) for item in items[skip:skip + size]])
+        for item in result['value']:
+            item.get('properties', dict()).pop('powerState', None)
+        if skip + size < len(items):
+            url = urlsplit(self.path)
+            query = '&'.join(part for part in url.query.split('&') if part and not part.startswith('$skiptoken='))
+            result['nextLink'] = '{0}{1}?{2}$skiptoken={3}'.format(self.base_url, url.path, query + '&' if query else '', skip + size)
+        return self.reply(200, result)
+
+    def metadata(self):
+        return dict(galleryEndpoint=self.base_url, graphEndpoint=self.base_url, portalEndpoint=self.base_url,
+                    authentication=dict(loginEndpoint=self.base_url, audiences=[self.base_url]), name='ArmServer',
+                    resourceManager=self.base_url)
+
+    def count(self, method, kind):
+        with self.state.lock:
+            self.state.stats['{0} {1}'.format(method, kind)] += 1
+
+    def reply(self, status, body, headers=None):
+        content = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('x-ms-request-id', str(uuid.uuid4()))
+        for key, value in (headers or dict()).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+
+def invalid_body(kind, body):
+    # Message of the 400 answered to a body the stand-in could not store, as ARM rejects it, None when it is valid
+    if not isinstance(body, dict) or not isinstance(body.get('properties', dict()), dict):
+        return 'The request body must be a JSON object with an object of properties'
+    if kind == 'microsoft.network/trafficmanagerprofiles':
+        endpoints = body.get('properties', dict()).get('endpoints') or []
+        if not isinstance(endpoints, list):
+            return 'properties.endpoints must be an array'
+        for index, endpoint in enumerate(endpoints):
+            if not isinstance(endpoint, dict):
+                return 'properties.endpoints[{0}] must be an object'.format(index)
+            for key in ('name', 'type'):
+                if not isinstance(endpoint.get(key), str) or not endpoint[key]:
+                    return 'properties.endpoints[{0}].{1} is required'.format(index, key)
+            if not endpoint['type'].lower().startswith('microsoft.network/trafficmanagerprofiles/'):
+                return 'properties.endpoints[{0}].type {1} is not a Traffic Manager endpoint type'.format(index, endpoint['type'])
+    return None
+
+
+def error(code, message):
+    return dict(error=dict(code=code, message=message))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Serve a local stand-in for the Azure Resource Manager endpoints used by this repo')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0, help='0 picks a free port')
+    parser.add_argument('--certfile', help='serve HTTPS with this certificate')
+    parser.add_argument('--keyfile')
+    parser.add_argument('--subscription', default='00000000-0000-0000-0000-000000000000')
+    parser.add_argument('--resource-group', default='rg-bench')
+    parser.add_argument('--location', default='australiaeast')
+    parser.add_argument('--vms', type=int, default=100, help='virtual machines to create, each with a network interface')
+    parser.add_argument('--public-ratio', type=float, default=0.5, help='share of the virtual machines with a public IP address')
+    parser.add_argument('--stopped-ratio', type=float, default=0.1, help='share of the virtual machines deallocated')
+    parser.add_argument('--page-size', type=int, default=50, help='items per page of list responses')
+    parser.add_argument('--latency', type=float, default=0.0, help='milliseconds added to each response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random milliseconds added to or removed from the latency')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='share of requests answered with 429')
+    parser.add_argument('--retry-after', type=int, default=0, help='Retry-After seconds of throttled and long running responses')
+    parser.add_argument('--lro-polls', type=int, default=1, help='polls before a long running operation completes')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true')
+    return parser.parse_args(argv)
+
+
+def serve(args, ready=None):
+    '''
+    Create and run the server. ready, when given, is called with the server and its base URL once it listens.
+    '''
+    state = ArmState(args)
+    server = ThreadingServer((args.host, args.port), ArmHandler)
+    scheme = 'http'
+    if args.certfile:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(args.certfile, args.keyfile)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        scheme = 'https'
+    base_url = '{0}://{1}:{2}'.format(scheme, args.host, server.server_address[1])
+    handler = type('BoundArmHandler', (ArmHandler,), dict(state=state, base_url=base_url))
+    server.RequestHandlerClass = handler
+    state.seed(base_url)
+    if ready is not None:
+        ready(server, base_url)
+    server.serve_forever()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    def ready(server, base_url):
+        print(base_url)
+        sys.stdout.flush()
+
+    try:
+        serve(args, ready)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
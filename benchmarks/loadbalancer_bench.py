@@ -0,0 +1,525 @@
+#!/usr/bin/env python
+# Offline benchmark and regression run of azure_rm_loadbalancer_c.
+#
+# The module is driven through exec_module against an in-memory network client, so neither Ansible,
+# the Azure SDK nor an Azure subscription is needed. For every size, a synthetic load balancer with
+# that many load balancing rules and inbound NAT rules, and an inbound NAT pool, goes through the create,
+# no-op, etag cache, snapshot cache, drift report, modify and delete scenarios. Wall time, peak traced
+# memory, the number of memory blocks the scenario leaves allocated, the number of SDK calls and the
+# number of whole load balancer serializations are reported.
+#
+#   python benchmarks/loadbalancer_bench.py --sizes 1,100,1000,5000
+#   python benchmarks/loadbalancer_bench.py --check --json results.json
+#   python benchmarks/loadbalancer_bench.py --baseline results.json --tolerance 0.25
+#   python benchmarks/loadbalancer_bench.py --sizes 100 --record lb.json.gz
+#   python benchmarks/loadbalancer_bench.py --sizes 100 --replay lb.json.gz --check
+#
+# The module gets its network client from the client pool of module_utils. --record records the calls made
+# through it into a fixture of sdk_fixtures.py, --replay serves them from the fixture instead of the fake client.
+#
+# --check fails when a scenario reports an unexpected 'changed' or drift, makes more SDK calls or serializations
+# than expected, or when a check of the rollout steps, profile waves or inventory cache helpers fails.
+# --baseline fails when a scenario is slower than a saved --json run by more than --tolerance.
+
+import argparse
+import copy
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+from collections import Counter
+
+from sdk_fixtures import Fixture, install, load_client_pool
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULE_PATH = os.path.join(REPO_PATH, 'azure_rm_loadbalancer_c.py')
+TRAFFIC_MANAGER_PATH = os.path.join(REPO_PATH, 'azure_rm_trafficmanagerprofile.py')
+HELPERS_PATH = os.path.join(REPO_PATH, 'module_utils', 'azure_rm_helpers.py')
+INVENTORY_CACHE_PATH = os.path.join(REPO_PATH, 'module_utils', 'azure_rm_inventory_cache.py')
+SUBSCRIPTION_ID = '00000000-0000-0000-0000-000000000000'
+RESOURCE_GROUP = 'rg-bench'
+LOCATION = 'australiaeast'
+
+# SDK calls expected per scenario, as counted by the fake network client, and load_balancer_to_dict calls:
+# the results state is serialized once, a state read from a cache file is not serialized again.
+EXPECTED = dict(
+    create=dict(changed=True, serializations=1, calls={'resource_groups.get': 1, 'load_balancers.get': 1, 'public_ip_addresses.get': 1,
+                                                       'load_balancers.create_or_update': 1}),
+    noop=dict(changed=False, serializations=1, calls={'resource_groups.get': 1, 'load_balancers.get': 1}),
+    etag_prime=dict(changed=False, serializations=1, calls={'resource_groups.get': 1, 'load_balancers.get': 1}),
+    etag_304=dict(changed=False, serializations=0, calls={'resource_groups.get': 1, 'load_balancers.get': 1}),
+    snapshot_prime=dict(changed=False, serializations=1, calls={'resource_groups.get': 1, 'load_balancers.list': 1}),
+    snapshot_hit=dict(changed=False, serializations=0, calls={}),
+    drift=dict(changed=False, drifted=False, serializations=0, calls={'load_balancers.list': 1}),
+    modify=dict(changed=True, serializations=1, calls={'resource_groups.get': 1, 'load_balancers.get': 1, 'public_ip_addresses.get': 1,
+                                                       'load_balancers.create_or_update': 1}),
+    delete=dict(changed=True, serializations=0, calls={'load_balancers.delete': 1}),
+)
+
+# NAT rules Azure derives from each inbound NAT pool, one per scale set instance using the pool
+POOL_INSTANCES = 2
+
+
+class Model(object):
+    # Stand-in for msrest models: keyword arguments become attributes, unknown attributes are None.
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return None
+
+    def as_dict(self):
+        def plain(value):
+            if isinstance(value, Model):
+                return value.as_dict()
+            if isinstance(value, list):
+                return [plain(item) for item in value]
+            return value
+        return dict((key, plain(value)) for key, value in self.__dict__.items() if value is not None)
+
+
+class CloudError(Exception):
+
+    def __init__(self, status_code, message=''):
+        super(CloudError, self).__init__(message)
+        self.status_code = status_code
+
+
+class ModuleFailed(Exception):
+    pass
+
+
+class Poller(object):
+
+    def __init__(self, result=None):
+        self._result = result
+
+    def wait(self):
+        return None
+
+    def result(self):
+        return self._result
+
+
+class FakeOperations(object):
+    # Operation group of the fake client, named like the SDK ones so that sdk_fixtures records its calls
+
+    def __init__(self, client, group):
+        self.client = client
+        self.group = group
+
+    def count(self, operation):
+        self.client.calls['{0}.{1}'.format(self.group, operation)] += 1
+
+
+class FakeLoadBalancersOperations(FakeOperations):
+
+    def get(self, resource_group_name, load_balancer_name, expand=None, custom_headers=None):
+        self.count('get')
+        load_balancer = self.client.store.get((resource_group_name, load_balancer_name))
+        if load_balancer is None:
+            raise CloudError(404, 'load balancer {0} not found'.format(load_balancer_name))
+        if custom_headers and custom_headers.get('If-None-Match') == load_balancer.etag:
+            raise CloudError(304)
+        return load_balancer
+
+    def list(self, resource_group_name):
+        self.count('list')
+        return [lb for (rg, name), lb in self.client.store.items() if rg == resource_group_name]
+
+    def create_or_update(self, resource_group_name, load_balancer_name, parameters):
+        self.count('create_or_update')
+        load_balancer = self.client.provision(resource_group_name, load_balancer_name, parameters)
+        return Poller(load_balancer)
+
+    def delete(self, resource_group_name, load_balancer_name):
+        self.count('delete')
+        self.client.store.pop((resource_group_name, load_balancer_name), None)
+        return Poller()
+
+
+class FakePublicIPAddressesOperations(FakeOperations):
+
+    def get(self, resource_group_name, public_ip_address_name):
+        self.count('get')
+        return Model(id='/subscriptions/{0}/resourceGroups/{1}/providers/Microsoft.Network/publicIPAddresses/{2}'.format(
+            SUBSCRIPTION_ID, resource_group_name, public_ip_address_name), location=LOCATION,
+            public_ip_allocation_method='Static', ip_address='203.0.113.10')
+
+
+class FakeSubnetsOperations(FakeOperations):
+
+    def get(self, resource_group_name, virtual_network_name, subnet_name):
+        self.count('get')
+        return Model(id='/subscriptions/{0}/resourceGroups/{1}/providers/Microsoft.Network/virtualNetworks/{2}/subnets/{3}'.format(
+            SUBSCRIPTION_ID, resource_group_name, virtual_network_name, subnet_name), name=subnet_name, address_prefix='10.0.0.0/24')
+
+
+class FakeNetworkClient(object):
+    # In-memory network client which stores load balancers the way Azure returns them.
+
+    CHILDREN = dict(frontend_ip_configurations='frontendIPConfigurations', backend_address_pools='backendAddressPools',
+                    load_balancing_rules='loadBalancingRules', probes='probes', inbound_nat_rules='inboundNatRules',
+                    inbound_nat_pools='inboundNatPools')
+
+    def __init__(self):
+        self.calls = Counter()
+        self.store = dict()
+        self.version = 0
+        self.load_balancers = FakeLoadBalancersOperations(self, 'load_balancers')
+        self.public_ip_addresses = FakePublicIPAddressesOperations(self, 'public_ip_addresses')
+        self.subnets = FakeSubnetsOperations(self, 'subnets')
+
+    def provision(self, resource_group_name, load_balancer_name, parameters):
+        self.version += 1
+        load_balancer = copy.deepcopy(parameters)
+        load_balancer.id = '/subscriptions/{0}/resourceGroups/{1}/providers/Microsoft.Network/loadBalancers/{2}'.format(
+            SUBSCRIPTION_ID, resource_group_name, load_balancer_name)
+        load_balancer.name = load_balancer_name
+        load_balancer.etag = 'W/"{0}"'.format(self.version)
+        load_balancer.provisioning_state = 'Succeeded'
+        for attribute, child_type in self.CHILDREN.items():
+            for child in getattr(load_balancer, attribute) or []:
+                child.id = '{0}/{1}/{2}'.format(load_balancer.id, child_type, child.name)
+                child.etag = load_balancer.etag
+                child.provisioning_state = 'Succeeded'
+        for child in load_balancer.frontend_ip_configurations or []:
+            if child.private_ip_allocation_method is None:
+                child.private_ip_allocation_method = 'Dynamic'
+        for pool in load_balancer.inbound_nat_pools or []:
+            load_balancer.inbound_nat_rules = (load_balancer.inbound_nat_rules or []) + [Model(
+                id='{0}/inboundNatRules/{1}.{2}'.format(load_balancer.id, pool.name, instance), name='{0}.{1}'.format(pool.name, instance),
+                frontend_ip_configuration=pool.frontend_ip_configuration, protocol=pool.protocol,
+                frontend_port=pool.frontend_port_range_start + instance, backend_port=pool.backend_port, idle_timeout_in_minutes=4,
+                etag=load_balancer.etag, provisioning_state='Succeeded') for instance in range(POOL_INSTANCES)]
+        self.store[(resource_group_name, load_balancer_name)] = load_balancer
+        return load_balancer
+
+
+def apply_spec(spec, params):
+    """Fill in defaults and nested options the way AnsibleModule does for the options used here"""
+    result = dict()
+    for key, option in spec.items():
+        value = params.get(key)
+        if value is None:
+            value = copy.deepcopy(option.get('default'))
+        if value is not None and option.get('options'):
+            if option.get('type') == 'list':
+                value = [apply_spec(option['options'], item) for item in value]
+            else:
+                value = apply_spec(option['options'], value)
+        if value is not None and option.get('type') == 'str' and not isinstance(value, str):
+            value = str(value)
+        result[key] = value
+    return result
+
+
+def install_fakes(client):
+    """Register stand-ins for the Ansible and Azure packages the module imports"""
+
+    class AzureRMModuleBase(object):
+        params = None
+
+        @property
+        def network_client(self):
+            return self._network_client
+
+        def __init__(self, derived_arg_spec, supports_check_mode=False, **kwargs):
+            spec = dict(derived_arg_spec, tags=dict(type='dict'), append_tags=dict(type='bool', default=True))
+            params = apply_spec(spec, AzureRMModuleBase.params)
+            self.check_mode = False
+            self.subscription_id = SUBSCRIPTION_ID
+            self._network_client = client
+            self.append_tags = params['append_tags']
+            self.module_tags = params['tags']
+            self.result = self.exec_module(**params)
+
+        def fail(self, msg, **kwargs):
+            raise ModuleFailed(msg)
+
+        def log(self, msg, pretty_print=False):
+            pass
+
+        def get_resource_group(self, resource_group):
+            client.calls['resource_groups.get'] += 1
+            return Model(name=resource_group, location=LOCATION)
+
+        def check_provisioning_state(self, azure_object, requested_state='present'):
+            if azure_object.provisioning_state != 'Succeeded' and requested_state != 'absent':
+                self.fail('Error {0} has a provisioning state of {1}.'.format(azure_object.name, azure_object.provisioning_state))
+
+        def update_tags(self, tags):
+            tags = tags or dict()
+            new_tags = dict(tags)
+            changed = False
+            for key, value in (self.module_tags or dict()).items():
+                if new_tags.get(key) != value:
+                    new_tags[key] = value
+                    changed = True
+            if not self.append_tags:
+                for key in tags:
+                    if key not in (self.module_tags or dict()):
+                        new_tags.pop(key)
+                        changed = True
+            return changed, new_tags
+
+    def package(name, **attributes):
+        module = types.ModuleType(name)
+        module.__dict__.update(attributes)
+        module.__path__ = []
+        sys.modules[name] = module
+        return module
+
+    models = dict((name, type(name, (Model,), dict())) for name in (
+        'LoadBalancer', 'FrontendIPConfiguration', 'BackendAddressPool', 'Probe', 'LoadBalancingRule', 'SubResource',
+        'InboundNatPool', 'InboundNatRule', 'Subnet'))
+    package('ansible')
+    package('ansible.module_utils')
+    package('ansible.module_utils.azure_rm_common', AzureRMModuleBase=AzureRMModuleBase)
+    # the shared helpers of module_utils are the real ones
+    spec = importlib.util.spec_from_file_location('ansible.module_utils.azure_rm_helpers', HELPERS_PATH)
+    helpers = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(helpers)
+    sys.modules['ansible.module_utils.azure_rm_helpers'] = helpers
+    # and so is the client pool, through which the module gets the network client
+    load_client_pool()
+    package('msrestazure')
+    package('msrestazure.azure_exceptions', CloudError=CloudError)
+    package('azure')
+    package('azure.mgmt')
+    package('azure.mgmt.network')
+    package('azure.mgmt.network.models', **models)
+    return AzureRMModuleBase
+
+
+def load_module(name='azure_rm_loadbalancer_c', path=MODULE_PATH):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def count_serializations(module):
+    """Count the calls of load_balancer_to_dict, each of which serializes a whole load balancer"""
+    counter = Counter()
+    serialize = module.load_balancer_to_dict
+
+    def load_balancer_to_dict(load_balancer):
+        counter['serializations'] += 1
+        return serialize(load_balancer)
+
+    module.load_balancer_to_dict = load_balancer_to_dict
+    return counter
+
+
+def synthetic_params(size, idle_timeout=15):
+    """Parameters of a load balancer with size load balancing rules and size inbound NAT rules"""
+    return dict(
+        resource_group=RESOURCE_GROUP,
+        name='lb-bench-{0}'.format(size),
+        frontend_ip_configs=[dict(name='frontend', public_ip_name='pip-bench')],
+        backend_pools=['backend'],
+        health_probes=[dict(name='probe', protocol='Tcp', port=80)],
+        load_balancing_rules=[dict(name='rule-{0}'.format(index), frontend_name='frontend', backend_name='backend', probe_name='probe',
+                                   frontend_port=1000 + index, backend_port=8000 + index % 1000, idle_timeout=idle_timeout)
+                              for index in range(size)],
+        inbound_nat_rules=[dict(name='nat-{0}'.format(index), frontend_name='frontend', frontend_port=20000 + index, backend_port=22)
+                           for index in range(size)],
+        inbound_nat_pools=[dict(name='pool', frontend_name='frontend', frontend_port_range='50000-50099', backend_port=3389)],
+    )
+
+
+def drift_params(size):
+    """Parameters of a drift report of the synthetic load balancer of size"""
+    spec = synthetic_params(size)
+    resource_group = spec.pop('resource_group')
+    return dict(resource_group=resource_group, drift_report=[spec])
+
+
+def run_scenario(module, base, client, serializations, params):
+    base.params = params
+    client.calls.clear()
+    serializations.clear()
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = module.AzureRMLoadBalancer().result
+        seconds = time.perf_counter() - start
+        # blocks allocated by the scenario and still referenced, mostly by its result
+        blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+    finally:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return dict(seconds=round(seconds, 4), peak_kib=peak // 1024, blocks=blocks, changed=result['changed'], calls=dict(client.calls),
+                serializations=serializations['serializations'], metrics_calls=result['metrics']['calls'],
+                drifted=any(drift['drifted'] for drift in result.get('drift', [])))
+
+
+def run(sizes, fixture=None, replay=False):
+    client = FakeNetworkClient()
+    base = install_fakes(client)
+    if fixture is not None:
+        install(sys.modules['ansible.module_utils.azure_rm_client_pool'].CLIENT_POOL, fixture, replay)
+    module = load_module()
+    serializations = count_serializations(module)
+    results = []
+    for size in sizes:
+        scenarios = [
+            ('create', synthetic_params(size)),
+            ('noop', synthetic_params(size)),
+            ('etag_prime', dict(synthetic_params(size), etag_cache=True)),
+            ('etag_304', dict(synthetic_params(size), etag_cache=True)),
+            ('snapshot_prime', dict(synthetic_params(size), snapshot_cache=True)),
+            ('snapshot_hit', dict(synthetic_params(size), snapshot_cache=True)),
+            ('drift', drift_params(size)),
+            ('modify', synthetic_params(size, idle_timeout=20)),
+            ('delete', dict(synthetic_params(size), state='absent')),
+        ]
+        for scenario, params in scenarios:
+            measurement = run_scenario(module, base, client, serializations, params)
+            measurement.update(scenario=scenario, size=size)
+            results.append(measurement)
+    return results
+
+
+def check(results):
+    errors = []
+    for result in results:
+        expected = EXPECTED[result['scenario']]
+        name = '{0}/{1}'.format(result['scenario'], result['size'])
+        if result['changed'] != expected['changed']:
+            errors.append('{0}: changed is {1}, expected {2}'.format(name, result['changed'], expected['changed']))
+        if result['drifted'] != expected.get('drifted', False):
+            errors.append('{0}: drifted is {1}, expected {2}'.format(name, result['drifted'], expected.get('drifted', False)))
+        if result['serializations'] > expected['serializations']:
+            errors.append('{0}: {1} serializations, expected at most {2}'.format(name, result['serializations'], expected['serializations']))
+        for operation, count in result['calls'].items():
+            if count > expected['calls'].get(operation, 0):
+                errors.append('{0}: {1} calls of {2}, expected at most {3}'.format(name, count, operation, expected['calls'].get(operation, 0)))
+        if result['metrics_calls'] < sum(result['calls'].values()):
+            errors.append('{0}: metrics report {1} calls, the client saw {2}'.format(name, result['metrics_calls'], sum(result['calls'].values())))
+    return errors
+
+
+def check_helpers():
+    """Check the helpers the scenarios do not exercise against known answers"""
+    errors = []
+    traffic_manager = load_module('azure_rm_trafficmanagerprofile', TRAFFIC_MANAGER_PATH)
+    rollouts = [
+        (dict(a=100, b=0), dict(), dict(a=50, b=50), 25, [dict(a=75, b=25), dict(a=50, b=50)]),
+        (dict(a=100, b=0), dict(b=10), dict(a=70, b=30), 10, [dict(b=10), dict(a=90, b=20), dict(a=80, b=30), dict(a=70)]),
+        (dict(a=50, b=50), dict(b=0), dict(a=50, b=50), 10, []),
+    ]
+    for current, start, target, step, expected in rollouts:
+        steps = traffic_manager.rollout_steps(current, start, target, step)
+        if steps != expected:
+            errors.append('rollout_steps from {0} to {1}: {2}, expected {3}'.format(current, target, steps, expected))
+
+    def profile(name, state='present', nested=()):
+        return dict(name=name, resource_group=RESOURCE_GROUP, state=state, endpoints=[dict(
+            name=child, type='nestedEndpoints',
+            target_resource_id='/subscriptions/{0}/resourceGroups/{1}/providers/Microsoft.Network/trafficManagerProfiles/{2}'.format(
+                SUBSCRIPTION_ID, RESOURCE_GROUP, child)) for child in nested])
+
+    # profile_waves only reads the prefetched profiles, so the module is not run
+    module = traffic_manager.AzureRMTrafficManager.__new__(traffic_manager.AzureRMTrafficManager)
+    module.prefetched = dict()
+    batches = [
+        ([profile('parent', nested=['child']), profile('child')], [['child'], ['parent']]),
+        ([profile('parent', nested=['child']), profile('child', state='absent')], [['parent'], ['child']]),
+        ([profile('b'), profile('a')], [['a', 'b']]),
+    ]
+    for specs, expected in batches:
+        waves = [[spec['name'] for spec in wave] for wave in module.profile_waves(specs)]
+        if waves != expected:
+            errors.append('profile_waves of {0}: {1}, expected {2}'.format([spec['name'] for spec in specs], waves, expected))
+
+    inventory_cache = load_module('azure_rm_inventory_cache', INVENTORY_CACHE_PATH)
+    hosts = [('10.0.0.5', dict(name='vm-b', location=LOCATION, public_ip=None, tags=dict(env='dev', role='web'))),
+             ('10.0.0.4', dict(name='vm-a', location=LOCATION, public_ip='203.0.113.4', tags=dict(env='prod')))]
+    query = dict(rg=RESOURCE_GROUP)
+    path = os.path.join(tempfile.gettempdir(), 'inventory.cache')
+    inventory_cache.write_inventory_cache(path, hosts, ['azure'], query)
+    cache = inventory_cache.fresh_inventory_cache(path, 60, query)
+    if cache is None:
+        errors.append('inventory cache: not read back')
+    else:
+        expected = dict(_meta=dict(hostvars=dict(hosts)), azure=[host for host, _ in hosts])
+        if cache.to_inventory() != expected:
+            errors.append('inventory cache: {0}, expected {1}'.format(cache.to_inventory(), expected))
+        if cache.hostvars('10.0.0.4') != hosts[1][1] or cache.hostvars('10.0.0.6') is not None:
+            errors.append('inventory cache: hostvars do not match the written hosts')
+        if cache.select('tags.env', 'dev') != ['10.0.0.5'] or cache.select('tags.env', 'test') != []:
+            errors.append('inventory cache: select of tags.env does not match the written hosts')
+        cache.close()
+    if inventory_cache.fresh_inventory_cache(path, 60, dict(rg='other')) is not None:
+        errors.append('inventory cache: read back for another query')
+    return errors
+
+
+def compare(results, baseline, tolerance):
+    errors = []
+    previous = dict(((item['scenario'], item['size']), item) for item in baseline)
+    for result in results:
+        before = previous.get((result['scenario'], result['size']))
+        if before and result['seconds'] > before['seconds'] * (1 + tolerance) and result['seconds'] - before['seconds'] > 0.01:
+            errors.append('{0}/{1}: {2}s, baseline {3}s'.format(result['scenario'], result['size'], result['seconds'], before['seconds']))
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmark of azure_rm_loadbalancer_c')
+    parser.add_argument('--sizes', default='1,10,100,1000,5000', help='comma separated numbers of rules and NAT rules')
+    parser.add_argument('--check', action='store_true', help='fail on unexpected results or SDK call counts')
+    parser.add_argument('--json', help='write the measurements to this file')
+    parser.add_argument('--baseline', help='fail when slower than the measurements of this file')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown against the baseline, default 0.25')
+    fixtures = parser.add_mutually_exclusive_group()
+    fixtures.add_argument('--record', help='record the SDK calls of the module into this fixture')
+    fixtures.add_argument('--replay', help='serve the SDK calls of the module from this fixture')
+    args = parser.parse_args()
+
+    # keep the snapshot and etag cache files of the module away from the real temporary directory
+    tempfile.tempdir = tempfile.mkdtemp(prefix='loadbalancer_bench-')
+    sizes = [int(size) for size in args.sizes.split(',')]
+    if args.record:
+        fixture = Fixture()
+        try:
+            results = run(sizes, fixture)
+        finally:
+            fixture.save(args.record)
+    elif args.replay:
+        results = run(sizes, Fixture.load(args.replay, error_factory=CloudError), replay=True)
+    else:
+        results = run(sizes)
+
+    row = '{0:<14} {1:>6} {2:>10} {3:>10} {4:>10} {5:>6} {6:>14} {7:>8}'
+    print(row.format('scenario', 'size', 'seconds', 'peak_kib', 'blocks', 'calls', 'serializations', 'changed'))
+    for result in results:
+        print(row.format(result['scenario'], result['size'], result['seconds'], result['peak_kib'], result['blocks'],
+                         sum(result['calls'].values()), result['serializations'], str(result['changed'])))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    errors = []
+    if args.check:
+        errors.extend(check(results))
+        errors.extend(check_helpers())
+    if args.baseline:
+        with open(args.baseline) as f:
+            errors.extend(compare(results, json.load(f), args.tolerance))
+    for error in errors:
+        print('FAIL ' + error)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
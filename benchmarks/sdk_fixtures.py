@@ -0,0 +1,412 @@
+#!/usr/bin/env python
+# Record and replay of the Azure SDK calls made by the modules and inventory scripts of this repo.
+#
+# Clients handed out by the shared client pool (module_utils/azure_rm_client_pool.py) are wrapped by a
+# recording proxy: every operation call is stored with its arguments, its duration and its result, long
+# running operations resolved and paged lists item by item as the caller reads them, into a gzipped JSON
+# fixture. Replay serves the same calls from the fixture, optionally with the recorded latency, without
+# credentials or network access.
+#
+#   python benchmarks/sdk_fixtures.py record fixture.json.gz -- inventory/inventory.py --list
+#   python benchmarks/sdk_fixtures.py replay fixture.json.gz --latency recorded -- inventory/inventory.py --list
+#   python benchmarks/sdk_fixtures.py counts fixture.json.gz
+#   python benchmarks/sdk_fixtures.py compare before.json.gz after.json.gz
+#
+# From Python, e.g. in a benchmark driving a module through exec_module:
+#
+#   fixture = Fixture.load('lb.json.gz', latency='none')
+#   install(load_client_pool().CLIENT_POOL, fixture, replay=True)
+#
+# load_client_pool registers the pool of module_utils as ansible.module_utils.azure_rm_client_pool too, so that
+# the modules, which import it under that name, use the pool install patches.
+
+import argparse
+import gzip
+import json
+import os
+import runpy
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+MODULE_UTILS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'module_utils')
+
+
+class FixtureModel(dict):
+    # Replayed SDK model: attribute access on the recorded as_dict() of the model. Nested models are recorded as
+    # plain dicts by as_dict(), so every replayed dict is a FixtureModel, which still works for dicts like tags.
+
+    def __init__(self, values):
+        super(FixtureModel, self).__init__((key, to_replayed(value)) for key, value in values.items())
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return self.get(name)
+
+    def as_dict(self):
+        return dict((key, from_replayed(value)) for key, value in self.items())
+
+
+class FixturePoller(object):
+    # Replayed long running operation, already complete
+
+    def __init__(self, result):
+        self._result = result
+
+    def wait(self, timeout=None):
+        return None
+
+    def result(self, timeout=None):
+        return self._result
+
+    def done(self):
+        return True
+
+
+class FixtureError(Exception):
+    # Replayed SDK error, when msrestazure is not installed
+
+    def __init__(self, status_code, message):
+        super(FixtureError, self).__init__(message)
+        self.status_code = status_code
+
+
+class FixtureMissing(KeyError):
+    pass
+
+
+class FixtureResponse(object):
+    # HTTP response of a replayed error, read by CloudError like the requests.Response of an ARM error
+
+    _content_consumed = True
+
+    def __init__(self, status_code, message):
+        self.status_code = status_code
+        self.reason = message
+        self.headers = {'content-type': 'application/json'}
+        self.text = json.dumps(dict(error=dict(code=str(status_code), message=message)))
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        pass
+
+
+def cloud_error(status_code, message):
+    '''
+    Default error factory: the CloudError raised by the SDK, which the modules catch, with the recorded status code.
+    '''
+    try:
+        from msrestazure.azure_exceptions import CloudError
+    except ImportError:
+        return FixtureError(status_code, message)
+    return CloudError(FixtureResponse(status_code, message))
+
+
+def to_plain(value):
+    '''
+    JSON form of an SDK call result: models as marked dicts, paged lists as lists, pollers by their result.
+    '''
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if hasattr(value, 'as_dict'):
+        return {'__model__': value.as_dict()}
+    if isinstance(value, dict):
+        return dict((key, to_plain(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [to_plain(item) for item in value]
+    if hasattr(value, 'advance_page') or hasattr(value, '__next__'):
+        return {'__paged__': [to_plain(item) for item in value]}
+    return repr(value)
+
+
+def to_replayed(value):
+    if isinstance(value, dict):
+        if '__model__' in value:
+            return FixtureModel(value['__model__'])
+        if '__paged__' in value:
+            return [to_replayed(item) for item in value['__paged__']]
+        if '__poller__' in value:
+            return FixturePoller(to_replayed(value['__poller__']))
+        return FixtureModel(value)
+    if isinstance(value, list):
+        return [to_replayed(item) for item in value]
+    return value
+
+
+def from_replayed(value):
+    if isinstance(value, list):
+        return [from_replayed(item) for item in value]
+    if isinstance(value, dict):
+        return dict((key, from_replayed(item)) for key, item in value.items())
+    return value
+
+
+def call_key(operation, args, kwargs):
+    '''
+    Key of a call: the operation and its plain arguments. Model arguments, e.g. the body of a PUT, are not part of
+    the key, so that replay does not depend on the exact parameters built by the code under test.
+    '''
+    def plain(value):
+        if value is None or isinstance(value, (bool, int, float, str)):
+            return value
+        if isinstance(value, dict):
+            return dict((key, plain(item)) for key, item in value.items())
+        if isinstance(value, (list, tuple)):
+            return [plain(item) for item in value]
+        return '<{0}>'.format(type(value).__name__)
+    return json.dumps([operation, plain(list(args)), plain(kwargs)], sort_keys=True)
+
+
+class Fixture(object):
+    '''
+    Recorded calls, in call order, with a replay queue per call key.
+    latency is 'none' to replay immediately or 'recorded' to sleep for the recorded duration of each call.
+    error_factory builds the exception raised for a recorded error from its status code and message, a CloudError by default.
+    '''
+
+    def __init__(self, calls=None, latency='none', error_factory=None):
+        self.calls = calls or []
+        self.latency = latency
+        self.error_factory = error_factory
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.queues = defaultdict(list)
+        for call in self.calls:
+            self.queues[call['key']].append(call)
+
+    @classmethod
+    def load(cls, path, latency='none', error_factory=None):
+        with gzip.open(path, 'rt') as f:
+            return cls(json.load(f)['calls'], latency, error_factory)
+
+    def save(self, path):
+        with gzip.open(path, 'wt') as f:
+            json.dump(dict(version=1, calls=self.calls), f, separators=(',', ':'), sort_keys=True)
+
+    def record(self, operation, func, args, kwargs):
+        key = call_key(operation, args, kwargs)
+        start = time.time()
+        entry = dict(operation=operation, key=key)
+        try:
+            result = func(*args, **kwargs)
+            # Long running operations are resolved here, so that their duration is recorded. The items of paged lists
+            # are recorded as they are read, without fetching the pages the caller does not read.
+            if callable(getattr(result, 'wait', None)) and callable(getattr(result, 'result', None)):
+                result = FixturePoller(result.result())
+                entry['result'] = {'__poller__': to_plain(result.result())}
+            elif callable(getattr(result, 'advance_page', None)):
+                entry['result'] = {'__paged__': []}
+                result = RecordingPaged(result, self, entry)
+            else:
+                entry['result'] = to_plain(result)
+            return result
+        except Exception as exc:
+            message = getattr(exc, 'message', None)
+            entry['error'] = dict(status_code=getattr(exc, 'status_code', None),
+                                  message=message if isinstance(message, str) else str(exc))
+            raise
+        finally:
+            entry['seconds'] = round(time.time() - start, 4)
+            with self.lock:
+                self.calls.append(entry)
+                self.counts[operation] += 1
+
+    def replay(self, operation, args, kwargs):
+        key = call_key(operation, args, kwargs)
+        with self.lock:
+            self.counts[operation] += 1
+            queue = self.queues.get(key)
+            if not queue:
+                raise FixtureMissing('No recorded call for {0}'.format(key))
+            # Successive identical calls replay successive recordings, the last one repeats
+            entry = queue.pop(0) if len(queue) > 1 else queue[0]
+        if self.latency == 'recorded':
+            time.sleep(entry['seconds'])
+        if 'error' in entry:
+            factory = self.error_factory or cloud_error
+            raise factory(entry['error']['status_code'], entry['error']['message'])
+        return to_replayed(entry['result'])
+
+    def summary(self):
+        return dict(calls=sum(self.counts.values()), operations=dict(self.counts))
+
+
+class RecordingPaged(object):
+    # Paged list of a recorded call, recording each item when the caller reads it, and the time spent fetching pages
+
+    def __init__(self, paged, fixture, entry):
+        self._items = iter(paged)
+        self._paged = paged
+        self._fixture = fixture
+        self._entry = entry
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.time()
+        try:
+            item = next(self._items)
+        finally:
+            with self._fixture.lock:
+                self._entry['seconds'] = round(self._entry.get('seconds', 0) + time.time() - start, 4)
+        with self._fixture.lock:
+            self._entry['result']['__paged__'].append(to_plain(item))
+        return item
+
+    next = __next__
+
+    def __getattr__(self, attribute):
+        return getattr(self._paged, attribute)
+
+
+class RecordingProxy(object):
+    # Wrap a client or operation group, recording the calls of its operations
+
+    def __init__(self, target, fixture, name):
+        self._target = target
+        self._fixture = fixture
+        self._name = name
+
+    def __getattr__(self, attribute):
+        value = getattr(self._target, attribute)
+        name = '{0}.{1}'.format(self._name, attribute)
+        if type(value).__name__.endswith('Operations'):
+            return RecordingProxy(value, self._fixture, name)
+        if callable(value) and not attribute.startswith('_'):
+            return lambda *args, **kwargs: self._fixture.record(name, value, args, kwargs)
+        return value
+
+
+class ReplayClient(object):
+    # Stand-in for a client or operation group, answering its operations from a fixture
+
+    def __init__(self, fixture, name):
+        self._fixture = fixture
+        self._name = name
+
+    def __getattr__(self, attribute):
+        if attribute.startswith('_'):
+            raise AttributeError(attribute)
+        return ReplayClient(self._fixture, '{0}.{1}'.format(self._name, attribute))
+
+    def __call__(self, *args, **kwargs):
+        return self._fixture.replay(self._name, args, kwargs)
+
+
+def install(pool, fixture, replay=False):
+    '''
+    Make the client pool hand out recording proxies, or replay clients that never call their factory.
+    Calls are named after the kind of client, e.g. network.network_interfaces.get.
+    '''
+    get = pool.get
+
+    def recording_get(kind, credentials, subscription_id, factory):
+        return RecordingProxy(get(kind, credentials, subscription_id, factory), fixture, kind)
+
+    def replay_get(kind, credentials, subscription_id, factory):
+        return ReplayClient(fixture, kind)
+
+    pool.get = replay_get if replay else recording_get
+    return pool
+
+
+def load_client_pool():
+    '''
+    Import the client pool of module_utils as the inventory scripts do, and register it as
+    ansible.module_utils.azure_rm_client_pool, the name the modules import it under, so that install patches the
+    pool of both. Return the module.
+    '''
+    if MODULE_UTILS not in sys.path:
+        sys.path.insert(0, MODULE_UTILS)
+    import azure_rm_client_pool
+    sys.modules['ansible.module_utils.azure_rm_client_pool'] = azure_rm_client_pool
+    return azure_rm_client_pool
+
+
+def run_script(script, script_args):
+    sys.argv = [script] + list(script_args)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    try:
+        runpy.run_path(script, run_name='__main__')
+    except SystemExit as exc:
+        if exc.code not in (None, 0):
+            raise
+
+
+def replay_credentials():
+    # Credentials are not needed to replay: avoid the token request of the service principal credentials
+    for name in ('AZURE_SUBSCRIPTION_ID', 'AZURE_CLIENT_ID', 'AZURE_SECRET', 'AZURE_TENANT'):
+        os.environ.setdefault(name, 'replay')
+    try:
+        import azure.common.credentials
+    except ImportError:
+        return
+    azure.common.credentials.ServicePrincipalCredentials = lambda **kwargs: None
+
+
+def print_counts(counts):
+    for operation in sorted(counts):
+        print('{0:<60} {1:>8}'.format(operation, counts[operation]))
+    print('{0:<60} {1:>8}'.format('total', sum(counts.values())))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Record and replay the Azure SDK calls of the modules and inventory scripts')
+    commands = parser.add_subparsers(dest='command')
+    record = commands.add_parser('record', help='run a script against Azure and record its SDK calls')
+    record.add_argument('fixture')
+    record.add_argument('script', nargs=argparse.REMAINDER)
+    replay = commands.add_parser('replay', help='run a script with its SDK calls served from a fixture')
+    replay.add_argument('fixture')
+    replay.add_argument('--latency', choices=['none', 'recorded'], default='none')
+    replay.add_argument('script', nargs=argparse.REMAINDER)
+    counts = commands.add_parser('counts', help='print the number of calls per operation of a fixture')
+    counts.add_argument('fixture')
+    compare = commands.add_parser('compare', help='compare the calls per operation of two fixtures')
+    compare.add_argument('before')
+    compare.add_argument('after')
+    args = parser.parse_args(argv)
+
+    if args.command in ('record', 'replay'):
+        script = [item for item in args.script if item != '--']
+        if not script:
+            parser.error('a script to run is required')
+        pool = load_client_pool().CLIENT_POOL
+        if args.command == 'record':
+            fixture = Fixture()
+            install(pool, fixture)
+            try:
+                run_script(script[0], script[1:])
+            finally:
+                fixture.save(args.fixture)
+        else:
+            fixture = Fixture.load(args.fixture, latency=args.latency)
+            install(pool, fixture, replay=True)
+            replay_credentials()
+            start = time.time()
+            run_script(script[0], script[1:])
+            summary = dict(fixture.summary(), seconds=round(time.time() - start, 3))
+            sys.stderr.write(json.dumps(summary, sort_keys=True) + '\n')
+    elif args.command == 'counts':
+        print_counts(Counter(call['operation'] for call in Fixture.load(args.fixture).calls))
+    elif args.command == 'compare':
+        before = Counter(call['operation'] for call in Fixture.load(args.before).calls)
+        after = Counter(call['operation'] for call in Fixture.load(args.after).calls)
+        for operation in sorted(set(before) | set(after)):
+            print('{0:<60} {1:>8} {2:>8} {3:>+8}'.format(operation, before[operation], after[operation],
+                                                         after[operation] - before[operation]))
+        print('{0:<60} {1:>8} {2:>8} {3:>+8}'.format('total', sum(before.values()), sum(after.values()),
+                                                     sum(after.values()) - sum(before.values())))
+    else:
+        parser.print_help()
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -14,6 +14,17 @@ from azure.mgmt.network import NetworkManagementClient
 from azure.common.credentials import ServicePrincipalCredentials
 from azure.mgmt.network import NetworkManagementClient
 import logging
+from multiprocessing.pool import ThreadPool
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'module_utils'))
+try:
+    from azure_rm_client_pool import CLIENT_POOL
+except ImportError:
+    CLIENT_POOL = None
+try:
+    from azure_rm_inventory_cache import fresh_inventory_cache, write_inventory_cache
+except ImportError:
+    fresh_inventory_cache = write_inventory_cache = None
 logger=logging.getLogger('msrestazure.azure_active_directory')
 logger.addHandler(logging.NullHandler())
 
@@ -51,13 +62,50 @@ def get_resource_group(file, sec):
         rg=rg.replace('{{'+s+'}}', tmp)
     return rg
 
+# Host key strategies: the host var naming each host
+HOST_KEYS = dict(name='name', private='private_ip', public='public_ip')
+
 VARFILE=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'all-variables.yml')
 RESOURCE_GROUP = get_resource_group(VARFILE,'common.rg')
 
+class HostStream(object):
+    # Write the --list JSON while the hosts are resolved: the hostvars one host at a time, then the groups
+
+    def __init__(self, out):
+        self.out = out
+        self.hosts = 0
+        self.out.write('{\n  "_meta": {\n    "hostvars": {')
+
+    def add(self, host_name, vars):
+        # json.dumps of a one item dict converts the host name like the former json.dumps of the whole inventory
+        self.out.write('{0}\n      {1}'.format(',' if self.hosts else '', json.dumps({host_name: vars})[1:-1]))
+        self.out.flush()
+        self.hosts += 1
+
+    def close(self, inventory):
+        self.out.write('\n    }\n  }')
+        for group in inventory:
+            if group != '_meta':
+                self.out.write(',\n  {0}: {1}'.format(json.dumps(group), json.dumps(inventory[group])))
+        self.out.write('\n}\n')
+        self.out.flush()
+
 class Inventory(object):
     def __init__(self):
         self.inventory = dict(_meta=dict(hostvars=dict()), azure=[])
+        self.host_index = dict()
+        self.collisions = []
+        self.hosts = []
         self.read_cli_args()
+        if self.args.cache_file:
+            if fresh_inventory_cache is None:
+                self.fail('--cache-file requires module_utils/azure_rm_inventory_cache.py')
+            # A fresh cache answers --list without any call to Azure
+            cache = fresh_inventory_cache(self.args.cache_file, self.args.cache_ttl, self.cache_query())
+            if cache is not None:
+                cache.write_json(sys.stdout)
+                cache.close()
+                return
         self.credentials = self.get_profile()
         self.subscription_id = self.credentials['subscription_id']
 
@@ -65,17 +113,40 @@ class Inventory(object):
                 client_id=self.credentials['client_id'],
                 secret=self.credentials['secret'],
                 tenant=self.credentials['tenant'])
-        self.network_client = NetworkManagementClient(self.azure_credentials,
-                                                      self.subscription_id)
-        self.compute_client = ComputeManagementClient(self.azure_credentials,
-                                                      self.subscription_id)
+        self.network_client = self.get_client('network', NetworkManagementClient)
+        self.compute_client = self.get_client('compute', ComputeManagementClient)
         self.vm_list = self.compute_client.virtual_machines.list(
                 self.args.rg)
+        self.output = HostStream(sys.stdout)
+        complete = False
         try:
             self.get_inventory(self.vm_list)
+            complete = True
         except Exception as exc:
             pass
-        print(json.dumps(self.inventory, indent=2))
+        self.output.close(self.inventory)
+        # Only a complete inventory is cached
+        if complete and self.args.cache_file:
+            # The inventory is already written, a cache failure must not fail it
+            try:
+                write_inventory_cache(self.args.cache_file, self.hosts, [group for group in self.inventory if group != '_meta'],
+                                      self.cache_query())
+            except (OSError, IOError, TypeError) as exc:
+                sys.stderr.write('Failed to write the inventory cache {0}: {1}\n'.format(self.args.cache_file, str(exc)))
+        for host_name, vm_name, other in self.collisions:
+            sys.stderr.write('Host key {0} of VM {1} is already used by VM {2}\n'.format(host_name, vm_name, other))
+
+    def cache_query(self):
+        # Arguments the inventory depends on, recorded in the cache so that it is not read back for other ones
+        return dict(script=os.path.basename(__file__), rg=self.args.rg, host_key=self.host_key, host_address=self.host_address)
+
+    def get_client(self, kind, client_class):
+        # Clients come from the shared client pool when it is available
+        def factory():
+            return client_class(self.azure_credentials, self.subscription_id)
+        if CLIENT_POOL is None:
+            return factory()
+        return CLIENT_POOL.get(kind, self.azure_credentials, self.subscription_id, factory)
 
     def _parse_ref_id(self, reference):
         response = {}
@@ -86,41 +157,68 @@ class Inventory(object):
         return response
 
     def _add_host(self, vars):
-        if self.args.public:
-            host_name = vars['public_ip']
-        else:
-            host_name = vars['private_ip']
-        self.inventory['_meta']['hostvars'][host_name] = vars
+        # The host is keyed by the first strategy of the chain with a value not used by an earlier host, by the VM
+        # id otherwise. host_index maps the keys in use to their VM, so that collisions are found in O(1).
+        host_name = None
+        for strategy in self.host_key:
+            key = vars[HOST_KEYS[strategy]]
+            if key is None:
+                continue
+            if key in self.host_index:
+                self.collisions.append((key, vars['name'], self.host_index[key]))
+                continue
+            host_name = key
+            break
+        if host_name is None:
+            host_name = vars['id']
+        address = next((vars[HOST_KEYS[s]] for s in self.host_address if vars[HOST_KEYS[s]]), None)
+        if address is not None and address != host_name:
+            vars['ansible_host'] = address
+        self.host_index[host_name] = vars['name']
+        self.output.add(host_name, vars)
+        if self.args.cache_file:
+            self.hosts.append((host_name, vars))
         self.inventory['azure'].append(host_name)
 
     def get_inventory(self, vmlist):
-        for vm in vmlist:
-            host_vars = dict(
-                location=vm.location,
-                name=vm.name,
-                id=vm.id,
-                tags=vm.tags,
-                public_ip=None,
-                private_ip=None
-            )
-            for interface in vm.network_profile.network_interfaces:
-                interface_reference = self._parse_ref_id(interface.id)
-                network_interface = self.network_client.network_interfaces.\
-                    get(interface_reference['resourceGroups'],
-                        interface_reference['networkInterfaces'])
-                if network_interface.primary:
-                    for ip_config in network_interface.ip_configurations:
-                        host_vars['private_ip'] = ip_config.private_ip_address
-                        if ip_config.public_ip_address:
-                            public_ip_reference = self._parse_ref_id(
-                                ip_config.public_ip_address.id)
-                            public_ip_address = self.network_client.\
-                                public_ip_addresses.get(
-                                    public_ip_reference['resourceGroups'],
-                                    public_ip_reference['publicIPAddresses'])
-                            host_vars['public_ip'] = public_ip_address.\
-                                ip_address
-            self._add_host(host_vars)
+        # The VMs are resolved by a pool of workers while the next pages of the list are fetched, the pool
+        # iterating over vmlist in its own thread, and each host is written as soon as it is resolved, in list order
+        pool = ThreadPool(self.args.workers)
+        try:
+            for host_vars in pool.imap(self.get_host_vars, vmlist):
+                if host_vars is not None:
+                    self._add_host(host_vars)
+        finally:
+            pool.terminate()
+
+    def get_host_vars(self, vm):
+        # Resolve the NICs and public IPs of a VM, in a worker thread
+        host_vars = dict(
+            location=vm.location,
+            name=vm.name,
+            id=vm.id,
+            tags=vm.tags,
+            public_ip=None,
+            private_ip=None
+        )
+        for interface in vm.network_profile.network_interfaces:
+            interface_reference = self._parse_ref_id(interface.id)
+            network_interface = self.network_client.network_interfaces.\
+                get(interface_reference['resourceGroups'],
+                    interface_reference['networkInterfaces'])
+            if network_interface.primary:
+                for ip_config in network_interface.ip_configurations:
+                    host_vars['private_ip'] = ip_config.private_ip_address
+                    if ip_config.public_ip_address:
+                        public_ip_reference = self._parse_ref_id(
+                            ip_config.public_ip_address.id)
+                        public_ip_address = self.network_client.\
+                            public_ip_addresses.get(
+                                public_ip_reference['resourceGroups'],
+                                public_ip_reference['publicIPAddresses'])
+                        host_vars['public_ip'] = public_ip_address.\
+                            ip_address
+        return host_vars
 
     # Empty inventory for testing.
     def empty_inventory(self):
@@ -138,7 +236,33 @@ class Inventory(object):
                             help='Resource Group: default='+RESOURCE_GROUP)
         parser.add_argument('--public', action='store_true',
                             help='Use public ip in inventory.')
+        parser.add_argument('--host-key', action='store',
+                            help='Comma separated chain of host key strategies among name, private and public, '
+                                 'the first one with an unused value naming the host: '
+                                 'default=private,name or public,private,name with --public')
+        parser.add_argument('--cache-file', action='store',
+                            help='Columnar inventory cache, written by a full run and read by the next runs while fresh')
+        parser.add_argument('--cache-ttl', action='store', type=int,
+                            default=300,
+                            help='Seconds the inventory cache stays fresh: default=300')
+        parser.add_argument('--workers', action='store', type=int,
+                            default=8,
+                            help='Number of VMs resolved concurrently: default=8')
         self.args = parser.parse_args()
+        if self.args.workers < 1:
+            parser.error('--workers must be at least 1')
+        if self.args.host_key:
+            self.host_key = [strategy.strip() for strategy in self.args.host_key.split(',')]
+        elif self.args.public:
+            self.host_key = ['public', 'private', 'name']
+        else:
+            self.host_key = ['private', 'name']
+        for strategy in self.host_key:
+            if strategy not in HOST_KEYS:
+                parser.error('unknown host key strategy {0}, expected one of {1}'.format(strategy, ', '.join(sorted(HOST_KEYS))))
+        # Address connected to by Ansible, set as ansible_host when the host is not keyed by it
+        self.host_address = [strategy for strategy in self.host_key if strategy != 'name'] or \
+            (['public', 'private'] if self.args.public else ['private'])
 
     def get_profile(self, profile="default"):
         credentials = dict()
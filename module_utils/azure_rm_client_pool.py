@@ -0,0 +1,118 @@
+# Copyright (c) 2018 Xiaoming Zheng, <xiaoming.zheng@icloud.com>
+#
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''
+Process wide pool of Azure SDK management clients, shared by the modules and the inventory scripts of this repo.
+
+A client is created once per kind of client, credentials and subscription, and its HTTP session is kept alive,
+with a connection pool large enough for the threads of the batch modes, instead of opening a new session and
+TLS connection for each request. Credentials without a client id, e.g. of a managed identity, are not pooled:
+each call creates a new client.
+
+The modules import it as ansible.module_utils.azure_rm_client_pool, so the module_utils directory must be on
+the module_utils path of Ansible, and fall back to their own clients otherwise.
+'''
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import threading
+
+try:
+    from requests.adapters import HTTPAdapter
+except ImportError:
+    HTTPAdapter = object
+
+DEFAULT_POOL_MAXSIZE = 32
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    # Adapter mounted by tune_client, to tell the sessions it already configured
+    pass
+
+
+class AzureClientPool(object):
+    # Clients by kind, credentials and subscription
+
+    def __init__(self, pool_maxsize=DEFAULT_POOL_MAXSIZE):
+        self.pool_maxsize = pool_maxsize
+        self.clients = dict()
+        self.lock = threading.Lock()
+
+    def get(self, kind, credentials, subscription_id, factory):
+        '''
+        Return the pooled client of this kind, e.g. network, for the credentials and the subscription.
+        factory is called without arguments to create the client the first time, or every time when the credentials
+        have no stable identity.
+        '''
+        identity = credentials_key(credentials)
+        if identity is None:
+            return tune_client(factory(), self.pool_maxsize)
+        key = (kind, identity, subscription_id)
+        with self.lock:
+            client = self.clients.get(key)
+            if client is None:
+                client = factory()
+                tune_client(client, self.pool_maxsize)
+                self.clients[key] = client
+        return client
+
+    def clear(self):
+        with self.lock:
+            self.clients.clear()
+
+
+def module_credentials(module):
+    '''
+    Credentials of an AzureRMModuleBase module: azure_credentials in the Ansible versions which set it on the module,
+    azure_auth.azure_credentials in the later ones.
+    '''
+    credentials = getattr(module, 'azure_credentials', None)
+    if credentials is None:
+        credentials = getattr(getattr(module, 'azure_auth', None), 'azure_credentials', None)
+    return credentials
+
+
+def credentials_key(credentials):
+    '''
+    Identity of credentials: their type, client id, tenant and user name. None when the credentials have no client id,
+    as the identity of the object itself may be reused by other credentials once it is garbage collected.
+    '''
+    client_id = getattr(credentials, 'id', None) or getattr(credentials, 'client_id', None)
+    if client_id is None:
+        return None
+    return type(credentials).__name__, client_id, getattr(credentials, 'tenant', None), getattr(credentials, 'username', None)
+
+
+def tune_client(client, pool_maxsize):
+    '''
+    Keep the HTTP session of an msrest based client alive between requests and size its connection pool, through the
+    keep_alive and session_configuration_callback settings of its configuration. The pooled adapter keeps the retries
+    of the retry_policy setting. Clients of msrest versions without these settings are left as they are.
+    '''
+    config = getattr(client, 'config', None)
+    if config is None:
+        return client
+    if hasattr(config, 'keep_alive'):
+        config.keep_alive = True
+    configure_session = getattr(config, 'session_configuration_callback', None)
+    if HTTPAdapter is object or configure_session is None or getattr(configure_session, 'pooled', False):
+        return client
+
+    def session_configuration_callback(session, global_config, local_config, **kwargs):
+        # Called before each request, the adapter is mounted once per session
+        if not isinstance(session.get_adapter('https://'), PooledHTTPAdapter):
+            retry_policy = getattr(global_config, 'retry_policy', None)
+            adapter = PooledHTTPAdapter(pool_connections=pool_maxsize, pool_maxsize=pool_maxsize,
+                                        max_retries=retry_policy() if retry_policy is not None else 0)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+        return configure_session(session, global_config, local_config, **kwargs)
+
+    session_configuration_callback.pooled = True
+    config.session_configuration_callback = session_configuration_callback
+    return client
+
+
+CLIENT_POOL = AzureClientPool()
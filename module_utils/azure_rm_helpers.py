@@ -0,0 +1,106 @@
+# Copyright (c) 2018 Xiaoming Zheng, <xiaoming.zheng@icloud.com>
+#
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''
+SDK call metrics and local cache files shared by the modules of this repo.
+
+The modules import it as ansible.module_utils.azure_rm_helpers, so the module_utils directory must be on the
+module_utils path of Ansible.
+'''
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+class CallMetrics(object):
+    # Count and time the SDK calls of a module run. summary is updated in place and returned as metrics.
+    # Calls may be recorded from worker threads.
+
+    def __init__(self):
+        self.summary = dict(calls=0, seconds=0.0, lro_wait_seconds=0.0, operations=dict())
+        self.lock = threading.Lock()
+
+    def call(self, operation, func, *args, **kwargs):
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.record(operation, time.time() - start)
+
+    def wait(self, operation, poller):
+        '''
+        Wait for a long running operation.
+        '''
+        start = time.time()
+        try:
+            return poller.wait()
+        finally:
+            elapsed = time.time() - start
+            with self.lock:
+                self.record_locked(operation + '.wait', elapsed)
+                self.summary['lro_wait_seconds'] = round(self.summary['lro_wait_seconds'] + elapsed, 3)
+
+    def record(self, operation, elapsed):
+        with self.lock:
+            self.record_locked(operation, elapsed)
+
+    def record_locked(self, operation, elapsed):
+        entry = self.summary['operations'].setdefault(operation, dict(count=0, seconds=0.0, max_seconds=0.0))
+        entry['count'] += 1
+        entry['seconds'] = round(entry['seconds'] + elapsed, 3)
+        entry['max_seconds'] = round(max(entry['max_seconds'], elapsed), 3)
+        self.summary['calls'] += 1
+        self.summary['seconds'] = round(self.summary['seconds'] + elapsed, 3)
+
+
+def cache_file_path(module_name, key):
+    '''
+    Path of the cache file of a module for a key, e.g. a resource id, in the temporary directory.
+    '''
+    return os.path.join(tempfile.gettempdir(), '{0}-{1}.json'.format(
+        module_name,
+        hashlib.sha1(key.lower().encode('utf-8')).hexdigest()
+    ))
+
+
+def read_cache_file(path, ttl=None):
+    '''
+    Load a cache file. Return None when it is missing, unreadable or older than ttl seconds.
+    '''
+    try:
+        with open(path, 'r') as f:
+            content = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    if ttl is not None and time.time() - content.get('timestamp', 0) > ttl:
+        return None
+    return content
+
+
+def write_cache_file(path, content):
+    '''
+    Write a cache file. Failures are ignored as the cache is only an optimization.
+    '''
+    tmp_path = '{0}.{1}'.format(path, os.getpid())
+    try:
+        with open(tmp_path, 'w') as f:
+            os.chmod(tmp_path, 0o600)
+            json.dump(content, f)
+        os.rename(tmp_path, path)
+    except (IOError, OSError):
+        remove_cache_file(tmp_path)
+
+
+def remove_cache_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,273 @@
+# Copyright (c) 2018 Xiaoming Zheng, <xiaoming.zheng@icloud.com>
+#
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+'''
+Compact columnar cache of the inventory of the inventory scripts of this repo, read through mmap.
+
+Each host var is a column of string indices, a dict host var like tags is split in one column per key, e.g.
+tags.env, and the strings are stored once, sorted. Reading a value, finding a host or selecting the hosts with a
+tag value only touches the mapped pages involved, instead of parsing the whole --list JSON:
+
+    cache = InventoryCache('/tmp/inventory.cache')
+    cache.hostvars('10.0.0.4')
+    cache.select('tags.env', 'dev')
+    cache.write_json(sys.stdout)
+
+File layout, little endian unsigned 32 bit integers:
+
+    magic, rows, strings, length of the JSON header
+    JSON header: columns, groups, query
+    string offsets (strings + 1), string data (UTF-8)
+    one array of string indices per column (rows each), or MISSING, NONE or DICT when the host var is missing,
+    None or a dict whose items are in the columns of its keys
+    rows in host name order
+
+query holds the arguments the inventory was built with, e.g. the resource group, so that a cache written for
+other arguments is not read back.
+'''
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import json
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+try:
+    string_types = (str, unicode)
+except NameError:
+    string_types = (str,)
+
+MAGIC = b'AZINVC01'
+HEADER = struct.Struct('<8sIII')
+CELL = struct.Struct('<I')
+MISSING = 0xFFFFFFFF
+NONE = 0xFFFFFFFE
+DICT = 0xFFFFFFFD
+HOST_COLUMN = '_host'
+
+
+def pad(length):
+    return (4 - length % 4) % 4
+
+
+def write_inventory_cache(path, hosts, groups, query=None):
+    '''
+    Write the cache of the hosts, a list of (host name, host vars) in inventory order, atomically.
+    groups is a list of the groups of the inventory, each holding all the hosts. query is a dict of the arguments
+    the inventory was built with. Host vars must be strings, None or dicts of strings, TypeError is raised otherwise.
+    '''
+    columns = [HOST_COLUMN]
+    positions = {HOST_COLUMN: 0}
+    cells = []
+    strings = set()
+    dicts = set()
+    for host_name, host_vars in hosts:
+        # The column of a dict host var comes before the columns of its keys
+        items = [(HOST_COLUMN, host_name)]
+        for key, value in host_vars.items():
+            if isinstance(value, dict):
+                items.append((key, None))
+                dicts.add((len(cells), key))
+                items.extend(('{0}.{1}'.format(key, item), item_value) for item, item_value in value.items())
+            else:
+                items.append((key, value))
+        for key, value in items:
+            if key not in positions:
+                positions[key] = len(columns)
+                columns.append(key)
+            if value is not None:
+                if not isinstance(value, string_types):
+                    raise TypeError('Host var {0} of {1} is not a string'.format(key, host_name))
+                strings.add(value)
+        cells.append(dict(items))
+
+    strings = sorted(strings)
+    index = dict((value, position) for position, value in enumerate(strings))
+    data = [value.encode('utf-8') for value in strings]
+    offsets = [0]
+    for value in data:
+        offsets.append(offsets[-1] + len(value))
+    header = json.dumps(dict(columns=columns, groups=groups, query=query or dict()), separators=(',', ':')).encode('utf-8')
+
+    def cell(number, row, column):
+        if column not in row:
+            return MISSING
+        if (number, column) in dicts:
+            return DICT
+        if row[column] is None:
+            return NONE
+        return index[row[column]]
+
+    hosts_column = [index[row[HOST_COLUMN]] for row in cells]
+    order = sorted(range(len(cells)), key=hosts_column.__getitem__)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp = tempfile.mkstemp(dir=directory, prefix='.inventory-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(cells), len(strings), len(header)))
+            f.write(header + b' ' * pad(len(header)))
+            f.write(struct.pack('<{0}I'.format(len(offsets)), *offsets))
+            f.write(b''.join(data) + b'\0' * pad(offsets[-1]))
+            for column in columns:
+                f.write(struct.pack('<{0}I'.format(len(cells)), *[cell(number, row, column) for number, row in enumerate(cells)]))
+            f.write(struct.pack('<{0}I'.format(len(order)), *order))
+        os.rename(temp, path)
+    except Exception:
+        os.remove(temp)
+        raise
+
+
+class InventoryCache(object):
+    # Reader of an inventory cache file
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, self.rows, strings, length = HEADER.unpack_from(self.map, 0)
+            if magic != MAGIC:
+                raise ValueError('{0} is not an inventory cache'.format(path))
+            position = HEADER.size
+            header = json.loads(self.map[position:position + length].decode('utf-8'))
+        except Exception:
+            self.map.close()
+            raise
+        self.columns = header['columns']
+        self.groups = header['groups']
+        self.query = header.get('query') or dict()
+        self.positions = dict((column, number) for number, column in enumerate(self.columns))
+        position += length + pad(length)
+        self.strings = strings
+        self.offsets = position
+        position += 4 * (strings + 1)
+        self.data = position
+        position += self.offset(strings) + pad(self.offset(strings))
+        self.cells = position
+        position += 4 * self.rows * len(self.columns)
+        self.order = position
+
+    def __len__(self):
+        return self.rows
+
+    def offset(self, number):
+        return CELL.unpack_from(self.map, self.offsets + 4 * number)[0]
+
+    def string(self, number):
+        return self.map[self.data + self.offset(number):self.data + self.offset(number + 1)].decode('utf-8')
+
+    def string_index(self, value):
+        # Binary search of the sorted strings
+        low, high = 0, self.strings
+        while low < high:
+            middle = (low + high) // 2
+            if self.string(middle) < value:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.strings and self.string(low) == value:
+            return low
+        return None
+
+    def cell(self, row, column):
+        return CELL.unpack_from(self.map, self.cells + 4 * (self.positions[column] * self.rows + row))[0]
+
+    def ordered_row(self, number):
+        return CELL.unpack_from(self.map, self.order + 4 * number)[0]
+
+    def value(self, row, column):
+        number = self.cell(row, column) if column in self.positions else MISSING
+        if number >= DICT:
+            return None
+        return self.string(number)
+
+    def column(self, column):
+        return [self.value(row, column) for row in range(self.rows)]
+
+    def find(self, host_name):
+        '''
+        Row of a host, None when the host is not in the cache.
+        '''
+        number = self.string_index(host_name)
+        if number is None:
+            return None
+        low, high = 0, self.rows
+        while low < high:
+            middle = (low + high) // 2
+            if self.cell(self.ordered_row(middle), HOST_COLUMN) < number:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.rows and self.cell(self.ordered_row(low), HOST_COLUMN) == number:
+            return self.ordered_row(low)
+        return None
+
+    def select(self, column, value):
+        '''
+        Names of the hosts whose host var column, e.g. location or tags.env, is value, in inventory order.
+        '''
+        number = self.string_index(value) if column in self.positions else None
+        if number is None:
+            return []
+        cells = struct.unpack_from('<{0}I'.format(self.rows), self.map, self.cells + 4 * self.positions[column] * self.rows)
+        return [self.value(row, HOST_COLUMN) for row in range(self.rows) if cells[row] == number]
+
+    def row(self, row):
+        '''
+        Host vars of a row, as written.
+        '''
+        host_vars = dict()
+        for column in self.columns[1:]:
+            number = self.cell(row, column)
+            if number == MISSING:
+                continue
+            key, dot, item = column.partition('.')
+            if number == DICT:
+                host_vars[column] = dict()
+            elif dot and isinstance(host_vars.get(key), dict):
+                host_vars[key][item] = None if number == NONE else self.string(number)
+            elif not dot:
+                host_vars[key] = None if number == NONE else self.string(number)
+        return host_vars
+
+    def hostvars(self, host_name):
+        row = self.find(host_name)
+        return None if row is None else self.row(row)
+
+    def to_inventory(self):
+        '''
+        The --list inventory of the cache.
+        '''
+        hosts = self.column(HOST_COLUMN)
+        inventory = dict(_meta=dict(hostvars=dict((hosts[row], self.row(row)) for row in range(self.rows))))
+        for group in self.groups:
+            inventory[group] = list(hosts)
+        return inventory
+
+    def write_json(self, out):
+        json.dump(self.to_inventory(), out, indent=2)
+        out.write('\n')
+
+    def close(self):
+        self.map.close()
+
+
+def fresh_inventory_cache(path, ttl, query=None):
+    '''
+    Reader of the cache at path when it was written less than ttl seconds ago for the same query, None otherwise.
+    '''
+    try:
+        if time.time() - os.path.getmtime(path) >= ttl:
+            return None
+        cache = InventoryCache(path)
+    except (OSError, IOError, ValueError):
+        return None
+    if cache.query != (query or dict()):
+        cache.close()
+        return None
+    return cache